@@ -8,9 +8,8 @@
 # pbkdf2.py Copyright © 2009 Daniel Holth <dholth@fastmail.fm>
 # pbkdf2.py This code may be freely used and modified for any purpose.
 
-import sys
 import hmac
-from struct import pack
+from struct import pack, unpack
 import hashlib
 import aescbc
 
@@ -19,47 +18,89 @@ class Pukall_Cipher(object):
         self.key = None
 
     def PC1(self, key, src, decryption=True):
-        sum1 = 0;
-        sum2 = 0;
-        keyXorVal = 0;
         if len(key)!=16:
             raise Exception("PC1: Bad key length")
-        wkey = []
-        for i in range(8):
-            if sys.version_info[0] == 2:
-                wkey.append(ord(key[i*2])<<8 | ord(key[i*2+1]))
-            else: 
-                wkey.append(key[i*2]<<8 | key[i*2+1])
+        # the eight key words live in locals and the inner key loop is
+        # unrolled, which avoids all list indexing in the per-byte loop
+        w0, w1, w2, w3, w4, w5, w6, w7 = unpack('>8H', key)
+        sum1 = 0
+        sum2 = 0
+        src = bytearray(src)
         dst = bytearray(len(src))
-        for i in range(len(src)):
-            temp1 = 0;
-            byteXorVal = 0;
-            for j in range(8):
-                temp1 ^= wkey[j]
-                sum2  = (sum2+j)*20021 + sum1
-                sum1  = (temp1*346)&0xFFFF
-                sum2  = (sum2+sum1)&0xFFFF
-                temp1 = (temp1*20021+1)&0xFFFF
-                byteXorVal ^= temp1 ^ sum2
-
-            if sys.version_info[0] == 2:
-                curByte = ord(src[i])
-            else:
-                curByte = src[i]
+        for i, curByte in enumerate(src):
+            temp1 = w0
+            sum2  = sum2*20021 + sum1
+            sum1  = (temp1*346)&0xFFFF
+            sum2  = (sum2+sum1)&0xFFFF
+            temp1 = (temp1*20021+1)&0xFFFF
+            byteXorVal = temp1 ^ sum2
+
+            temp1 ^= w1
+            sum2  = (sum2+1)*20021 + sum1
+            sum1  = (temp1*346)&0xFFFF
+            sum2  = (sum2+sum1)&0xFFFF
+            temp1 = (temp1*20021+1)&0xFFFF
+            byteXorVal ^= temp1 ^ sum2
+
+            temp1 ^= w2
+            sum2  = (sum2+2)*20021 + sum1
+            sum1  = (temp1*346)&0xFFFF
+            sum2  = (sum2+sum1)&0xFFFF
+            temp1 = (temp1*20021+1)&0xFFFF
+            byteXorVal ^= temp1 ^ sum2
+
+            temp1 ^= w3
+            sum2  = (sum2+3)*20021 + sum1
+            sum1  = (temp1*346)&0xFFFF
+            sum2  = (sum2+sum1)&0xFFFF
+            temp1 = (temp1*20021+1)&0xFFFF
+            byteXorVal ^= temp1 ^ sum2
+
+            temp1 ^= w4
+            sum2  = (sum2+4)*20021 + sum1
+            sum1  = (temp1*346)&0xFFFF
+            sum2  = (sum2+sum1)&0xFFFF
+            temp1 = (temp1*20021+1)&0xFFFF
+            byteXorVal ^= temp1 ^ sum2
+
+            temp1 ^= w5
+            sum2  = (sum2+5)*20021 + sum1
+            sum1  = (temp1*346)&0xFFFF
+            sum2  = (sum2+sum1)&0xFFFF
+            temp1 = (temp1*20021+1)&0xFFFF
+            byteXorVal ^= temp1 ^ sum2
+
+            temp1 ^= w6
+            sum2  = (sum2+6)*20021 + sum1
+            sum1  = (temp1*346)&0xFFFF
+            sum2  = (sum2+sum1)&0xFFFF
+            temp1 = (temp1*20021+1)&0xFFFF
+            byteXorVal ^= temp1 ^ sum2
+
+            temp1 ^= w7
+            sum2  = (sum2+7)*20021 + sum1
+            sum1  = (temp1*346)&0xFFFF
+            sum2  = (sum2+sum1)&0xFFFF
+            temp1 = (temp1*20021+1)&0xFFFF
+            byteXorVal ^= temp1 ^ sum2
 
-            if not decryption:
-                keyXorVal = curByte * 257;
-            curByte = ((curByte ^ (byteXorVal >> 8)) ^ byteXorVal) & 0xFF
             if decryption:
-                keyXorVal = curByte * 257;
-            for j in range(8):
-                wkey[j] ^= keyXorVal;
-            
-            if sys.version_info[0] == 2:
-                dst[i] = chr(curByte)
-            else: 
-                dst[i] = curByte
-                
+                curByte = ((curByte ^ (byteXorVal >> 8)) ^ byteXorVal) & 0xFF
+                keyXorVal = curByte * 257
+            else:
+                keyXorVal = curByte * 257
+                curByte = ((curByte ^ (byteXorVal >> 8)) ^ byteXorVal) & 0xFF
+            w0 ^= keyXorVal
+            w1 ^= keyXorVal
+            w2 ^= keyXorVal
+            w3 ^= keyXorVal
+            w4 ^= keyXorVal
+            w5 ^= keyXorVal
+            w6 ^= keyXorVal
+            w7 ^= keyXorVal
+
+            dst[i] = curByte
+
         return bytes(dst)
 
 class Topaz_Cipher(object):
@@ -12,6 +12,8 @@ import sys
 import csv
 import os
 import getopt
+import pickle
+import concurrent.futures
 from struct import pack
 from struct import unpack
 
@@ -30,6 +32,9 @@ import stylexml2css
 # global switch
 buildXML = False
 
+# Below this many pages starting worker processes costs more than it saves
+PARALLEL_MIN_PAGES = 16
+
 # Get a 7 bit encoded number from a file
 def readEncodedNumber(file):
     flag = False
@@ -202,9 +207,11 @@ class GParser(object):
         maxw = (self.gw[gly] * self.dpi) / self.gdpi[gly]
         return maxh, maxw
     def getPath(self, gly):
-        path = ''
         if (gly < 0) or (gly >= self.count):
-            return path
+            return ''
+        plst = []
+        dpi = self.dpi
+        gdpi = self.gdpi[gly]
         tx = self.vx[self.gvtx[gly]:self.gvtx[gly+1]]
         ty = self.vy[self.gvtx[gly]:self.gvtx[gly+1]]
         p = 0
@@ -217,25 +224,26 @@ class GParser(object):
                 zy = ty[self.vlen[k-1]+1:self.vlen[k]+1]
             p += 1
             j = 0
-            while ( j  < len(zx) ):
+            zlen = len(zx)
+            while ( j  < zlen ):
                 if (j == 0):
                     # Start Position.
-                    path += 'M %d %d ' % (zx[j] * self.dpi / self.gdpi[gly], zy[j] * self.dpi / self.gdpi[gly])
-                elif (j <= len(zx)-3):
+                    plst.append('M %d %d ' % (zx[j] * dpi / gdpi, zy[j] * dpi / gdpi))
+                elif (j <= zlen-3):
                     # Cubic Bezier Curve
-                    path += 'C %d %d %d %d %d %d ' % (zx[j] * self.dpi / self.gdpi[gly], zy[j] * self.dpi / self.gdpi[gly], zx[j+1] * self.dpi / self.gdpi[gly], zy[j+1] * self.dpi / self.gdpi[gly], zx[j+2] * self.dpi / self.gdpi[gly], zy[j+2] * self.dpi / self.gdpi[gly])
+                    plst.append('C %d %d %d %d %d %d ' % (zx[j] * dpi / gdpi, zy[j] * dpi / gdpi, zx[j+1] * dpi / gdpi, zy[j+1] * dpi / gdpi, zx[j+2] * dpi / gdpi, zy[j+2] * dpi / gdpi))
                     j += 2
-                elif (j == len(zx)-2):
+                elif (j == zlen-2):
                     # Cubic Bezier Curve to Start Position
-                    path += 'C %d %d %d %d %d %d ' % (zx[j] * self.dpi / self.gdpi[gly], zy[j] * self.dpi / self.gdpi[gly], zx[j+1] * self.dpi / self.gdpi[gly], zy[j+1] * self.dpi / self.gdpi[gly], zx[0] * self.dpi / self.gdpi[gly], zy[0] * self.dpi / self.gdpi[gly])
+                    plst.append('C %d %d %d %d %d %d ' % (zx[j] * dpi / gdpi, zy[j] * dpi / gdpi, zx[j+1] * dpi / gdpi, zy[j+1] * dpi / gdpi, zx[0] * dpi / gdpi, zy[0] * dpi / gdpi))
                     j += 1
-                elif (j == len(zx)-1):
+                elif (j == zlen-1):
                     # Quadratic Bezier Curve to Start Position
-                    path += 'Q %d %d %d %d ' % (zx[j] * self.dpi / self.gdpi[gly], zy[j] * self.dpi / self.gdpi[gly], zx[0] * self.dpi / self.gdpi[gly], zy[0] * self.dpi / self.gdpi[gly])
+                    plst.append('Q %d %d %d %d ' % (zx[j] * dpi / gdpi, zy[j] * dpi / gdpi, zx[0] * dpi / gdpi, zy[0] * dpi / gdpi))
 
                 j += 1
-        path += 'z'
-        return path
+        plst.append('z')
+        return "".join(plst)
 
 
 
@@ -253,6 +261,83 @@ class GlyphDict(object):
         self.gdict[id] = path
 
 
+# Renders single pages. Pages only depend on the dictionary, the css
+# classes and the glyph paths, which are all built once per book, so
+# they can be rendered by worker processes and assembled in order.
+class PageRenderer(object):
+    def __init__(self, dict, bookDir, classlst, gd, fixedimage, meta_array, raw, scaledpi, buildxml):
+        self.dict = dict
+        self.bookDir = bookDir
+        self.classlst = classlst
+        self.gd = gd
+        self.fixedimage = fixedimage
+        self.meta_array = meta_array
+        self.raw = raw
+        self.scaledpi = scaledpi
+        self.buildxml = buildxml
+        self.svgDir = os.path.join(bookDir,'svg')
+        self.xmlDir = os.path.join(bookDir,'xml')
+
+    def renderHTML(self, fname):
+        flat_xml = convert2xml.fromData(self.dict, fname)
+        if self.buildxml:
+            xname = os.path.join(self.xmlDir, os.path.basename(fname).replace('.dat','.xml'))
+            open(xname, 'wb').write(convert2xml.getXML(self.dict, fname))
+        pagehtml, tocinfo = flatxml2html.convert2HTML(flat_xml, self.classlst, fname, self.bookDir, self.gd, self.fixedimage)
+        return flat_xml, pagehtml, tocinfo
+
+    def renderSVG(self, pageid, previd, nextid, flat_svg):
+        svgxml = flatxml2svg.convert2SVG(self.gd, flat_svg, pageid, previd, nextid, self.svgDir, self.raw, self.meta_array, self.scaledpi)
+        if (self.raw) :
+            pfile = open(os.path.join(self.svgDir,'page%04d.svg' % pageid),'w')
+        else :
+            pfile = open(os.path.join(self.svgDir,'page%04d.xhtml' % pageid), 'w')
+        pfile.write(svgxml)
+        pfile.close()
+
+
+# the renderer of a worker process, the dictionary file is parsed again
+# there as the open Dictionary can not be pickled
+_renderer = None
+
+def _initRenderer(dictFile, *args):
+    global _renderer
+    _renderer = PageRenderer(Dictionary(dictFile), *args)
+
+def _renderPage(method, args):
+    return getattr(_renderer, method)(*args)
+
+# Returns a process pool for rendering pages, or None if it is not worth it
+def getPagePool(numpages, dictFile, renderer):
+    workers = min(os.cpu_count() or 1, numpages)
+    if workers < 2 or numpages < PARALLEL_MIN_PAGES:
+        return None
+    initargs = (dictFile, renderer.bookDir, renderer.classlst, renderer.gd, renderer.fixedimage,
+                renderer.meta_array, renderer.raw, renderer.scaledpi, renderer.buildxml)
+    try:
+        return concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_initRenderer, initargs=initargs)
+    except (OSError, RuntimeError, ImportError) as e:
+        print("Parallel page rendering unavailable ({0}), rendering in-process.".format(e))
+        return None
+
+# Yields the results of renderer.method(*args) for each args in argslist,
+# in order, rendered by the pool if there is one.
+def renderPages(pool, renderer, method, argslist):
+    done = 0
+    if pool is not None:
+        chunksize = max(1, len(argslist) // ((os.cpu_count() or 1) * 4))
+        try:
+            for result in pool.map(_renderPage, [method] * len(argslist), argslist, chunksize=chunksize):
+                done += 1
+                yield result
+            return
+        except (OSError, RuntimeError, ImportError, pickle.PicklingError) as e:
+            # no usable process pool here (frozen build, calibre, sandbox, ...)
+            print("Parallel page rendering unavailable ({0}), rendering in-process.".format(e))
+    for args in argslist[done:]:
+        yield getattr(renderer, method)(*args)
+
+
 def generateBook(bookDir, raw, fixedimage):
     # sanity check Topaz file extraction
     if not os.path.exists(bookDir) :
@@ -481,124 +566,125 @@ def generateBook(bookDir, raw, fixedimage):
     xmllst = []
     elst = []
 
-    for filename in filenames:
-        # print '     ', filename
-        print(".", end=' ')
-        fname = os.path.join(pageDir,filename)
-        flat_xml = convert2xml.fromData(dict, fname)
-
-        # keep flat_xml for later svg processing
-        xmllst.append(flat_xml)
-
-        if buildXML:
-            xname = os.path.join(xmlDir, filename.replace('.dat','.xml'))
-            open(xname, 'wb').write(convert2xml.getXML(dict, fname))
-
-        # first get the html
-        pagehtml, tocinfo = flatxml2html.convert2HTML(flat_xml, classlst, fname, bookDir, gd, fixedimage)
-        elst.append(tocinfo)
-        hlst.append(pagehtml)
-
-    # finish up the html string and output it
-    hlst.append('</body>\n</html>\n')
-    htmlstr = "".join(hlst)
-    hlst = None
-    open(os.path.join(bookDir, htmlFileName), 'w').write(htmlstr)
-
-    print(" ")
-    print('Extracting Table of Contents from Amazon OCR')
-
-    # first create a table of contents file for the svg images
-    tlst = []
-    tlst.append('<?xml version="1.0" encoding="utf-8"?>\n')
-    tlst.append('<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">\n')
-    tlst.append('<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" >')
-    tlst.append('<head>\n')
-    tlst.append('<title>' + meta_array['Title'] + '</title>\n')
-    tlst.append('<meta name="Author" content="' + meta_array['Authors'] + '" />\n')
-    tlst.append('<meta name="Title" content="' + meta_array['Title'] + '" />\n')
-    if 'ASIN' in meta_array:
-        tlst.append('<meta name="ASIN" content="' + meta_array['ASIN'] + '" />\n')
-    if 'GUID' in meta_array:
-        tlst.append('<meta name="GUID" content="' + meta_array['GUID'] + '" />\n')
-    tlst.append('</head>\n')
-    tlst.append('<body>\n')
-
-    tlst.append('<h2>Table of Contents</h2>\n')
-    start = pageidnums[0]
-    if (raw):
-        startname = 'page%04d.svg' % start
-    else:
-        startname = 'page%04d.xhtml' % start
-
-    tlst.append('<h3><a href="' + startname + '">Start of Book</a></h3>\n')
-    # build up a table of contents for the svg xhtml output
-    tocentries = "".join(elst)
-    elst = None
-    toclst = tocentries.split('\n')
-    toclst.pop()
-    for entry in toclst:
-        print(entry)
-        title, pagenum = entry.split('|')
-        id = pageidnums[int(pagenum)]
+    # the pages are rendered by worker processes when that pays off
+    renderer = PageRenderer(dict, bookDir, classlst, gd, fixedimage, meta_array, raw, scaledpi, buildXML)
+    pool = getPagePool(numfiles, dictFile, renderer)
+    try:
+        fnames = [(os.path.join(pageDir,filename),) for filename in filenames]
+        for flat_xml, pagehtml, tocinfo in renderPages(pool, renderer, 'renderHTML', fnames):
+            # print '     ', filename
+            print(".", end=' ')
+
+            # keep flat_xml for later svg processing
+            xmllst.append(flat_xml)
+
+            # first get the html
+            elst.append(tocinfo)
+            hlst.append(pagehtml)
+
+        # finish up the html string and output it
+        hlst.append('</body>\n</html>\n')
+        htmlstr = "".join(hlst)
+        hlst = None
+        open(os.path.join(bookDir, htmlFileName), 'w').write(htmlstr)
+
+        print(" ")
+        print('Extracting Table of Contents from Amazon OCR')
+
+        # first create a table of contents file for the svg images
+        tlst = []
+        tlst.append('<?xml version="1.0" encoding="utf-8"?>\n')
+        tlst.append('<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">\n')
+        tlst.append('<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" >')
+        tlst.append('<head>\n')
+        tlst.append('<title>' + meta_array['Title'] + '</title>\n')
+        tlst.append('<meta name="Author" content="' + meta_array['Authors'] + '" />\n')
+        tlst.append('<meta name="Title" content="' + meta_array['Title'] + '" />\n')
+        if 'ASIN' in meta_array:
+            tlst.append('<meta name="ASIN" content="' + meta_array['ASIN'] + '" />\n')
+        if 'GUID' in meta_array:
+            tlst.append('<meta name="GUID" content="' + meta_array['GUID'] + '" />\n')
+        tlst.append('</head>\n')
+        tlst.append('<body>\n')
+
+        tlst.append('<h2>Table of Contents</h2>\n')
+        start = pageidnums[0]
         if (raw):
-            fname = 'page%04d.svg' % id
+            startname = 'page%04d.svg' % start
         else:
-            fname = 'page%04d.xhtml' % id
-        tlst.append('<h3><a href="'+ fname + '">' + title + '</a></h3>\n')
-    tlst.append('</body>\n')
-    tlst.append('</html>\n')
-    tochtml = "".join(tlst)
-    open(os.path.join(svgDir, 'toc.xhtml'), 'w').write(tochtml)
-
-
-    # now create index_svg.xhtml that points to all required files
-    slst = []
-    slst.append('<?xml version="1.0" encoding="utf-8"?>\n')
-    slst.append('<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">\n')
-    slst.append('<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" >')
-    slst.append('<head>\n')
-    slst.append('<title>' + meta_array['Title'] + '</title>\n')
-    slst.append('<meta name="Author" content="' + meta_array['Authors'] + '" />\n')
-    slst.append('<meta name="Title" content="' + meta_array['Title'] + '" />\n')
-    if 'ASIN' in meta_array:
-        slst.append('<meta name="ASIN" content="' + meta_array['ASIN'] + '" />\n')
-    if 'GUID' in meta_array:
-        slst.append('<meta name="GUID" content="' + meta_array['GUID'] + '" />\n')
-    slst.append('</head>\n')
-    slst.append('<body>\n')
-
-    print("Building svg images of each book page")
-    slst.append('<h2>List of Pages</h2>\n')
-    slst.append('<div>\n')
-    idlst = sorted(pageIDMap.keys())
-    numids = len(idlst)
-    cnt = len(idlst)
-    previd = None
-    for j in range(cnt):
-        pageid = idlst[j]
-        if j < cnt - 1:
-            nextid = idlst[j+1]
-        else:
-            nextid = None
-        print('.', end=' ')
-        pagelst = pageIDMap[pageid]
-        flst = []
-        for page in pagelst:
-            flst.append(xmllst[page])
-        flat_svg = b"".join(flst)
-        flst=None
-        svgxml = flatxml2svg.convert2SVG(gd, flat_svg, pageid, previd, nextid, svgDir, raw, meta_array, scaledpi)
-        if (raw) :
-            pfile = open(os.path.join(svgDir,'page%04d.svg' % pageid),'w')
-            slst.append('<a href="svg/page%04d.svg">Page %d</a>\n' % (pageid, pageid))
-        else :
-            pfile = open(os.path.join(svgDir,'page%04d.xhtml' % pageid), 'w')
-            slst.append('<a href="svg/page%04d.xhtml">Page %d</a>\n' % (pageid, pageid))
-        previd = pageid
-        pfile.write(svgxml)
-        pfile.close()
-        counter += 1
+            startname = 'page%04d.xhtml' % start
+
+        tlst.append('<h3><a href="' + startname + '">Start of Book</a></h3>\n')
+        # build up a table of contents for the svg xhtml output
+        tocentries = "".join(elst)
+        elst = None
+        toclst = tocentries.split('\n')
+        toclst.pop()
+        for entry in toclst:
+            print(entry)
+            title, pagenum = entry.split('|')
+            id = pageidnums[int(pagenum)]
+            if (raw):
+                fname = 'page%04d.svg' % id
+            else:
+                fname = 'page%04d.xhtml' % id
+            tlst.append('<h3><a href="'+ fname + '">' + title + '</a></h3>\n')
+        tlst.append('</body>\n')
+        tlst.append('</html>\n')
+        tochtml = "".join(tlst)
+        open(os.path.join(svgDir, 'toc.xhtml'), 'w').write(tochtml)
+
+
+        # now create index_svg.xhtml that points to all required files
+        slst = []
+        slst.append('<?xml version="1.0" encoding="utf-8"?>\n')
+        slst.append('<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">\n')
+        slst.append('<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" >')
+        slst.append('<head>\n')
+        slst.append('<title>' + meta_array['Title'] + '</title>\n')
+        slst.append('<meta name="Author" content="' + meta_array['Authors'] + '" />\n')
+        slst.append('<meta name="Title" content="' + meta_array['Title'] + '" />\n')
+        if 'ASIN' in meta_array:
+            slst.append('<meta name="ASIN" content="' + meta_array['ASIN'] + '" />\n')
+        if 'GUID' in meta_array:
+            slst.append('<meta name="GUID" content="' + meta_array['GUID'] + '" />\n')
+        slst.append('</head>\n')
+        slst.append('<body>\n')
+
+        print("Building svg images of each book page")
+        slst.append('<h2>List of Pages</h2>\n')
+        slst.append('<div>\n')
+        idlst = sorted(pageIDMap.keys())
+        numids = len(idlst)
+        cnt = len(idlst)
+        previd = None
+        svgargs = []
+        for j in range(cnt):
+            pageid = idlst[j]
+            if j < cnt - 1:
+                nextid = idlst[j+1]
+            else:
+                nextid = None
+            pagelst = pageIDMap[pageid]
+            flst = []
+            for page in pagelst:
+                flst.append(xmllst[page])
+            flat_svg = b"".join(flst)
+            flst=None
+            svgargs.append((pageid, previd, nextid, flat_svg))
+            if (raw) :
+                slst.append('<a href="svg/page%04d.svg">Page %d</a>\n' % (pageid, pageid))
+            else :
+                slst.append('<a href="svg/page%04d.xhtml">Page %d</a>\n' % (pageid, pageid))
+            previd = pageid
+        xmllst = None
+        for _ in renderPages(pool, renderer, 'renderSVG', svgargs):
+            print('.', end=' ')
+        svgargs = None
+    finally:
+        # do not leave worker processes behind if rendering fails
+        if pool is not None:
+            pool.shutdown()
     slst.append('</div>\n')
     slst.append('<h2><a href="svg/toc.xhtml">Table of Contents</a></h2>\n')
     slst.append('</body>\n</html>\n')
@@ -12,21 +12,22 @@ Revision history:
   1.3   - Fixed lzma support for calibre 4.6+
   2.0   - VoucherEnvelope v2/v3 support by apprenticesakuya.
   3.0   - Added Python 3 compatibility for calibre 5.0
+  3.1   - Decrypt and decompress DRMION pages concurrently
+  3.2   - BinaryIonParser works on a memoryview instead of a stream
 
 Copyright © 2013-2020 Apprentice Harper et al.
 """
 
 import collections
+import concurrent.futures
 import hashlib
 import hmac
 import os
 import os.path
 import struct
 
-from io import BytesIO
-
 __license__ = 'GPL v3'
-__version__ = '3.0'
+__version__ = '3.2'
 
 #@@CALIBRE_COMPAT_CODE@@
 
@@ -195,12 +196,22 @@ class BinaryIonParser(object):
     value = None
     didimports = False
 
+    # stream may be bytes-like or a BytesIO positioned at the start of the
+    # data; either way the parser reads through a memoryview without copying
     def __init__(self, stream):
         self.annotations = []
         self.catalog = []
 
-        self.stream = stream
-        self.initpos = stream.tell()
+        if isinstance(stream, (bytes, bytearray, memoryview)):
+            self.buf = memoryview(stream).cast("B")
+            self.initpos = 0
+        elif hasattr(stream, "getbuffer"):
+            self.buf = stream.getbuffer()
+            self.initpos = stream.tell()
+        else:
+            self.buf = memoryview(stream.read())
+            self.initpos = 0
+        self.buflen = len(self.buf)
         self.reset()
         self.symbols = SymbolTable()
 
@@ -211,7 +222,7 @@ class BinaryIonParser(object):
         self.eof = False
         self.isinstruct = False
         self.containerstack = []
-        self.stream.seek(self.initpos)
+        self.pos = self.initpos
 
     def addtocatalog(self, name, version, symbols):
         self.catalog.append(IonCatalogItem(name, version, symbols))
@@ -292,7 +303,7 @@ class BinaryIonParser(object):
             nextrem -= self.valuelen
             if nextrem < 0:
                 nextrem = 0
-        self.push(self.parenttid, self.stream.tell() + self.valuelen, nextrem)
+        self.push(self.parenttid, self.pos + self.valuelen, nextrem)
 
         self.isinstruct = (self.valuetid == TID_STRUCT)
         if self.isinstruct:
@@ -319,7 +330,7 @@ class BinaryIonParser(object):
         self.needhasnext = True
 
         self.clearvalue()
-        curpos = self.stream.tell()
+        curpos = self.pos
         if rec.nextpos > curpos:
             self.skip(rec.nextpos - curpos)
         else:
@@ -327,15 +338,17 @@ class BinaryIonParser(object):
 
         self.localremaining = rec.remaining
 
+    # returns a view into the buffer, which may be short at the end of the data
     def read(self, count=1):
         if self.localremaining != -1:
             self.localremaining -= count
             _assert(self.localremaining >= 0)
 
-        result = self.stream.read(count)
-        if len(result) == 0:
+        pos = self.pos
+        if pos >= self.buflen:
             raise EOFError()
-        return result
+        self.pos = min(pos + count, self.buflen)
+        return self.buf[pos:self.pos]
 
     def readfieldid(self):
         if self.localremaining != -1 and self.localremaining < 1:
@@ -352,10 +365,11 @@ class BinaryIonParser(object):
                 return -1
             self.localremaining -= 1
 
-        b = self.stream.read(1)
-        if len(b) < 1:
+        pos = self.pos
+        if pos >= self.buflen:
             return -1
-        b = ord(b)
+        b = self.buf[pos]
+        self.pos = pos + 1
         result = b >> 4
         ln = b & 0xF
 
@@ -380,13 +394,13 @@ class BinaryIonParser(object):
         return result
 
     def readvarint(self):
-        b = ord(self.read())
+        b = self.read()[0]
         negative = ((b & 0x40) != 0)
         result = (b & 0x3F)
 
         i = 0
         while (b & 0x80) == 0 and i < 4:
-            b = ord(self.read())
+            b = self.read()[0]
             result = (result << 7) | (b & 0x7F)
             i += 1
 
@@ -397,15 +411,28 @@ class BinaryIonParser(object):
         return result
 
     def readvaruint(self):
-        b = ord(self.read())
-        result = (b & 0x7F)
-
+        # inlined read() of one byte at a time, this is the hottest path
+        buf, pos, buflen = self.buf, self.pos, self.buflen
+        remaining = self.localremaining
+        result = 0
         i = 0
-        while (b & 0x80) == 0 and i < 4:
-            b = ord(self.read())
+        while True:
+            if remaining != -1:
+                remaining -= 1
+                if remaining < 0:
+                    self.localremaining = remaining
+                    _assert(False)
+            if pos >= buflen:
+                self.pos, self.localremaining = pos, remaining
+                raise EOFError()
+            b = buf[pos]
+            pos += 1
             result = (result << 7) | (b & 0x7F)
+            if (b & 0x80) != 0 or i == 4:
+                break
             i += 1
 
+        self.pos, self.localremaining = pos, remaining
         _assert(i < 4 or (b & 0x80) != 0, "int overflow")
 
         return result
@@ -422,7 +449,7 @@ class BinaryIonParser(object):
         _assert(self.localremaining <= 8, "Decimal overflow")
 
         signed = False
-        b = [ord(x) for x in self.read(self.localremaining)]
+        b = list(self.read(self.localremaining))
         if (b[0] & 0x80) != 0:
             b[0] = b[0] & 0x7F
             signed = True
@@ -434,7 +461,7 @@ class BinaryIonParser(object):
             vb[i] = b[j]
             j += 1
 
-        v = struct.unpack("<Q", b"".join(bchr(x) for x in vb))[0]
+        v = struct.unpack("<Q", bytes(vb))[0]
 
         result = v * (10 ** exponent)
         if signed:
@@ -449,7 +476,7 @@ class BinaryIonParser(object):
             if self.localremaining < 0:
                 raise EOFError()
 
-        self.stream.seek(count, os.SEEK_CUR)
+        self.pos += count
 
     def parsesymboltable(self):
         self.next() # shouldn't do anything?
@@ -580,16 +607,17 @@ class BinaryIonParser(object):
             return
 
         if self.valuetid == TID_STRING:
-            self.value = self.read(self.valuelen).decode("UTF-8")
+            self.value = str(self.read(self.valuelen), "UTF-8")
 
         elif self.valuetid in (TID_POSINT, TID_NEGINT, TID_SYMBOL):
             if self.valuelen == 0:
                 self.value = 0
             else:
                 _assert(self.valuelen <= 4, "int too long: %d" % self.valuelen)
-                v = 0
-                for i in range(self.valuelen - 1, -1, -1):
-                    v = (v | (ord(self.read()) << (i * 8)))
+                b = self.read(self.valuelen)
+                if len(b) < self.valuelen:
+                    raise EOFError()
+                v = int.from_bytes(b, "big")
 
                 if self.valuetid == TID_NEGINT:
                     self.value = -v
@@ -613,8 +641,8 @@ class BinaryIonParser(object):
 
     def loadannotations(self):
         ln = self.readvaruint()
-        maxpos = self.stream.tell() + ln
-        while self.stream.tell() < maxpos:
+        maxpos = self.pos + ln
+        while self.pos < maxpos:
             self.annotations.append(self.readvaruint())
         self.valuetid = self.readtypeid()
 
@@ -659,7 +687,7 @@ class BinaryIonParser(object):
 
         result = ""
         for i in b:
-            result += ("%02x " % ord(i))
+            result += ("%02x " % i)
 
         if len(result) > 0:
             result = result[:-1]
@@ -1340,13 +1368,7 @@ class DrmIonVoucher(object):
     secretkey = b""
 
     def __init__(self, voucherenv, dsn, secret,skeylist=None):
-        self.dsn, self.secret = dsn, secret
-
-        if isinstance(dsn, str):
-            self.dsn = dsn.encode('ASCII')
-
-        if isinstance(secret, str):
-            self.secret = secret.encode('ASCII')
+        self.setcredentials(dsn, secret)
 
         self.lockparams = []
         self.keycandidates=[]
@@ -1356,6 +1378,17 @@ class DrmIonVoucher(object):
         self.envelope = BinaryIonParser(voucherenv)
         addprottable(self.envelope)
 
+    # The parsed envelope doesn't depend on the credentials, so a voucher can
+    # be parsed once and then tried with several DSN/secret pairs.
+    def setcredentials(self, dsn, secret):
+        self.dsn, self.secret = dsn, secret
+
+        if isinstance(dsn, str):
+            self.dsn = dsn.encode('ASCII')
+
+        if isinstance(secret, str):
+            self.secret = secret.encode('ASCII')
+
     def decryptvoucher(self):
         shared = ("PIDv3" + self.encalgorithm + self.enctransformation + self.hashalgorithm).encode('ASCII')
 
@@ -1384,7 +1417,7 @@ class DrmIonVoucher(object):
             try:
                 b = aes.decrypt(self.ciphertext)
                 b = pkcs7unpad(b, 16)
-                self.drmkey = BinaryIonParser(BytesIO(b))
+                self.drmkey = BinaryIonParser(b)
                 addprottable(self.drmkey)
 
                 _assert(self.drmkey.hasnext() and self.drmkey.next() == TID_LIST and self.drmkey.gettypename() == "com.amazon.drm.KeySet@1.0",
@@ -1421,7 +1454,7 @@ class DrmIonVoucher(object):
                 elif self.drmkey.getfieldname() == "format":
                     _assert(self.drmkey.stringvalue() == "RAW", "Unknown key format: %s" % self.drmkey.stringvalue())
                 elif self.drmkey.getfieldname() == "encoded":
-                    self.secretkey = self.drmkey.lobvalue()
+                    self.secretkey = bytes(self.drmkey.lobvalue())
 
             self.drmkey.stepout()
             break
@@ -1442,7 +1475,7 @@ class DrmIonVoucher(object):
             self.envelope.next()
             field = self.envelope.getfieldname()
             if field == "voucher":
-                self.voucher = BinaryIonParser(BytesIO(self.envelope.lobvalue()))
+                self.voucher = BinaryIonParser(self.envelope.lobvalue())
                 addprottable(self.voucher)
                 continue
             elif field != "strategy":
@@ -1535,7 +1568,31 @@ class DrmIon(object):
         addprottable(self.ion)
         self.onvoucherrequired = onvoucherrequired
         self.skeylist = skeylist
-    def parse(self, outpages):
+    def parse(self, outpages, workers=None):
+        # Scan the envelope first, then decrypt and decompress the pages.
+        # AES and LZMA both release the GIL, so independent pages are
+        # processed on a thread pool and written out in order.
+        pages = self.scanpages()
+        if workers is None:
+            workers = min(len(pages), os.cpu_count() or 1)
+        if workers < 2:
+            for ct, civ, decompress, decrypt in pages:
+                self.processpage(ct, civ, outpages, decompress, decrypt)
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            # keep only a few pages in flight so output doesn't pile up in memory
+            pending = collections.deque()
+            for page in pages:
+                pending.append(executor.submit(self.decryptpage, *page))
+                if len(pending) >= workers * 2:
+                    outpages.write(pending.popleft().result())
+            while pending:
+                outpages.write(pending.popleft().result())
+
+    # returns a list of (data, iv, decompress, decrypt) for every page
+    def scanpages(self):
+        pages = []
         self.ion.reset()
 
         _assert(self.ion.hasnext(), "DRMION envelope is empty")
@@ -1595,7 +1652,7 @@ class DrmIon(object):
                             civ = self.ion.lobvalue()
                     _assert(self.key is not None, "Unable to obtain secret key from voucher or keylist")
                     if ct is not None and civ is not None:
-                        self.processpage(ct, civ, outpages, decompress, decrypt)
+                        pages.append((ct, civ, decompress, decrypt))
                     self.ion.stepout()
 
                 elif self.ion.gettypename() in ["com.amazon.drm.PlainText@1.0", "com.amazon.drm.PlainText@2.0"]:
@@ -1611,7 +1668,7 @@ class DrmIon(object):
                             plaintext = self.ion.lobvalue()
 
                     if plaintext is not None:
-                        self.processpage(plaintext, None, outpages, decompress, decrypt)
+                        pages.append((plaintext, None, decompress, decrypt))
                     self.ion.stepout()
 
             self.ion.stepout()
@@ -1619,10 +1676,15 @@ class DrmIon(object):
                 break
             self.ion.next()
 
+        return pages
+
     def print_(self, lst):
         self.ion.print_(lst)
 
     def processpage(self, ct, civ, outpages, decompress, decrypt):
+        outpages.write(self.decryptpage(ct, civ, decompress, decrypt))
+
+    def decryptpage(self, ct, civ, decompress, decrypt):
         if decrypt:
             aes = AES.new(self.key[:16], AES.MODE_CBC, civ[:16])
             msg = pkcs7unpad(aes.decrypt(ct), 16)
@@ -1630,19 +1692,19 @@ class DrmIon(object):
             msg = ct
 
         if not decompress:
-            outpages.write(msg)
-            return
+            return msg
 
         _assert(msg[0] == 0, "LZMA UseFilter not supported")
 
         if calibre_lzma is not None:
             with calibre_lzma.decompress(msg[1:], bufsize=0x1000000) as f:
                 f.seek(0)
-                outpages.write(f.read())
-            return
+                return f.read()
 
         decomp = lzma.LZMADecompressor(format=lzma.FORMAT_ALONE)
+        segments = []
         while not decomp.eof:
             segment = decomp.decompress(msg[1:])
             msg = b"" # Contents were internally buffered after the first call
-            outpages.write(segment)
+            segments.append(segment)
+        return b"".join(segments)
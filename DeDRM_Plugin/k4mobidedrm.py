@@ -5,7 +5,7 @@
 # Copyright © 2008-2020 by Apprentice Harper et al.
 
 __license__ = 'GPL v3'
-__version__ = '6.0'
+__version__ = '6.1'
 
 # Engine to remove drm from Kindle and Mobipocket ebooks
 # for personal use for archiving and converting your ebooks
@@ -61,13 +61,13 @@ __version__ = '6.0'
 #  5.6 - Invoke KFXZipBook to handle zipped KFX files
 #  5.7 - Revamp cleanup_name
 #  6.0 - Added Python 3 compatibility for calibre 5.0
+#  6.1 - Added KeyRing so key files are parsed once per session, not per book
 
 
 import sys, os, re
 import csv
 import getopt
 import glob
-import re
 import traceback
 import time
 try: 
@@ -88,6 +88,8 @@ import topazextract
 import kgenpids
 import androidkindlekey
 import kfxdedrm
+from ion import SKeyList
+from keyhitcache import KeyHitCache
 
 from utilities import SafeUnbuffered
 
@@ -141,22 +143,138 @@ def unescape(text):
         return text # leave as is
     return re.sub("&#?\\w+;", fixup, text)
 
-def GetDecryptedBook(infile, kDatabases, androidFiles, serials, pids, starttime = time.time(),skeyfile=None, remove_watermarks=True):
+class KeyRing(object):
+    """All the key material needed to decrypt Kindle books, parsed once.
+
+    Building one reads the PID and serial lists, the kindlekey databases,
+    the Android backups and the KFX secret key file. The same key ring can
+    then be used for every book of a run; refresh() re-reads everything
+    only if one of the source files was added, removed or modified. It
+    also carries the KeyHitCache that puts known-good keys first.
+    """
+
+    def __init__(self, rscpath=None, kDatabaseFiles=[], androidFiles=[], serials=[], pids=[], kDatabases=[], skeyfile=None):
+        self.rscpath = rscpath
+        self.kDatabaseFiles = list(kDatabaseFiles)
+        self.androidFiles = list(androidFiles)
+        self.extraSerials = list(serials)
+        self.extraPids = list(pids)
+        self.extraDatabases = list(kDatabases)
+        self.skeyfile = skeyfile
+        # remembers which keys worked, kept next to the key files if we have a directory
+        if rscpath is not None:
+            self.keycache = KeyHitCache(os.path.join(rscpath, 'keyhits.json'))
+        else:
+            self.keycache = KeyHitCache()
+        self.stamp = None
+        self.refresh()
+
+    def _scan(self):
+        # everything found in rscpath plus the explicitly given files
+        self.pidsFile = self.serialsFile = None
+        self.allDatabaseFiles = list(self.kDatabaseFiles)
+        self.allAndroidFiles = list(self.androidFiles)
+        if self.rscpath is not None:
+            for filename in os.listdir(self.rscpath):
+                dpath = os.path.join(self.rscpath, filename)
+                lname = filename.lower()
+                if lname == 'pidlist.txt':
+                    self.pidsFile = dpath
+                elif lname == 'seriallist.txt':
+                    self.serialsFile = dpath
+                elif lname.endswith('.k4i'):
+                    self.allDatabaseFiles.append(dpath)
+                elif lname.endswith(('.ab', '.db', '.xml')):
+                    self.allAndroidFiles.append(dpath)
+
+    def _getStamp(self):
+        paths = [self.pidsFile, self.serialsFile, self.skeyfile] + self.allDatabaseFiles + self.allAndroidFiles
+        stamp = []
+        for path in paths:
+            if path is None:
+                continue
+            try:
+                stamp.append((path, os.stat(path).st_mtime_ns))
+            except OSError:
+                stamp.append((path, None))
+        return stamp
+
+    def refresh(self):
+        self._scan()
+        stamp = self._getStamp()
+        if stamp != self.stamp:
+            self.load()
+            self.stamp = stamp
+        return self
+
+    def load(self):
+        self.pids = list(self.extraPids)
+        if self.pidsFile is not None:
+            pidstr = open(self.pidsFile,'r').read()
+            pidstr = pidstr.rstrip(os.linesep)
+            pidstr = pidstr.strip()
+            if pidstr != '':
+                self.pids.extend(pidstr.split(','))
+
+        self.serials = list(self.extraSerials)
+        if self.serialsFile is not None:
+            serialstr = open(self.serialsFile,'r').read()
+            serialstr = serialstr.rstrip(os.linesep)
+            serialstr = serialstr.strip()
+            if serialstr != '':
+                self.serials.extend(serialstr.split(','))
+        # extend list of serials with serials from android databases
+        for aFile in self.allAndroidFiles:
+            self.serials.extend(androidkindlekey.get_serials(aFile))
+
+        self.kDatabases = list(self.extraDatabases)
+        for dbfile in self.allDatabaseFiles:
+            try:
+                with open(dbfile, 'r') as keyfilein:
+                    kindleDatabase = json.loads(keyfilein.read())
+                self.kDatabases.append([dbfile,kindleDatabase])
+            except Exception as e:
+                print("Error getting database from file {0:s}: {1}".format(dbfile,e))
+                traceback.print_exc()
+
+        self.skeylist = SKeyList(self.skeyfile) if self.skeyfile is not None else None
+
+        # PIDs that don't depend on the book (KFX books have no PID meta info)
+        self.bookIndependentPids = None
+
+    def getPidList(self, md1, md2):
+        if md1 is None:
+            if self.bookIndependentPids is None:
+                self.bookIndependentPids = self._getPidList(md1, md2)
+            return list(self.bookIndependentPids)
+        return self._getPidList(md1, md2)
+
+    def _getPidList(self, md1, md2):
+        totalpids = list(self.pids)
+        totalpids.extend(kgenpids.getPidList(md1, md2, self.serials, self.kDatabases))
+        # remove any duplicates
+        return list(set(totalpids))
+
+
+def GetDecryptedBook(infile, kDatabases, androidFiles, serials, pids, starttime = time.time(),skeyfile=None, remove_watermarks=True, keyring=None):
     # handle the obvious cases at the beginning
     if not os.path.isfile(infile):
         raise DrmException("Input file does not exist.")
 
+    if keyring is None:
+        keyring = KeyRing(kDatabases=kDatabases, androidFiles=androidFiles, serials=serials, pids=pids, skeyfile=skeyfile)
+
     mobi = True
     magic8 = open(infile,'rb').read(8)
     if magic8 == b'\xeaDRMION\xee':
         voucher_files = glob.glob(os.path.join(os.path.dirname(infile), '*.voucher'))
         if voucher_files:
             print("Found voucher file for standalone DRMION: {0}".format(voucher_files[0]))
-            mb = kfxdedrm.KFXStandaloneBook(infile, voucher_files[0], skeyfile)
+            mb = kfxdedrm.KFXStandaloneBook(infile, voucher_files[0], skeylist=keyring.skeylist)
         else:
             raise DrmException("The .kfx DRMION file cannot be decrypted by itself. A .kfx-zip archive or .voucher file is required.")
     elif magic8[:4] == b'PK\x03\x04':
-        mb = kfxdedrm.KFXZipBook(infile,skeyfile)
+        mb = kfxdedrm.KFXZipBook(infile, skeylist=keyring.skeylist)
     else:
         magic3 = magic8[:3]
         if magic3 == b'TPZ':
@@ -172,16 +290,10 @@ def GetDecryptedBook(infile, kDatabases, androidFiles, serials, pids, starttime
     except: 
         print("Decrypting {0} ebook.".format(mb.getBookType()))
 
-    # copy list of pids
-    totalpids = list(pids)
-    # extend list of serials with serials from android databases
-    for aFile in androidFiles:
-        serials.extend(androidkindlekey.get_serials(aFile))
-    # extend PID list with book-specific PIDs from seriala and kDatabases
+    # book-specific PIDs from the serials and kDatabases in the key ring
     md1, md2 = mb.getPIDMetaInfo()
-    totalpids.extend(kgenpids.getPidList(md1, md2, serials, kDatabases))
-    # remove any duplicates
-    totalpids = list(set(totalpids))
+    totalpids = keyring.getPidList(md1, md2)
+    mb.keycache = keyring.keycache
     print("Found {1:d} keys to try after {0:.1f} seconds".format(time.time()-starttime, len(totalpids)))
     #print totalpids
 
@@ -196,23 +308,13 @@ def GetDecryptedBook(infile, kDatabases, androidFiles, serials, pids, starttime
 
 
 # kDatabaseFiles is a list of files created by kindlekey
-def decryptBook(infile, outdir, kDatabaseFiles, androidFiles, serials, pids, skeyfile=None):
+def decryptBook(infile, outdir, kDatabaseFiles, androidFiles, serials, pids, skeyfile=None, keyring=None):
     starttime = time.time()
-    kDatabases = []
-    for dbfile in kDatabaseFiles:
-        kindleDatabase = {}
-        try:
-            with open(dbfile, 'r') as keyfilein:
-                kindleDatabase = json.loads(keyfilein.read())
-            kDatabases.append([dbfile,kindleDatabase])
-        except Exception as e:
-            print("Error getting database from file {0:s}: {1:s}".format(dbfile,e))
-            traceback.print_exc()
-
-
+    if keyring is None:
+        keyring = KeyRing(kDatabaseFiles=kDatabaseFiles, androidFiles=androidFiles, serials=serials, pids=pids, skeyfile=skeyfile)
 
     try:
-        book = GetDecryptedBook(infile, kDatabases, androidFiles, serials, pids, starttime, skeyfile=skeyfile)
+        book = GetDecryptedBook(infile, None, None, None, None, starttime, keyring=keyring)
     except Exception as e:
         print("Error decrypting book after {1:.1f} seconds: {0}".format(e.args[0],time.time()-starttime))
         traceback.print_exc()
@@ -236,7 +338,14 @@ def decryptBook(infile, outdir, kDatabaseFiles, androidFiles, serials, pids, ske
     outfilename = outfilename+"_nodrm"
     outfile = os.path.join(outdir, outfilename + book.getBookExtension())
 
-    book.getFile(outfile)
+    # KFX-ZIP containers are only decrypted while being written out
+    try:
+        book.getFile(outfile)
+    except Exception as e:
+        print("Error decrypting book after {1:.1f} seconds: {0}".format(e,time.time()-starttime))
+        traceback.print_exc()
+        book.cleanup()
+        return 1
     print("Saved decrypted book {1:s} after {0:.1f} seconds".format(time.time()-starttime, outfilename))
 
     if book.getBookType()=="Topaz":
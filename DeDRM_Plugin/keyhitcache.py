@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Remembers which PID / DSN+secret succeeded for which book, so that later
+books and re-runs try the known-good key first instead of brute-forcing
+every candidate.
+
+Only a SHA-256 fingerprint of each key is stored, never the key itself.
+Books are identified by their voucher ID (KFX) or ASIN (Mobipocket). Keys
+that worked for any book are also remembered, most recent first, as they
+usually belong to the account or device the whole library came from.
+"""
+
+#@@CALIBRE_COMPAT_CODE@@
+
+import os
+import json
+import time
+import hashlib
+
+__license__ = 'GPL v3'
+
+CACHE_VERSION = 1
+# keep the global list of good keys short, a library rarely needs more
+MAX_KEYS = 64
+
+
+class KeyHitCache(object):
+    def __init__(self, path=None):
+        # with no path the cache only lives for this session
+        self.path = path
+        self.books = {}
+        self.keys = {}
+        if path is not None and os.path.isfile(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as fh:
+                    data = json.load(fh)
+                if data.get('version') == CACHE_VERSION:
+                    self.books = dict(data.get('books', {}))
+                    self.keys = dict(data.get('keys', {}))
+            except Exception as e:
+                print("Ignoring unreadable key cache {0}: {1}".format(path, e))
+
+    @staticmethod
+    def fingerprint(key):
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        return hashlib.sha256(bytes(key)).hexdigest()
+
+    def order(self, bookid, candidates):
+        """Return candidates with the known-good keys moved to the front.
+
+        The key recorded for bookid comes first, then keys that worked for
+        other books (most recently used first), then everything else in
+        its original order.
+        """
+        if not self.books and not self.keys:
+            return list(candidates)
+        bookfp = self.books.get(bookid) if bookid else None
+        def rank(item):
+            fp = self.fingerprint(item[1])
+            if fp == bookfp:
+                return (0, 0, item[0])
+            if fp in self.keys:
+                return (1, -self.keys[fp], item[0])
+            return (2, 0, item[0])
+        return [key for _, key in sorted(enumerate(candidates), key=rank)]
+
+    def record(self, bookid, key):
+        fp = self.fingerprint(key)
+        if bookid:
+            self.books[bookid] = fp
+        self.keys[fp] = time.time()
+        if len(self.keys) > MAX_KEYS:
+            for old in sorted(self.keys, key=self.keys.get)[:len(self.keys) - MAX_KEYS]:
+                del self.keys[old]
+        self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        tmppath = self.path + '.tmp'
+        try:
+            with open(tmppath, 'w', encoding='utf-8') as fh:
+                json.dump({'version': CACHE_VERSION, 'books': self.books, 'keys': self.keys}, fh)
+            os.replace(tmppath, self.path)
+        except Exception as e:
+            print("Could not save key cache {0}: {1}".format(self.path, e))
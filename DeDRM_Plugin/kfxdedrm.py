@@ -6,10 +6,13 @@
 #  2.0   - Python 3 for calibre 5.0
 #  2.1   - Some fixes for debugging
 #  2.1.1 - Whitespace!
+#  2.2   - Stream decrypted KFX-ZIP members to the output, copy the rest raw
 
 
 import os, sys
+import copy
 import shutil
+import struct
 import traceback
 import zipfile
 
@@ -24,18 +27,74 @@ from ion import DrmIon, DrmIonVoucher, SKeyList
 
 
 __license__ = 'GPL v3'
-__version__ = '2.0'
+__version__ = '2.2'
+
+# size of the local file header that precedes each member's data
+_LOCAL_HEADER_SIZE = 30
+_COPY_CHUNK = 1024 * 1024
+
+
+# ZipFile writer internals used by _copyrawmember (the ones writestr uses)
+_RAW_COPY_ATTRS = ('fp', 'start_dir', 'filelist', 'NameToInfo', '_didModify', '_writing')
+
+
+def _canrawcopy(zof):
+    # the internals are not a public API, so check they are all there before
+    # relying on them and fall back to _copymember otherwise
+    return all(hasattr(zof, name) for name in _RAW_COPY_ATTRS) and not zof._writing
+
+
+def _copymember(zif, zof, info):
+    # copy a member through the public API, inflating and deflating it again
+    zinfo = copy.copy(info)
+    with zif.open(info) as src, zof.open(zinfo, 'w') as dst:
+        shutil.copyfileobj(src, dst, _COPY_CHUNK)
+
+
+def _copyrawmember(zif, zof, info):
+    # copy the stored/compressed bytes of a member without inflating and
+    # deflating them again. Only used when _canrawcopy(zof) is true.
+    fp = zif.fp
+    fp.seek(info.header_offset)
+    header = fp.read(_LOCAL_HEADER_SIZE)
+    if len(header) != _LOCAL_HEADER_SIZE or header[:4] != b'PK\x03\x04':
+        raise zipfile.BadZipFile("Bad local header for {0}".format(info.filename))
+    namelen, extralen = struct.unpack('<HH', header[26:30])
+    fp.seek(namelen + extralen, 1)
+
+    zinfo = copy.copy(info)
+    # sizes and CRC are known up front, no data descriptor needed
+    zinfo.flag_bits &= ~0x08
+    zinfo.header_offset = zof.fp.tell()
+    zof.fp.write(zinfo.FileHeader())
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = fp.read(min(remaining, _COPY_CHUNK))
+        if not chunk:
+            raise zipfile.BadZipFile("Truncated data for {0}".format(info.filename))
+        zof.fp.write(chunk)
+        remaining -= len(chunk)
+    zof.start_dir = zof.fp.tell()
+    zof.filelist.append(zinfo)
+    zof.NameToInfo[zinfo.filename] = zinfo
+    zof._didModify = True
 
 
 class KFXZipBook:
-    def __init__(self, infile,skeyfile=None):
+    # set by the caller to try previously successful keys first
+    keycache = None
+
+    def __init__(self, infile,skeyfile=None,skeylist=None):
         self.infile = infile
-        if skeyfile is not None:
+        if skeylist is not None:
+          self.skeylist=skeylist
+        elif skeyfile is not None:
           self.skeylist=SKeyList(skeyfile)
         else:
           self.skeylist=None
         self.voucher = None
-        self.decrypted = {}
+        # names of the DRMION members, decrypted only while being written
+        self.encrypted = []
 
     def getPIDMetaInfo(self):
         return (None, None)
@@ -44,19 +103,31 @@ class KFXZipBook:
         with zipfile.ZipFile(self.infile, 'r') as zf:
             for filename in zf.namelist():
                 with zf.open(filename) as fh:
-                    data = fh.read(8)
-                    if data != b'\xeaDRMION\xee':
-                        continue
-                    data += fh.read()
-                    if self.voucher is None:
-                        self.decrypt_voucher(totalpids)
-                    print("Decrypting KFX DRMION: {0}".format(filename))
-                    outfile = BytesIO()
-                    DrmIon(BytesIO(data[8:-8]), lambda name: self.voucher,self.skeylist).parse(outfile)
-                    self.decrypted[filename] = outfile.getvalue()
+                    if fh.read(8) == b'\xeaDRMION\xee':
+                        self.encrypted.append(filename)
 
-        if not self.decrypted:
+        if not self.encrypted:
             print("The .kfx-zip archive does not contain an encrypted DRMION file")
+            return
+
+        self.decrypt_voucher(totalpids)
+
+    def decryptmember(self, zf, filename, outfile):
+        print("Decrypting KFX DRMION: {0}".format(filename))
+        data = zf.read(filename)
+        DrmIon(memoryview(data)[8:-8], lambda name: self.voucher,self.skeylist).parse(outfile)
+
+    def iterFiles(self):
+        # yields (filename, data) for every member with the DRMION containers
+        # decrypted, one at a time, for callers that do not need a .kfx-zip
+        with zipfile.ZipFile(self.infile, 'r') as zf:
+            for info in zf.infolist():
+                if info.filename in self.encrypted:
+                    outfile = BytesIO()
+                    self.decryptmember(zf, info.filename, outfile)
+                    yield info.filename, outfile.getvalue()
+                else:
+                    yield info.filename, zf.read(info)
 
     def decrypt_voucher(self, totalpids):
         with zipfile.ZipFile(self.infile, 'r') as zf:
@@ -76,7 +147,22 @@ class KFXZipBook:
                 return
         print("Decrypting KFX DRM voucher: {0}".format(info.filename))
 
-        for pid in [''] + totalpids:
+        # the envelope is parsed once, only the credentials change per attempt
+        voucher = DrmIonVoucher(BytesIO(data), '', '', self.skeylist)
+        try:
+            voucher.parse()
+        except Exception:
+            traceback.print_exc()
+            print("Failed to parse KFX DRM voucher... Hoping that keylist has a book key. ")
+            self.voucher = voucher
+            return
+        bookid = "kfx:" + voucher.voucher_id if voucher.voucher_id else None
+        candidates = [''] + totalpids
+        if self.keycache is not None:
+            candidates = self.keycache.order(bookid, candidates)
+
+        lastexception = None
+        for pid in candidates:
             # Belt and braces. PIDs should be unicode strings, but just in case...
             if isinstance(pid, bytes):
                 pid = pid.decode('ascii')
@@ -87,18 +173,22 @@ class KFXZipBook:
                 continue
 
             try:
-                voucher = DrmIonVoucher(BytesIO(data), pid[:dsn_len], pid[dsn_len:],self.skeylist)
-                voucher.parse()
+                voucher.setcredentials(pid[:dsn_len], pid[dsn_len:])
                 voucher.decryptvoucher()
                 break
-            except:
-                traceback.print_exc()
-                pass
+            except Exception as e:
+                lastexception = e
+                print("Voucher decryption failed with DSN length={0}, secret length={1}: {2}".format(dsn_len, secret_len, e))
         else:
+            if lastexception is not None:
+                traceback.print_exception(type(lastexception), lastexception, lastexception.__traceback__)
             print("Failed to decrypt KFX DRM voucher with any key... Hoping that keylist has a book key. ")
             self.voucher = voucher
             return
 
+        if self.keycache is not None and voucher.drmkey is not None and pid:
+            self.keycache.record(bookid, pid)
+
         print("KFX DRM voucher successfully decrypted")
 
         license_type = voucher.getlicensetype()
@@ -123,20 +213,42 @@ class KFXZipBook:
         pass
 
     def getFile(self, outpath):
-        if not self.decrypted:
+        if not self.encrypted:
             shutil.copyfile(self.infile, outpath)
-        else:
+            return
+        try:
             with zipfile.ZipFile(self.infile, 'r') as zif:
                 with zipfile.ZipFile(outpath, 'w') as zof:
+                    rawcopy = _canrawcopy(zof)
                     for info in zif.infolist():
-                        zof.writestr(info, self.decrypted.get(info.filename, zif.read(info.filename)))
+                        if info.filename not in self.encrypted:
+                            if info.flag_bits & 0x01:
+                                zof.writestr(info, zif.read(info))
+                            elif rawcopy:
+                                _copyrawmember(zif, zof, info)
+                            else:
+                                _copymember(zif, zof, info)
+                            continue
+                        zinfo = copy.copy(info)
+                        with zof.open(zinfo, 'w') as fh:
+                            self.decryptmember(zif, info.filename, fh)
+        except Exception:
+            # do not leave a half written book behind
+            if os.path.exists(outpath):
+                os.remove(outpath)
+            raise
 
 
 class KFXStandaloneBook:
-    def __init__(self, infile, voucherfile, skeyfile=None):
+    # set by the caller to try previously successful keys first
+    keycache = None
+
+    def __init__(self, infile, voucherfile, skeyfile=None, skeylist=None):
         self.infile = infile
         self.voucherfile = voucherfile
-        if skeyfile is not None:
+        if skeylist is not None:
+            self.skeylist = skeylist
+        elif skeyfile is not None:
             self.skeylist = SKeyList(skeyfile)
         else:
             self.skeylist = None
@@ -158,7 +270,7 @@ class KFXStandaloneBook:
 
         print("Decrypting standalone KFX DRMION: {0}".format(os.path.basename(self.infile)))
         outfile = BytesIO()
-        DrmIon(BytesIO(data[8:-8]), lambda name: self.voucher, self.skeylist).parse(outfile)
+        DrmIon(memoryview(data)[8:-8], lambda name: self.voucher, self.skeylist).parse(outfile)
         self.decrypted[os.path.basename(self.infile)] = outfile.getvalue()
 
     def decrypt_voucher(self, totalpids):
@@ -176,7 +288,15 @@ class KFXStandaloneBook:
         print("Decrypting KFX DRM voucher: {0}".format(os.path.basename(self.voucherfile)))
 
         import binascii
-        for pid in [''] + totalpids:
+        # the envelope is parsed once, only the credentials change per attempt
+        voucher = DrmIonVoucher(BytesIO(data), '', '', self.skeylist)
+        voucher.parse()
+        bookid = "kfx:" + voucher.voucher_id if voucher.voucher_id else None
+        candidates = [''] + totalpids
+        if self.keycache is not None:
+            candidates = self.keycache.order(bookid, candidates)
+
+        for pid in candidates:
             if isinstance(pid, bytes):
                 pid = pid.decode('utf-8')
             for dsn_len,secret_len in [(0,0), (16,0), (16,40), (16,128), (32,0), (32,40), (32,128), (40,0), (40,40), (40,128)]:
@@ -207,8 +327,7 @@ class KFXStandaloneBook:
                     secret_bytes = secret
 
             try:
-                voucher = DrmIonVoucher(BytesIO(data), dsn, secret_bytes, self.skeylist)
-                voucher.parse()
+                voucher.setcredentials(dsn, secret_bytes)
                 voucher.decryptvoucher()
                 print("Successfully decrypted voucher with DSN length={}, SECRET length={}".format(len(dsn), len(secret)))
                 break
@@ -220,6 +339,9 @@ class KFXStandaloneBook:
             print("Failed to decrypt KFX DRM voucher with any key")
             raise Exception("Failed to decrypt voucher")
 
+        if self.keycache is not None and voucher.drmkey is not None and pid:
+            self.keycache.record(bookid, pid)
+
         print("KFX DRM voucher successfully decrypted")
 
         license_type = voucher.getlicensetype()
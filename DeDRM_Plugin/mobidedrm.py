@@ -7,7 +7,7 @@
 
 from __future__ import print_function
 __license__ = 'GPL v3'
-__version__ = "1.1"
+__version__ = "1.3"
 
 # This is a python script. You need a Python interpreter to run it.
 # For example, ActiveState Python, which exists for windows.
@@ -75,11 +75,16 @@ __version__ = "1.1"
 #  0.42 - Added GPL v3 licence. updated/removed some print statements
 #  1.0  - Python 3 compatibility for calibre 5.0
 #  1.1  - Speed Python PC1 implementation up a little bit
+#  1.2  - Decrypt text records in parallel on multi-core machines
+#  1.3  - Stream the decrypted book to the output instead of building copies
 
 import sys
 import os
 import struct
 import binascii
+import collections
+import concurrent.futures
+import pickle
 
 
 #@@CALIBRE_COMPAT_CODE@@
@@ -106,6 +111,65 @@ def PC1(key, src, decryption=True):
     except: 
         raise
 
+# Below this many encrypted bytes the cost of starting worker processes
+# outweighs the gain, so small books are decrypted in-process.
+PARALLEL_MIN_BYTES = 1024 * 1024
+# records are sent to the workers in chunks of about this many bytes
+PARALLEL_CHUNK_BYTES = 256 * 1024
+
+def _decryptRecords(key, records):
+    cipher = Pukall_Cipher()
+    return [cipher.PC1(key, data) for data in records]
+
+def _chunkRecords(records):
+    chunk = []
+    chunk_size = 0
+    for data in records:
+        chunk.append(data)
+        chunk_size += len(data)
+        if chunk_size >= PARALLEL_CHUNK_BYTES:
+            yield chunk
+            chunk = []
+            chunk_size = 0
+    if chunk:
+        yield chunk
+
+# Every record starts from a fresh PC1 key schedule, so records can be
+# decrypted independently. Yields the decrypted records in input order,
+# with only a few chunks in flight so memory use stays bounded.
+def iterDecryptRecords(key, records, workers=None):
+    total = sum(len(data) for data in records)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, (total + PARALLEL_CHUNK_BYTES - 1) // PARALLEL_CHUNK_BYTES)
+    done = 0
+    if workers >= 2 and total >= PARALLEL_MIN_BYTES:
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                pending = collections.deque()
+                for chunk in _chunkRecords(records):
+                    # memoryview slices can not be pickled
+                    pending.append(executor.submit(_decryptRecords, key, [bytes(data) for data in chunk]))
+                    if len(pending) > workers * 2:
+                        decrypted = pending.popleft().result()
+                        done += len(decrypted)
+                        yield from decrypted
+                while pending:
+                    decrypted = pending.popleft().result()
+                    done += len(decrypted)
+                    yield from decrypted
+            return
+        except (OSError, RuntimeError, ImportError, pickle.PicklingError) as e:
+            # no usable process pool here (frozen build, calibre, sandbox, ...)
+            print("Parallel decryption unavailable ({0}), decrypting in-process.".format(e), end=' ')
+    cipher = Pukall_Cipher()
+    for data in records[done:]:
+        yield cipher.PC1(key, data)
+
+# Returns the decrypted records as a list.
+def decryptRecords(key, records, workers=None):
+    return list(iterDecryptRecords(key, records, workers))
+
 letters = b'ABCDEFGHIJKLMNPQRSTUVWXYZ123456789'
 
 def crc32(s):
@@ -163,13 +227,19 @@ def getSizeOfTrailingDataEntries(ptr, size, flags):
 
 
 class MobiBook:
-    def loadSection(self, section):
+    # set by the caller to try previously successful PIDs first
+    keycache = None
+
+    def sectionRange(self, section):
         if (section + 1 == self.num_sections):
             endoff = len(self.data_file)
         else:
             endoff = self.sections[section + 1][0]
-        off = self.sections[section][0]
-        return self.data_file[off:endoff]
+        return self.sections[section][0], endoff
+
+    def loadSection(self, section):
+        off, endoff = self.sectionRange(section)
+        return bytes(self.data_file[off:endoff])
 
     def cleanup(self):
         # to match function in Topaz book
@@ -179,9 +249,13 @@ class MobiBook:
         print("MobiDeDrm v{0:s}.\nCopyright © 2008-2022 The Dark Reverser, Apprentice Harper et al.".format(__version__))
 
         # initial sanity check on file
-        self.data_file = open(infile, 'rb').read()
-        self.mobi_data = ''
-        self.header = self.data_file[0:78]
+        # the file is patched and, if asked to, decrypted in place
+        with open(infile, 'rb') as f:
+            self.data_file = bytearray(os.fstat(f.fileno()).st_size)
+            f.readinto(self.data_file)
+        self.book_key = None
+        self.decrypted_in_place = False
+        self.header = bytes(self.data_file[0:78])
         if self.header[0x3C:0x3C+8] != b'BOOKMOBI' and self.header[0x3C:0x3C+8] != b'TEXtREAd':
             raise DrmException("Invalid file format")
         self.magic = self.header[0x3C:0x3C+8]
@@ -297,22 +371,28 @@ class MobiBook:
 
     # new must be byte array
     def patch(self, off, new):
-        self.data_file = self.data_file[:off] + new + self.data_file[off+len(new):]
+        self.data_file[off:off+len(new)] = new
 
     # new must be byte array
     def patchSection(self, section, new, in_off = 0):
-        if (section + 1 == self.num_sections):
-            endoff = len(self.data_file)
-        else:
-            endoff = self.sections[section + 1][0]
-        off = self.sections[section][0]
+        off, endoff = self.sectionRange(section)
         assert off + in_off + len(new) <= endoff
         self.patch(off + in_off, new)
 
+    # identifies the book in the key cache
+    def getBookId(self):
+        for asin_type in (113, 504):
+            if asin_type in self.meta_array:
+                return "mobi:" + self.meta_array[asin_type].decode('utf-8', 'replace')
+        return None
+
     # pids in pidlist must be unicode, returned key is byte array, pid is unicode
     def parseDRM(self, data, count, pidlist):
         found_key = None
         keyvec1 = b'\x72\x38\x33\xB0\xB4\xF2\xE3\xCA\xDF\x09\x01\xD6\xE2\xE0\x3F\x96'
+        bookid = self.getBookId()
+        if self.keycache is not None:
+            pidlist = self.keycache.order(bookid, pidlist)
         for pid in pidlist:
             bigpid = pid.encode('utf-8').ljust(16,b'\0')
             temp_key = PC1(keyvec1, bigpid, False)
@@ -330,6 +410,8 @@ class MobiBook:
                         found_key = finalkey
                         break
             if found_key != None:
+                if self.keycache is not None:
+                    self.keycache.record(bookid, pid)
                 break
         if not found_key:
             # Then try the default encoding that doesn't require a PID
@@ -350,8 +432,60 @@ class MobiBook:
                         break
         return [found_key,pid]
 
+    # yields the book piece by piece: the patched header, each decrypted
+    # record followed by its trailing entries, then the untouched tail
+    def iterBook(self):
+        view = memoryview(self.data_file)
+        if self.book_key is None or self.decrypted_in_place:
+            yield view
+            return
+        yield view[:self.sections[1][0]]
+        records = []
+        trailers = []
+        for i in range(1, self.records+1):
+            off, endoff = self.sectionRange(i)
+            extra_size = getSizeOfTrailingDataEntries(view[off:endoff], endoff - off, self.extra_data_flags)
+            records.append(view[off:endoff - extra_size])
+            trailers.append(view[endoff - extra_size:endoff])
+        for i, (decoded_data, trailer) in enumerate(zip(iterDecryptRecords(self.book_key, records), trailers), 1):
+            if i%100 == 0:
+                print(".", end=' ')
+            yield decoded_data
+            if trailer:
+                yield trailer
+        if self.num_sections > self.records+1:
+            yield view[self.sections[self.records+1][0]:]
+        print("done")
+
+    # writes the decrypted book to outfile, a path or a binary file object
+    def writeBook(self, outfile):
+        if isinstance(outfile, str):
+            with open(outfile, 'wb') as f:
+                self.writeBook(f)
+            return
+        for data in self.iterBook():
+            outfile.write(data)
+
     def getFile(self, outpath):
-        open(outpath,'wb').write(self.mobi_data)
+        self.writeBook(outpath)
+
+    # Decrypts the records in place and returns a memoryview of the whole
+    # book, so that e.g. KindleUnpack's Sectionizer can use it without
+    # another copy. PC1 does not change the record length.
+    def getBookView(self):
+        if self.book_key is not None and not self.decrypted_in_place:
+            pos = 0
+            for data in self.iterBook():
+                # everything but the decrypted records is already in place
+                if not isinstance(data, memoryview):
+                    self.data_file[pos:pos+len(data)] = data
+                pos += len(data)
+            self.decrypted_in_place = True
+        return memoryview(self.data_file)
+
+    @property
+    def mobi_data(self):
+        return bytes(self.getBookView())
 
     def getBookType(self):
         if self.print_replica:
@@ -378,7 +512,6 @@ class MobiBook:
             print("This book is not encrypted.")
             # we must still check for Print Replica
             self.print_replica = (self.loadSection(1)[0:4] == b'%MOP')
-            self.mobi_data = self.data_file
             return
         if crypto_type != 2 and crypto_type != 1:
             raise DrmException("Cannot decode unknown Mobipocket encryption type {0:d}".format(crypto_type))
@@ -436,26 +569,13 @@ class MobiBook:
         # clear the crypto type
         self.patchSection(0, b'\0' * 2, 0xC)
 
-        # decrypt sections
+        # the records are only decrypted while the book is written out,
+        # but Print Replica is told by the start of the first record
+        self.book_key = found_key
+        data = self.loadSection(1)
+        extra_size = getSizeOfTrailingDataEntries(data, len(data), self.extra_data_flags)
+        self.print_replica = (PC1(found_key, data[:len(data) - extra_size][:4]) == b'%MOP')
         print("Decrypting. Please wait . . .", end=' ')
-        mobidataList = []
-        mobidataList.append(self.data_file[:self.sections[1][0]])
-        for i in range(1, self.records+1):
-            data = self.loadSection(i)
-            extra_size = getSizeOfTrailingDataEntries(data, len(data), self.extra_data_flags)
-            if i%100 == 0:
-                print(".", end=' ')
-            # print "record %d, extra_size %d" %(i,extra_size)
-            decoded_data = PC1(found_key, data[0:len(data) - extra_size])
-            if i==1:
-                self.print_replica = (decoded_data[0:4] == b'%MOP')
-            mobidataList.append(decoded_data)
-            if extra_size > 0:
-                mobidataList.append(data[-extra_size:])
-        if self.num_sections > self.records+1:
-            mobidataList.append(self.data_file[self.sections[self.records+1][0]:])
-        self.mobi_data = b''.join(mobidataList)
-        print("done")
         return
 
 # pids in pidlist must be unicode
@@ -484,8 +604,9 @@ def cli_main():
         else:
             pidlist = []
         try:
-            stripped_file = getUnencryptedBook(infile, pidlist)
-            open(outfile, 'wb').write(stripped_file)
+            book = MobiBook(infile)
+            book.processBook(pidlist)
+            book.getFile(outfile)
         except DrmException as e:
             print("MobiDeDRM v{0} Error: {1:s}".format(__version__,e.args[0]))
             return 1
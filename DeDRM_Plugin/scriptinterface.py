@@ -146,60 +146,50 @@ def decryptpdb(infile, outdir, rscpath):
     return rv
 
 
+# key rings are kept for the whole session, keyed on where they were read from
+_keyrings = {}
+
+def getKeyRing(rscpath, skeyfile=None):
+    key = (os.path.abspath(rscpath), os.path.abspath(skeyfile) if skeyfile else None)
+    keyring = _keyrings.get(key)
+    if keyring is None:
+        keyring = k4mobidedrm.KeyRing(rscpath, skeyfile=skeyfile)
+        _keyrings[key] = keyring
+    else:
+        keyring.refresh()
+    return keyring
+
+
 def decryptk4mobi(infile, outdir, rscpath, skeyfile=None):
     errlog = ''
     rv = 1
-    pidnums = []
-    pidspath = os.path.join(rscpath,'pidlist.txt')
-    if os.path.exists(pidspath):
-        pidstr = open(pidspath,'r').read()
-        pidstr = pidstr.rstrip(os.linesep)
-        pidstr = pidstr.strip()
-        if pidstr != '':
-            pidnums = pidstr.split(',')
-    serialnums = []
-    serialnumspath = os.path.join(rscpath,'seriallist.txt')
-    if os.path.exists(serialnumspath):
-        serialstr = open(serialnumspath,'r').read()
-        serialstr = serialstr.rstrip(os.linesep)
-        serialstr = serialstr.strip()
-        if serialstr != '':
-            serialnums = serialstr.split(',')
-    kDatabaseFiles = []
-    files = os.listdir(rscpath)
-    filefilter = re.compile("\.k4i$", re.IGNORECASE)
-    files = filter(filefilter.search, files)
-    if files:
-        for filename in files:
-            dpath = os.path.join(rscpath,filename)
-            kDatabaseFiles.append(dpath)
-    androidFiles = []
-    files = os.listdir(rscpath)
-    filefilter = re.compile("\.ab$", re.IGNORECASE)
-    files = filter(filefilter.search, files)
-    if files:
-        for filename in files:
-            dpath = os.path.join(rscpath,filename)
-            androidFiles.append(dpath)
-    files = os.listdir(rscpath)
-    filefilter = re.compile("\.db$", re.IGNORECASE)
-    files = filter(filefilter.search, files)
-    if files:
-        for filename in files:
-            dpath = os.path.join(rscpath,filename)
-            androidFiles.append(dpath)
-    files = os.listdir(rscpath)
-    filefilter = re.compile("\.xml$", re.IGNORECASE)
-    files = filter(filefilter.search, files)
-    if files:
-        for filename in files:
-            dpath = os.path.join(rscpath,filename)
-            androidFiles.append(dpath)
     try:
-        rv = k4mobidedrm.decryptBook(infile, outdir, kDatabaseFiles, androidFiles, serialnums, pidnums, skeyfile=skeyfile)
+        keyring = getKeyRing(rscpath, skeyfile)
+        rv = k4mobidedrm.decryptBook(infile, outdir, [], [], [], [], keyring=keyring)
     except Exception as e:
         errlog += traceback.format_exc()
         errlog += str(e)
         rv = 1
 
     return rv
+
+
+def decryptk4mobifiles(infile, rscpath, skeyfile=None):
+    # decrypts a .kfx-zip without writing a _nodrm.kfx-zip, returns a list of
+    # (filename, data) for its members or None if it could not be decrypted
+    try:
+        keyring = getKeyRing(rscpath, skeyfile)
+        book = k4mobidedrm.GetDecryptedBook(infile, None, None, None, None, keyring=keyring)
+    except Exception:
+        traceback.print_exc()
+        return None
+
+    try:
+        if not hasattr(book, 'iterFiles'):
+            return None
+        return list(book.iterFiles())
+    except Exception:
+        traceback.print_exc()
+        return None
+    finally:
+        book.cleanup()
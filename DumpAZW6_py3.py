@@ -4,10 +4,16 @@
 import sys
 
 import os, getopt, struct
+import mmap
 import imghdr
 
 def get_image_type(imgname, imgdata=None):
-    imgtype = imghdr.what(imgname, imgdata)
+    # imghdr only looks at the leading bytes and needs real bytes to do so,
+    # so don't copy a whole memoryview just to identify it
+    if isinstance(imgdata, memoryview):
+        imgtype = imghdr.what(imgname, bytes(imgdata[:32]))
+    else:
+        imgtype = imghdr.what(imgname, imgdata)
     if imgtype == "jpeg":
         imgtype = "jpg"
 
@@ -30,12 +36,17 @@ def get_image_type(imgname, imgdata=None):
     return imgtype
 
 
-def processCRES(i, data, outdir):
+def getCRESImage(i, data):
     data = data[12:]
     imgtype = get_image_type(None, data)
     if imgtype is None:
         print("        Warning: CRES Section %s does not contain a recognised resource" % i)
         imgtype = "dat"
+    return imgtype, data
+
+
+def processCRES(i, data, outdir):
+    imgtype, data = getCRESImage(i, data)
     imgname = "image%05d.%s" % (i, imgtype)
     if outdir is None:
         imgdir = os.path.join(".", "azw6_images")
@@ -303,6 +314,85 @@ def main(argv=sys.argv):
             usage(progname)
             sys.exit(0)
 
+class AZW6Reader:
+    """Read-only view of an AZW6 HD container backed by an mmap of the file.
+
+    Sections are returned as memoryviews into the mapping, so nothing is
+    copied until the caller does so.  The views are only valid until the
+    reader is closed; use bytes() on any that must outlive it.
+    """
+
+    def __init__(self, infile):
+        self.infile = infile
+        self.f = open(infile, 'rb')
+        try:
+            self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.f.close()
+            raise dumpHeaderException('invalid file format')
+        self.data = memoryview(self.mm)
+        # make sure it is really an hd container file
+        if self.data[0x3C:0x3C+8] != b'RBINCONT':
+            self.close()
+            raise dumpHeaderException('invalid file format')
+        self.pp = PalmDB(self.data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.data is not None:
+            self.pp = None
+            self.data.release()
+            self.data = None
+            try:
+                self.mm.close()
+            except BufferError:
+                # a caller still holds one of our views, the mapping is
+                # released together with it
+                pass
+            self.f.close()
+
+    def getnumsections(self):
+        return self.pp.getnumsections()
+
+    def getsecaddr(self, secno):
+        return self.pp.getsecaddr(secno)
+
+    def readsection(self, secno):
+        return self.pp.readsection(secno)
+
+    def header(self):
+        return HdrParser(bytes(self.pp.readsection(0)), 0)
+
+    def iter_images(self, sections=None):
+        """Yield (section index, image type, memoryview) for each CRES image.
+
+        If sections is given only those section indexes are examined.
+        """
+        if sections is None:
+            sections = range(self.pp.getnumsections())
+        for i in sections:
+            data = self.pp.readsection(i)
+            if data[0:4] == b"CRES":
+                imgtype, imgdata = getCRESImage(i, data)
+                yield i, imgtype, imgdata
+
+
+def iter_hd_images(infile, sections=None):
+    """Yield (section index, image type, memoryview) for the HD images of infile.
+
+    The views point into an mmap of the file which is closed once the
+    iteration finishes, so consume (or copy) each image before moving on.
+    """
+    with AZW6Reader(infile) as reader:
+        for item in reader.iter_images(sections):
+            yield item
+
+
 def DumpAZW6(infile, outdir):
     #infile = args[0]
     infileext = os.path.splitext(infile)[1].upper()
@@ -311,68 +401,60 @@ def DumpAZW6(infile, outdir):
         return 1
 
     try:
-        # make sure it is really an hd container file
-        contdata = open(infile, 'rb').read()
-        palmheader = contdata[0:78]
-        ident = palmheader[0x3C:0x3C+8]
-        if ident != b'RBINCONT':
-            raise dumpHeaderException('invalid file format')
-
-        headers = {}
-
-        pp = PalmDB(contdata)
-        header = pp.readsection(0)
-
-        print("\n\nFirst Header Dump from Section %d" % 0)
-        hp = HdrParser(header, 0)
-        hp.dumpHeaderInfo()
-
-        # now dump a basic sector map of the palmdb
-        n = pp.getnumsections()
-        dtmap = {
-            b"FONT": "FONT",
-            b"RESC": "RESC",
-            b"CRES": "CRES",
-            b"CONT": "CONT",
-            b'\xa0\xa0\xa0\xa0': "Empty_Image/Resource_Placeholder",
-            b'\xe9\x8e\r\n': "EOF_RECORD",
+        with AZW6Reader(infile) as pp:
+            headers = {}
+
+            print("\n\nFirst Header Dump from Section %d" % 0)
+            hp = pp.header()
+            hp.dumpHeaderInfo()
+
+            # now dump a basic sector map of the palmdb
+            n = pp.getnumsections()
+            dtmap = {
+                b"FONT": "FONT",
+                b"RESC": "RESC",
+                b"CRES": "CRES",
+                b"CONT": "CONT",
+                b'\xa0\xa0\xa0\xa0': "Empty_Image/Resource_Placeholder",
+                b'\xe9\x8e\r\n': "EOF_RECORD",
+                }
+            dtmap2 = {
+                b"kindle:embed" : "KINDLE:EMBED",
             }
-        dtmap2 = {
-            b"kindle:embed" : "KINDLE:EMBED",
-        }
-        tr = -1
-        off = -1
-        hp = None
-        secmap = {}
-        print("\nMap of Palm DB Sections")
-        print("    Dec  - Hex : Description")
-        print("    ---- - ----  -----------")
-        for i in range(n):
-            before, after = pp.getsecaddr(i)
-            data = pp.readsection(i)
-            dlen = len(data)
-            dt = data[0:4]            
-            dtext = data[0:12]
-            desc = '' 
-            if dtext in list(dtmap2.keys()):
-                desc = data.decode()
-                linkhrefs = []
-                hreflist = desc.split('|')
-                for href in hreflist:
-                    if href != "":
-                        linkhrefs.append("        " +   href)
-                desc = "\n" + "\n".join(linkhrefs)
-            elif dt in list(dtmap.keys()):
-                desc = dtmap[dt]
-                if dt == b"CONT":
-                    desc="Cont Header"
-                elif dt == b"CRES":
-                    processCRES(i, data, outdir)
-            else:
-                desc = dtext.hex()
-                desc = desc + " " + dtext.decode()
-            if desc != "CONT":
-                print("    %04d - %04x: %s [%d]" % (i, i, desc, dlen))
+            tr = -1
+            off = -1
+            hp = None
+            secmap = {}
+            print("\nMap of Palm DB Sections")
+            print("    Dec  - Hex : Description")
+            print("    ---- - ----  -----------")
+            for i in range(n):
+                before, after = pp.getsecaddr(i)
+                data = pp.readsection(i)
+                dlen = len(data)
+                dt = bytes(data[0:4])
+                dtext = bytes(data[0:12])
+                desc = ''
+                if dtext in dtmap2:
+                    desc = bytes(data).decode()
+                    linkhrefs = []
+                    hreflist = desc.split('|')
+                    for href in hreflist:
+                        if href != "":
+                            linkhrefs.append("        " +   href)
+                    desc = "\n" + "\n".join(linkhrefs)
+                elif dt in dtmap:
+                    desc = dtmap[dt]
+                    if dt == b"CONT":
+                        desc="Cont Header"
+                    elif dt == b"CRES":
+                        processCRES(i, data, outdir)
+                else:
+                    desc = dtext.hex()
+                    desc = desc + " " + dtext.decode()
+                if desc != "CONT":
+                    print("    %04d - %04x: %s [%d]" % (i, i, desc, dlen))
+                del data
 
     except Exception as e:
         print("Error: %s" % e)
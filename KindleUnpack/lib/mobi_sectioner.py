@@ -46,10 +46,14 @@ class Sectionizer:
 
     def __init__(self, filename):
         self.data = b''
-        with open(pathof(filename), 'rb') as f:
-            self.data = f.read()
-        self.palmheader = self.data[:78]
-        self.palmname = self.data[:32]
+        if isinstance(filename, (memoryview, bytearray)):
+            # an already decrypted book held in memory, used without a copy
+            self.data = memoryview(filename)
+        else:
+            with open(pathof(filename), 'rb') as f:
+                self.data = f.read()
+        self.palmheader = bytes(self.data[:78])
+        self.palmname = bytes(self.data[:32])
         self.ident = self.palmheader[0x3C:0x3C+8]
         self.num_sections, = struct.unpack_from(b'>H', self.palmheader, 76)
         self.filelength = len(self.data)
@@ -117,4 +121,4 @@ class Sectionizer:
 
     def loadSection(self, section):
         before, after = self.sectionoffsets[section:section+2]
-        return self.data[before:after]
+        return bytes(self.data[before:after])
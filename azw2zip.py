@@ -43,6 +43,7 @@ from kfx_key_extractor import KFXKeyExtractor, KFXKeyExtractorError, MSIXKFXArch
 try:
     from kfxlib.yj_book import YJ_Book
     from kfxlib.yj_to_image_book import KFX_IMAGE_BOOK
+    from kfxlib.resources import set_jxr_conversion_cache
     KFX_AVAILABLE = True
 except ImportError as e:
     print(u"警告: kfxlibが利用できません。KFX画像抽出は無効です。")
@@ -52,7 +53,7 @@ except ImportError as e:
 with redirect_stdout(open(os.devnull, 'w')):
     # AlfCrypto読み込み時の標準出力抑制
     import kindlekey
-    from scriptinterface import decryptepub, decryptpdb, decryptpdf, decryptk4mobi
+    from scriptinterface import decryptepub, decryptpdb, decryptpdf, decryptk4mobi, decryptk4mobifiles
 
 def usage(progname):
     print(u"Description:")
@@ -65,7 +66,7 @@ def usage(progname):
     print(u"  -z        zipを出力(出力形式省略時のデフォルト)")
     print(u"  -e        epubを出力")
     print(u"  -f        画像ファイルをディレクトリに出力")
-    print(u"  -p        pdfを出力(PrintReplica書籍の場合のみ)")
+    print(u"  -p        pdfを出力(PrintReplica書籍・固定レイアウトのKFX書籍の場合のみ)")
     print(u"  -t        ファイル名の作品名にUpdated_Titleを使用する(Kindleと同じ作品名)")
     print(u"  -s        作者名を昇順でソートする")
     print(u"  -c        zipでの出力時に圧縮をする")
@@ -83,9 +84,10 @@ def find_all_files(directory):
         for file in files:
             yield os.path.join(root, file)
 
-def process_kfx_to_images(kfx_path, output_dir, base_filename, output_zip, output_epub, compress_zip, debug_mode):
+def process_kfx_to_images(kfx_path, output_dir, base_filename, output_zip, output_epub, compress_zip, debug_mode, output_pdf=False,
+                          kfx_files=None):
     """
-    KFXファイル/ディレクトリから画像を抽出してZIP/EPUBを作成
+    KFXファイル/ディレクトリから画像を抽出してZIP/EPUB/PDFを作成
     
     Args:
         kfx_path: KFXファイル/ディレクトリのパス
@@ -95,6 +97,8 @@ def process_kfx_to_images(kfx_path, output_dir, base_filename, output_zip, outpu
         output_epub: EPUB出力フラグ
         compress_zip: ZIP圧縮フラグ
         debug_mode: デバッグモードフラグ
+        output_pdf: PDF出力フラグ（固定レイアウトの場合のみ）
+        kfx_files: 復号済みKFX-ZIPのメンバー [(ファイル名, データ)]。指定時は kfx_path を読まずにこれを使用
     """
     if not KFX_AVAILABLE:
         print(u"  KFX処理: kfxlibが利用できません")
@@ -104,7 +108,15 @@ def process_kfx_to_images(kfx_path, output_dir, base_filename, output_zip, outpu
         print(u"  KFX画像抽出: 開始: {}".format(kfx_path))
         
         # ディレクトリまたはファイルを判定
-        if os.path.isdir(kfx_path):
+        if kfx_files is not None:
+            # 復号済みのメンバーをそのまま YJ_Book に渡す
+            if base_filename is None:
+                base_name = os.path.splitext(os.path.basename(kfx_path))[0]
+            else:
+                base_name = base_filename
+            process_target = kfx_path
+
+        elif os.path.isdir(kfx_path):
             # ディレクトリの場合、KFX-ZIPを作成
             print(u"  KFX処理: ディレクトリをKFX-ZIPに変換します: {}".format(kfx_path))
             
@@ -223,13 +235,13 @@ def process_kfx_to_images(kfx_path, output_dir, base_filename, output_zip, outpu
         
         try:
             # YJ_BookでKFX-ZIPを読み込み（DRM解除済みなので credentials=[]）
-            book = YJ_Book(process_target, credentials=[])
+            book = YJ_Book(process_target, credentials=[], files=kfx_files)
             
             output_files = []
             
-            # 本をデコード
+            # 本をデコード（DRM解除済みの信頼できる入力なので検証パスは省略）
             try:
-                book.decode_book()
+                book.decode_book(validate=False)
             except KeyError as e:
                 error_msg = str(e)
                 if "$260" in error_msg:
@@ -344,56 +356,38 @@ def process_kfx_to_images(kfx_path, output_dir, base_filename, output_zip, outpu
                     is_fixed_layout = True
                     print(u"  KFX処理: テキストコンテンツなし、画像ベースとして処理します")
             
-            # 固定レイアウトの場合、CBZを試みる
-            if output_zip and is_fixed_layout:
-                try:
-                    cbz_data = book.convert_to_cbz(
-                        split_landscape_comic_images=False,
-                        progress_fn=None
-                    )
-                    
-                    cbz_path = os.path.join(output_dir, base_name + '.cbz')
-                    with open(cbz_path, 'wb') as f:
-                        f.write(cbz_data)
-                    
-                    output_files.append(cbz_path)
-                    print(u"  KFX画像抽出: CBZ作成完了: {}".format(cbz_path))
-                except KeyError as e:
-                    error_msg = str(e)
-                    if "$260" in error_msg:
-                        print(u"  KFX画像抽出: CBZ作成スキップ（$260フラグメントエラー）")
-                    else:
-                        print(u"  KFX画像抽出: CBZ作成失敗: {}".format(error_msg))
-                        if debug_mode:
-                            import traceback
-                            traceback.print_exc()
-                except Exception as e:
-                    print(u"  KFX画像抽出: CBZ作成失敗: {}".format(str(e)))
-                    if debug_mode:
-                        import traceback
-                        traceback.print_exc()
+            # PDFはPrintReplicaを含む固定レイアウトの本であれば作成できる
+            make_cbz = output_zip and is_fixed_layout
+            make_pdf = output_pdf and (is_fixed_layout or getattr(book, 'is_fixed_layout', False))
+            make_epub = output_epub or (not is_fixed_layout and (output_zip or output_epub))
             
-            # リフロー型または固定レイアウトでない場合、EPUBを生成
-            if output_epub or (not is_fixed_layout and (output_zip or output_epub)):
-                try:
+            # 出力形式をまとめて変換し、JPEG-XR画像・PDFページの変換結果は出力間で共有して変換を1回で済ませる
+            formats = [fmt for fmt, wanted in [("cbz", make_cbz), ("pdf", make_pdf), ("epub", make_epub)] if wanted]
+            outfiles = dict((fmt, os.path.join(output_dir, base_name + "." + fmt)) for fmt in formats)
+            if formats:
+                if make_epub:
                     print(u"  KFX変換: EPUB変換を開始します")
-                    epub_data = book.convert_to_epub(
-                        epub2_desired=False,
-                        force_cover=False,
-                        progress_fn=None
-                    )
-                    
-                    epub_path = os.path.join(output_dir, base_name + '.epub')
-                    with open(epub_path, 'wb') as f:
-                        f.write(epub_data)
-                    
-                    output_files.append(epub_path)
-                    print(u"  KFX変換: EPUB作成完了: {}".format(epub_path))
+                try:
+                    # ページ画像は変換しながら直接ファイルへ書き込む（圧縮は設定に従う）
+                    results = book.convert_to_formats(formats, outfiles, compress=compress_zip)
                 except Exception as e:
-                    print(u"  KFX変換: EPUB作成失敗: {}".format(str(e)))
+                    print(u"  KFX画像抽出: 変換失敗: {}".format(str(e)))
                     if debug_mode:
                         import traceback
                         traceback.print_exc()
+                    results = {}
+
+                for fmt, label, stage in [("cbz", u"CBZ", u"KFX画像抽出"), ("pdf", u"PDF", u"KFX画像抽出"), ("epub", u"EPUB", u"KFX変換")]:
+                    if fmt not in formats:
+                        continue
+                    if results.get(fmt) is None:
+                        print(u"  {}: {}作成失敗".format(stage, label))
+                    else:
+                        output_files.append(outfiles[fmt])
+                        print(u"  {}: {}作成完了: {}".format(stage, label, outfiles[fmt]))
+            
+            if output_pdf and not make_pdf:
+                print(u"  KFX画像抽出: PDF作成スキップ（固定レイアウトではありません）")
             
             return {"output": output_files, "title": title if title else base_name, "authors": authors or []} if output_files else None
 
@@ -461,7 +455,7 @@ def get_kfx_metadata(kfx_path):
     
     try:
         book = YJ_Book(kfx_path, credentials=[])
-        book.decode_book()
+        book.decode_book(validate=False)
         
         title = None
         authors = None
@@ -600,6 +594,15 @@ def main(argv=unicode_argv()):
         k4i_dir = azw2zip_dir
     print(u"k4iディレクトリ: {}".format(k4i_dir))
     cfg.setk4iDirectory(k4i_dir)
+
+    # JPEG-XR変換結果のキャッシュ(設定時のみ)
+    jxr_cache_dir = cfg.getJxrCacheDirectory()
+    if jxr_cache_dir and KFX_AVAILABLE:
+        if not os.path.isabs(jxr_cache_dir):
+            jxr_cache_dir = os.path.join(azw2zip_dir, jxr_cache_dir)
+        print(u"JPEG-XRキャッシュ: {} ({}MB)".format(jxr_cache_dir, cfg.getJxrCacheSize()))
+        set_jxr_conversion_cache(jxr_cache_dir, cfg.getJxrCacheSize() * 1024 * 1024)
+
     k4i_files = glob.glob(os.path.join(k4i_dir, '*.k4i'))
     
     # -K オプションが指定された場合、既存のk4iファイルを削除
@@ -833,7 +836,7 @@ def main(argv=unicode_argv()):
             base_name = ensure_unique_base_name(
                 base_name,
                 out_dir,
-                [u".zip", u".epub", u""],
+                [u".zip", u".epub", u".pdf", u""],
                 over_write
             )
             
@@ -844,6 +847,7 @@ def main(argv=unicode_argv()):
                     [output_zip_org, u"zip", u".zip"],
                     [output_epub_org, u"epub", u".epub"],
                     [output_images_org, u"Images", u""],
+                    [output_pdf_org, u"pdf", u".pdf"],
                 ]:
                     if format[0]:
                         output_fpath = os.path.join(out_dir, base_name + format[2])
@@ -874,7 +878,8 @@ def main(argv=unicode_argv()):
                     output_zip_org,
                     output_epub_org,
                     compress_zip,
-                    debug_mode
+                    debug_mode,
+                    output_pdf_org
                 )
 
                 if kfx_output:
@@ -1027,7 +1032,28 @@ def main(argv=unicode_argv()):
 
         # Kindleファイル全般のDRM解除
         DeDRM_path = ""
-        if fext in ['.AZW', '.KFX', '.AZW8', '.AZW9', '.ION'] or fname.upper().endswith('.KFX-ZIP'):
+        kfx_files = None
+        if fname.upper().endswith('.KFX-ZIP') and KFX_AVAILABLE:
+            # KFX-ZIPは復号したメンバーをそのまま変換に使い、_nodrm.kfx-zipを書き出さない
+            print(u"  DRM解除: 開始: {}".format(azw_fpath))
+            kfx_keys_file = os.path.join(k4i_dir, 'kfx_keys.txt')
+            skeyfile = kfx_keys_file if os.path.exists(kfx_keys_file) else None
+            if debug_mode:
+                kfx_files = decryptk4mobifiles(azw_fpath, k4i_dir, skeyfile)
+            else:
+                old_stderr = sys.stderr
+                sys.stderr = open(os.devnull, 'w')
+                try:
+                    with redirect_stdout(open(os.devnull, 'w')):
+                        kfx_files = decryptk4mobifiles(azw_fpath, k4i_dir, skeyfile)
+                finally:
+                    sys.stderr.close()
+                    sys.stderr = old_stderr
+            if kfx_files is None:
+                # 失敗した場合は_nodrm.kfx-zipを書き出す従来の処理で再試行する
+                print(u"  DRM解除: メモリ上での復号に失敗したため再試行します")
+
+        if kfx_files is None and (fext in ['.AZW', '.KFX', '.AZW8', '.AZW9', '.ION'] or fname.upper().endswith('.KFX-ZIP')):
             print(u"  DRM解除: 開始: {}".format(azw_fpath))
             
             # Check for existing KFX keys file
@@ -1200,7 +1226,36 @@ def main(argv=unicode_argv()):
         elif fext in ['.AZW3']:
             DeDRM_path = azw_fpath
 
-        if DeDRM_path and unipath.exists(DeDRM_path):
+        if kfx_files is not None:
+            print(u"  DRM解除: 完了: {}".format(azw_fpath))
+            print(u"  KFX画像抽出処理: 開始: {}".format(azw_fpath))
+            kfx_output = process_kfx_to_images(
+                azw_fpath,
+                out_dir,
+                None,
+                output_zip,
+                output_epub,
+                compress_zip,
+                debug_mode,
+                output_pdf,
+                kfx_files=kfx_files
+            )
+            kfx_files = None
+
+            if kfx_output:
+                print(u"  KFX画像抽出処理: 完了")
+                jsonl_result["status"] = "success"
+                jsonl_result["format"] = "epub"
+                output_paths = kfx_output["output"]
+                jsonl_result["output"] = output_paths
+                jsonl_result["title"] = kfx_output.get("title", "")
+                jsonl_result["authors"] = kfx_output.get("authors", [])
+                for output_file in output_paths:
+                    print(u"    出力: {}".format(output_file))
+            else:
+                print(u"  KFX画像抽出処理: 失敗")
+                jsonl_result["error"] = "KFX extraction failed"
+        elif DeDRM_path and unipath.exists(DeDRM_path):
             # KFXファイルかチェック
             is_kfx_file = False
             with open(DeDRM_path, 'rb') as f:
@@ -1230,7 +1285,8 @@ def main(argv=unicode_argv()):
                     output_zip, 
                     output_epub, 
                     compress_zip, 
-                    debug_mode
+                    debug_mode,
+                    output_pdf
                 )
                 
                 if kfx_output_files:
@@ -1278,7 +1334,8 @@ def main(argv=unicode_argv()):
                         output_zip, 
                         output_epub, 
                         compress_zip, 
-                        debug_mode
+                        debug_mode,
+                        output_pdf
                     )
                     
                     if kfx_output:
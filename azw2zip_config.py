@@ -56,6 +56,8 @@ class azw2zipConfig:
         self.outdir = ''
         self.k4idir = ''
         self.tmpdir = ''
+        self.jxr_cache_dir = ''
+        self.jxr_cache_size = 1024
         self.authors_sep = u' & '
         self.authors_sort = False
         self.authors_others = u'外{}名'
@@ -101,6 +103,10 @@ class azw2zipConfig:
                         self.outdir = key_info['output_dir']
                     if 'k4i_dir' in key_info:
                         self.k4idir = key_info['k4i_dir']
+                    if 'jxr_cache_dir' in key_info:
+                        self.jxr_cache_dir = key_info['jxr_cache_dir']
+                    if 'jxr_cache_size' in key_info:
+                        self.jxr_cache_size = int(key_info['jxr_cache_size'])
                     if 'authors_sep' in key_info:
                         self.authors_sep = key_info['authors_sep']
                     if 'authors_sort' in key_info and key_info['authors_sort']:
@@ -128,6 +134,13 @@ class azw2zipConfig:
     def setk4iDirectory(self, k4idir):
         self.k4idir = k4idir
 
+    def getJxrCacheDirectory(self):
+        return self.jxr_cache_dir
+
+    def getJxrCacheSize(self):
+        # MB単位
+        return self.jxr_cache_size
+
     def isUpdatedTitle(self):
         return self.updated_title
 
@@ -48,7 +48,7 @@ class IonBinary(IonSerial):
         if DEBUG:
             log.debug("decoding: %s" % bytes_to_separated_hex(data[:1000]))
 
-        serial = Deserializer(data)
+        serial = Deserializer(memoryview(data))
         self.import_symbols = import_symbols
 
         ion_signature = serial.extract(4)
@@ -91,8 +91,152 @@ class IonBinary(IonSerial):
         return descriptor(signature, IonBinary.VARIABLE_LEN_FLAG) + serialize_vluint(length) + data
 
     def deserialize_value(self, serial):
+        if DEBUG:
+            return self.deserialize_value_(serial)
+
+        value, serial.offset = self.decode_value(serial.buffer, serial.offset, len(serial.buffer))
+        return value
+
+    def decode_value(self, buffer, offset, end):
+        # fast path for deserialize_value working directly on buffer offsets, returns the value and the offset after it
+        if offset >= end:
+            raise Exception("Deserializer: Insufficient data (need 1 bytes, have 0 bytes)")
+
+        descriptor = buffer[offset]
+        signature, length = DESCRIPTOR_TABLE[descriptor]
+        offset += 1
+
+        if signature < 0:
+            return self.decode_special_value(descriptor), offset
+
+        if length < 0:
+            if offset >= end:
+                raise Exception("Deserializer: Insufficient data (need 1 bytes, have 0 bytes)")
+
+            length = buffer[offset]
+            offset += 1
+            if length & 0x80:
+                length &= 0x7f
+            else:
+                length, offset = decode_vluint(buffer, offset - 1, end)
+
+        stop = offset + length
+        if stop > end:
+            raise Exception("Deserializer: Insufficient data (need %d bytes, have %d bytes)" % (length, max(end - offset, 0)))
+
+        if signature == IonBinary.STRUCT_VALUE_SIGNATURE:
+            if descriptor == SORTED_STRUCT_DESCRIPTOR:
+                log.error("BinaryIonStruct: Sorted IonStruct encountered")
+
+            symtab = self.symtab
+            symbol_cache = symtab.symbol_cache
+            result = IonStruct()
+
+            while offset < stop:
+                symbol_id = buffer[offset]
+                offset += 1
+                if symbol_id & 0x80:
+                    symbol_id &= 0x7f
+                else:
+                    symbol_id, offset = decode_vluint(buffer, offset - 1, stop)
+
+                id_symbol = symbol_cache.get(symbol_id)
+                if id_symbol is None:
+                    id_symbol = symbol_cache[symbol_id] = symtab.get_symbol(symbol_id)
+
+                value, offset = self.decode_value(buffer, offset, stop)
+
+                if not isinstance(value, IonNop):
+                    if id_symbol in result:
+                        log.error("BinaryIonStruct: Duplicate field name %s" % id_symbol)
+
+                    result[id_symbol] = value
+
+            return result, stop
+
+        if signature == IonBinary.SYMBOL_VALUE_SIGNATURE:
+            if 0 < length <= 2 and buffer[offset]:
+                symbol_id = ((buffer[offset] << 8) | buffer[offset + 1]) if length == 2 else buffer[offset]
+            else:
+                symbol_id = deserialize_unsignedint(buffer[offset:stop])
+
+            symbol = self.symtab.symbol_cache.get(symbol_id)
+            if symbol is None:
+                symbol = self.symtab.symbol_cache[symbol_id] = self.symtab.get_symbol(symbol_id)
+
+            return symbol, stop
+
+        if signature == IonBinary.POSINT_VALUE_SIGNATURE:
+            if 0 < length <= 2 and buffer[offset]:
+                return ((buffer[offset] << 8) | buffer[offset + 1]) if length == 2 else buffer[offset], stop
+
+            return deserialize_unsignedint(buffer[offset:stop]), stop
+
+        if signature == IonBinary.STRING_VALUE_SIGNATURE:
+            return str(buffer[offset:stop], "utf-8"), stop
+
+        if signature == IonBinary.LIST_VALUE_SIGNATURE or signature == IonBinary.SEXP_VALUE_SIGNATURE:
+            result = []
+            while offset < stop:
+                value, offset = self.decode_value(buffer, offset, stop)
+
+                if not isinstance(value, IonNop):
+                    result.append(value)
+
+            return (result if signature == IonBinary.LIST_VALUE_SIGNATURE else IonSExp(result)), stop
+
+        if signature == IonBinary.ANNOTATION_VALUE_SIGNATURE:
+            annotation_length, offset = decode_vluint(buffer, offset, stop)
+            annotation_end = offset + annotation_length
+            if annotation_end > stop:
+                raise Exception("Deserializer: Insufficient data (need %d bytes, have %d bytes)" % (
+                        annotation_length, max(stop - offset, 0)))
+
+            ion_value, value_end = self.decode_value(buffer, annotation_end, stop)
+            if value_end != stop:
+                raise Exception("IonAnnotation has excess data: %s" % bytes_to_separated_hex(buffer[value_end:stop]))
+
+            symtab = self.symtab
+            symbol_cache = symtab.symbol_cache
+            annotations = []
+            while offset < annotation_end:
+                symbol_id, offset = decode_vluint(buffer, offset, annotation_end)
+                symbol = symbol_cache.get(symbol_id)
+                if symbol is None:
+                    symbol = symbol_cache[symbol_id] = symtab.get_symbol(symbol_id)
 
-        descriptor = serial.unpack("B")
+                annotations.append(symbol)
+
+            if offset != annotation_end:
+                raise Exception("Deserializer: Insufficient data in IonAnnotation annotations")
+
+            if len(annotations) == 0:
+                raise Exception("IonAnnotation has no annotations")
+
+            return IonAnnotation(annotations, ion_value), stop
+
+        if signature == IonBinary.NULL_VALUE_SIGNATURE:
+            return IonNop(), stop
+
+        return IonBinary.VALUE_DESERIALIZERS[signature][1](self, buffer[offset:stop]), stop
+
+    def decode_special_value(self, descriptor):
+        if descriptor == IonBinary.VERSION_MARKER:
+            raise Exception("Unexpected Ion version marker within data stream")
+
+        signature = descriptor >> 4
+        flag = descriptor & 0x0f
+
+        if flag == IonBinary.NULL_FLAG:
+            if signature != IonBinary.NULL_VALUE_SIGNATURE:
+                log.error("IonBinary: Deserialized null of type %s" % IonBinary.VALUE_DESERIALIZERS[signature][2])
+
+            return None
+
+        return self.deserialize_bool_value(flag, None)
+
+    def deserialize_value_(self, serial):
+        descriptor = serial.extract(1)[0]
         if descriptor == IonBinary.VERSION_MARKER:
             raise Exception("Unexpected Ion version marker within data stream")
 
@@ -307,7 +451,7 @@ class IonBinary(IonSerial):
         return (IonBinary.STRING_VALUE_SIGNATURE, value.encode("utf-8"))
 
     def deserialize_string_value(self, data):
-        return data.decode("utf-8")
+        return str(data, "utf-8")
 
     CLOB_VALUE_SIGNATURE = 9
 
@@ -469,6 +613,29 @@ class IonBinary(IonSerial):
         }
 
 
+def make_descriptor_table():
+    # (signature, length) for each descriptor byte, with a length of -1 when a VarUInt length follows and a signature
+    # of -1 for values decoded from the descriptor alone (bool, null) or not allowed (version marker)
+    table = []
+    for descriptor in range(256):
+        signature = descriptor >> 4
+        flag = descriptor & 0x0f
+
+        if (descriptor == IonBinary.VERSION_MARKER or signature == IonBinary.BOOL_VALUE_SIGNATURE or
+                flag == IonBinary.NULL_FLAG):
+            table.append((-1, 0))
+        elif flag == IonBinary.VARIABLE_LEN_FLAG or descriptor == SORTED_STRUCT_DESCRIPTOR:
+            table.append((signature, -1))
+        else:
+            table.append((signature, flag))
+
+    return tuple(table)
+
+
+SORTED_STRUCT_DESCRIPTOR = (IonBinary.STRUCT_VALUE_SIGNATURE << 4) + IonBinary.SORTED_STRUCT_FLAG
+DESCRIPTOR_TABLE = make_descriptor_table()
+
+
 def descriptor(signature, flag):
     if flag < 0 or flag > 0x0f:
         raise Exception("Serialize bad descriptor flag: %d" % flag)
@@ -484,6 +651,9 @@ def deserialize_unsignedint(data):
     if len(data) > 0 and data[0] == 0:
         raise Exception("BinaryIonInt data padded with 0x00")
 
+    if len(data) <= 8:
+        return int.from_bytes(data, "big")
+
     return struct.unpack_from(">Q", lpad0(data, 8))[0]
 
 
@@ -500,6 +670,10 @@ def deserialize_signedint(data):
     if len(data) == 0:
         return 0
 
+    if len(data) <= 8:
+        value = int.from_bytes(data, "big")
+        return -(value & ~(0x80 << (8 * (len(data) - 1)))) if data[0] & 0x80 else value
+
     if (data[0] & 0x80) != 0:
         return -(struct.unpack_from(">Q", lpad0(and_first_byte(data, 0x7f), 8))[0])
 
@@ -520,13 +694,22 @@ def serialize_vluint(value):
 
 
 def deserialize_vluint(serial):
+    value, serial.offset = decode_vluint(serial.buffer, serial.offset, len(serial.buffer))
+    return value
+
+
+def decode_vluint(buffer, offset, end):
     value = 0
     while True:
-        i = serial.unpack("B")
+        if offset >= end:
+            raise Exception("Deserializer: Insufficient data in IonVLUInt")
+
+        i = buffer[offset]
+        offset += 1
         value = (value << 7) | (i & 0x7f)
 
         if i & 0x80:
-            return value
+            return value, offset
 
         if value == 0:
             raise Exception("IonVLUInt padded with 0x00")
@@ -66,6 +66,7 @@ class LocalSymbolTable(object):
         self.undefined_symbols = set()
         self.unexpected_used_symbols = set()
         self.reported = False
+        self.symbol_cache = {}
         self.clear()
         self.set_translation(None)
 
@@ -78,6 +79,7 @@ class LocalSymbolTable(object):
         self.id_of_symbol = {}
         self.symbol_of_id = {}
         self.unexpected_ids = set()
+        self.symbol_cache.clear()
         self.creating_local_symbols = False
         self.creating_yj_local_symbols = False
 
@@ -215,9 +217,11 @@ class LocalSymbolTable(object):
         if not expected:
             self.unexpected_ids.add(symbol_id)
 
+        self.symbol_cache.clear()
         return symbol_id
 
     def get_symbol(self, symbol_id):
+        # IonBinary keeps the results in symbol_cache, which must be cleared whenever symbol_of_id changes
         if not isinstance(symbol_id, int):
             raise Exception("get_symbol: symbol id must be integer not %s: %s" % (type_name(symbol_id), repr(symbol_id)))
 
@@ -278,6 +282,8 @@ class LocalSymbolTable(object):
             self.symbol_of_id.pop(symbol_id)
             symbol_id += 1
 
+        self.symbol_cache.clear()
+
         self.symbols = self.symbols[:self.local_min_id-1]
 
     def create_import(self, imports_only=False):
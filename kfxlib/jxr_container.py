@@ -111,10 +111,10 @@ class JXRContainer(object):
         else:
             self.image_data = data[image_offset:]
 
-    def unpack_image(self):
+    def unpack_image(self, tile_workers=1):
         jxr_image = JXRImage(self.image_data)
 
-        im = jxr_image.decode()
+        im = jxr_image.decode(tile_workers)
 
         if jxr_image.image_width != self.image_width or jxr_image.image_height != self.image_height:
             log.warning("Expected image size %dx%d but found %dx%d" % (
@@ -1,8 +1,17 @@
+import array
 import collections
-import math
+import concurrent.futures
+import operator
+import pickle
+import sys
 from PIL import Image
 
-from .jxr_misc import (Deserializer, bytes_to_separated_hex)
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .jxr_misc import (Deserializer, HuffmanTable, bytes_to_separated_hex)
 from .message_logging import log
 
 
@@ -13,6 +22,8 @@ DEBUG0 = False
 DEBUG1 = False
 DEBUG2 = False
 
+PARALLEL_MIN_MBS = 1024
+
 
 DC = 0
 LP = 1
@@ -128,7 +139,7 @@ def HBIN(stbl):
     btbl = {}
     for k, v in stbl.items():
         btbl[int("1" + k, 2)] = v
-    return btbl
+    return HuffmanTable(btbl)
 
 
 VAL_DC_YUV = HBIN({"10": 0, "001": 1, "00001": 2, "0001": 3, "11": 4, "010": 5, "00000": 6, "011": 7})
@@ -208,11 +219,11 @@ class JXRImage(object):
         self.data = data
         self.width = self.height = 0
 
-    def decode(self):
+    def decode(self, tile_workers=1):
         try:
             self.ds = Deserializer(self.data)
 
-            self.coded_image()
+            self.coded_image(tile_workers)
 
             if len(self.ds):
                 log.warning("%d of %d bytes remain after coded image" % (len(self.ds), len(self.data)))
@@ -231,7 +242,22 @@ class JXRImage(object):
 
         return im
 
-    def coded_image(self):
+    def coded_image(self, tile_workers=1):
+        self.coded_image_header()
+
+        if tile_workers > 1 and self.parallel_tiles_possible():
+            self.coded_tiles_parallel(tile_workers)
+        else:
+            self.coded_tiles()
+
+        for plane in self.planes:
+            plane.Decode_cleanup()
+
+        self.ds.discard_remainder_bits()
+
+    def coded_image_header(self, decoded_tiles=None):
+        # macroblocks are only allocated for decoded_tiles, if given
+        self.decoded_tiles = decoded_tiles
         self.image_header_decoded = False
         self.planes = []
 
@@ -261,12 +287,7 @@ class JXRImage(object):
                 log.error("unexpected AdditionalBytes: SubsequentBytes(%d) != ProfileBytes(%d)" % (SubsequentBytes, iBytes))
                 self.ds.extract(SubsequentBytes - iBytes)
 
-        self.coded_tiles()
-
-        for plane in self.planes:
-            plane.Decode_cleanup()
-
-        self.ds.discard_remainder_bits()
+        self.first_tile_offset = self.ds.offset
 
     def image_header(self):
         gdi_signature = self.ds.extract(8)
@@ -394,57 +415,116 @@ class JXRImage(object):
                 return iBytes
 
     def coded_tiles(self):
-        first_tile_offset = self.ds.offset
-
-        n = 0
         for Ty in range(self.NumTileRows):
-            top_mb_index = self.TopMBIndexOfTile[Ty]
-            height_mb = self.tile_height_in_mb[Ty]
-
             for Tx in range(self.NumTileCols):
-                try:
-                    left_mb_index = self.LeftMBIndexOfTile[Tx]
-                    width_mb = self.tile_width_in_mb[Tx]
+                self.coded_tile(Tx, Ty)
 
-                    if DEBUG1:
-                        log.info("processing tile %d: Tx=%d Ty=%d, MBx=%d-%d MBy=%d-%d" % (
-                                n, Tx, Ty, left_mb_index, left_mb_index+width_mb-1, top_mb_index, top_mb_index+height_mb-1))
+    def coded_tile(self, Tx, Ty):
+        n = self.tile_index(Tx, Ty)
+        top_mb_index = self.TopMBIndexOfTile[Ty]
+        height_mb = self.tile_height_in_mb[Ty]
+        left_mb_index = self.LeftMBIndexOfTile[Tx]
+        width_mb = self.tile_width_in_mb[Tx]
 
-                    for t, tile_type in enumerate(
-                            [DCTile, LowpassTile, HighpassTile, FlexTile] if self.frequency_mode else [SpatialTile]):
-                        if self.NumBandsOfPrimary > t:
-                            if self.index_table_present_flag:
-                                current_tile_offset = self.ds.offset - first_tile_offset
-                                if self.IndexOffsetTile[n] != current_tile_offset:
-                                    log.warning("Tile %d index table offset (%d) != current offset (%d)" % (
-                                                n, self.IndexOffsetTile[n], current_tile_offset))
+        try:
+            if DEBUG1:
+                log.info("processing tile %d: Tx=%d Ty=%d, MBx=%d-%d MBy=%d-%d" % (
+                        n, Tx, Ty, left_mb_index, left_mb_index+width_mb-1, top_mb_index, top_mb_index+height_mb-1))
+
+            for t, tile_type in enumerate(
+                    [DCTile, LowpassTile, HighpassTile, FlexTile] if self.frequency_mode else [SpatialTile]):
+                if self.NumBandsOfPrimary > t:
+                    if self.index_table_present_flag:
+                        current_tile_offset = self.ds.offset - self.first_tile_offset
+                        if self.IndexOffsetTile[n] != current_tile_offset:
+                            log.warning("Tile %d index table offset (%d) != current offset (%d)" % (
+                                        n, self.IndexOffsetTile[n], current_tile_offset))
 
-                                    self.ds.offset = first_tile_offset + self.IndexOffsetTile[n]
+                            self.ds.offset = self.first_tile_offset + self.IndexOffsetTile[n]
 
-                            tile = tile_type(self.ds)
-                            tile.common_tile_header()
+                    tile = tile_type(self.ds)
+                    tile.common_tile_header()
 
+                    for plane in self.planes:
+                        tile.tile_plane_header(plane)
+
+                    for MBy in range(top_mb_index, top_mb_index+height_mb):
+                        for MBx in range(left_mb_index, left_mb_index+width_mb):
                             for plane in self.planes:
-                                tile.tile_plane_header(plane)
-
-                            for MBy in range(top_mb_index, top_mb_index+height_mb):
-                                for MBx in range(left_mb_index, left_mb_index+width_mb):
-                                    for plane in self.planes:
-                                        if DEBUG1:
-                                            log.info("****************************\nprocessing %s tile MBx=%d MBy=%d" % (
-                                                    tile.tile_type, MBx, MBy))
-
-                                        try:
-                                            tile.tile_MB(plane, plane.Mb[MBx][MBy])
-                                        except Exception:
-                                            log.info("Error processing %s tile MBx=%d MBy=%d" % (tile.tile_type, MBx, MBy))
-                                            raise
-
-                            tile.common_tile_finish()
-                            n += 1
-                except Exception:
-                    log.info("Error processing tile %d Tx=%d Ty=%d" % (n, Tx, Ty))
-                    raise
+                                if DEBUG1:
+                                    log.info("****************************\nprocessing %s tile MBx=%d MBy=%d" % (
+                                            tile.tile_type, MBx, MBy))
+
+                                try:
+                                    tile.tile_MB(plane, plane.Mb[MBx][MBy])
+                                except Exception:
+                                    log.info("Error processing %s tile MBx=%d MBy=%d" % (tile.tile_type, MBx, MBy))
+                                    raise
+
+                    tile.common_tile_finish()
+                    n += 1
+        except Exception:
+            log.info("Error processing tile %d Tx=%d Ty=%d" % (n, Tx, Ty))
+            raise
+
+    def tile_index(self, Tx, Ty):
+        # index table entry of the first band of a tile
+        return (Ty * self.NumTileCols + Tx) * (self.NumBandsOfPrimary if self.frequency_mode else 1)
+
+    def tile_mbs(self, Tx, Ty):
+        return [(MBx, MBy) for MBy in range(self.TopMBIndexOfTile[Ty], self.TopMBIndexOfTile[Ty+1])
+                for MBx in range(self.LeftMBIndexOfTile[Tx], self.LeftMBIndexOfTile[Tx+1])]
+
+    def parallel_tiles_possible(self):
+        # spatial mode tiles are entropy coded independently of each other and can be located using the index table
+        return (self.index_table_present_flag and not self.frequency_mode and self.NumTileRows * self.NumTileCols > 1 and
+                self.MBWidth * self.MBHeight >= PARALLEL_MIN_MBS)
+
+    def coded_tiles_parallel(self, tile_workers):
+        # each worker decodes a group of tiles to coefficients, which are stitched back into the macroblocks here.
+        # sample reconstruction, including overlap filtering across tile boundaries, then runs on the whole image.
+        tiles = [(Tx, Ty) for Ty in range(self.NumTileRows) for Tx in range(self.NumTileCols)]
+        tile_workers = min(tile_workers, len(tiles))
+        mbs_per_group = (self.MBWidth * self.MBHeight + tile_workers - 1) // tile_workers
+
+        tile_groups = [[]]
+        group_mbs = 0
+        for Tx, Ty in tiles:
+            if group_mbs >= mbs_per_group:
+                tile_groups.append([])
+                group_mbs = 0
+
+            tile_groups[-1].append((Tx, Ty))
+            group_mbs += self.tile_width_in_mb[Tx] * self.tile_height_in_mb[Ty]
+
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=len(tile_groups)) as pool:
+                results = list(pool.map(decode_tiles, [self.data] * len(tile_groups), tile_groups))
+        except (OSError, RuntimeError, ImportError, concurrent.futures.process.BrokenProcessPool, pickle.PicklingError) as e:
+            log.warning("Parallel JPEG-XR tile decoding unavailable (%s), decoding sequentially" % repr(e))
+            self.coded_tiles()
+            return
+
+        end_offset = self.first_tile_offset
+        for group_result in results:
+            for Tx, Ty, tile_end_offset, plane_buffers in group_result:
+                end_offset = max(end_offset, tile_end_offset)
+                for plane, buffers in zip(self.planes, plane_buffers):
+                    for (MBx, MBy), buffer in zip(self.tile_mbs(Tx, Ty), buffers):
+                        plane.Mb[MBx][MBy].MBBuffer = buffer
+
+        self.ds.offset = end_offset
+
+    def decode_tile_group(self, tiles):
+        result = []
+        for Tx, Ty in tiles:
+            self.ds.offset = self.first_tile_offset + self.IndexOffsetTile[self.tile_index(Tx, Ty)]
+            self.coded_tile(Tx, Ty)
+
+            mbs = self.tile_mbs(Tx, Ty)
+            result.append((Tx, Ty, self.ds.offset, [[plane.Mb[MBx][MBy].MBBuffer for MBx, MBy in mbs] for plane in self.planes]))
+
+        return result
 
     def construct_image(self):
         if ((self.output_clr_fmt == RGB and self.alpha_plane is not None) or
@@ -471,46 +551,40 @@ class JXRImage(object):
             raise Exception("Color format %s with %d components is not supported" % (
                     OUTPUT_COLOR_NAME[self.output_clr_fmt], self.primary_plane.NumComponents))
 
-        im = Image.new(mode, (self.image_width, self.image_height))
-        pixels = im.load()
-
-        if mode == "RGBA":
-            r_data = self.primary_plane.ImagePlane[0]
-            g_data = self.primary_plane.ImagePlane[1]
-            b_data = self.primary_plane.ImagePlane[2]
-            a_data = self.primary_plane.ImagePlane[3] if self.output_clr_fmt == NCOMPONENT else self.alpha_plane.ImagePlane[0]
-
-            for y in range(self.image_height):
-                for x in range(self.image_width):
-                    pixels[x, y] = (r_data[x][y], g_data[x][y], b_data[x][y], a_data[x][y]) if self.output_bitdepth == BD8 else \
-                        (r_data[x][y] >> 8, g_data[x][y] >> 8, b_data[x][y] >> 8, a_data[x][y] >> 8)
-
-        elif mode == "RGB":
-            r_data = self.primary_plane.ImagePlane[0]
-            g_data = self.primary_plane.ImagePlane[1]
-            b_data = self.primary_plane.ImagePlane[2]
+        if mode in ["RGBA", "RGB"]:
+            planes = self.primary_plane.ImagePlane[:3]
+            if mode == "RGBA":
+                planes.append(self.primary_plane.ImagePlane[3] if self.output_clr_fmt == NCOMPONENT else self.alpha_plane.ImagePlane[0])
 
-            for y in range(self.image_height):
-                for x in range(self.image_width):
-                    pixels[x, y] = (r_data[x][y], g_data[x][y], b_data[x][y]) if self.output_bitdepth == BD8 else \
-                        (r_data[x][y] >> 8, g_data[x][y] >> 8, b_data[x][y] >> 8)
+            return Image.merge(mode, [self.plane_image(plane, 8 if self.output_bitdepth == BD16 else 0) for plane in planes])
 
-        elif mode == "1":
-            y_data = self.primary_plane.ImagePlane[0]
+        if mode == "I;16":
+            return self.plane_image(self.primary_plane.ImagePlane[0], 0, mode)
 
-            for y in range(self.image_height):
-                for x in range(self.image_width):
-                    pixels[x, y] = y_data[x][y] * 255
+        im = self.plane_image(self.primary_plane.ImagePlane[0], 0)
+        return im.point([0] + [255] * 255, "1") if mode == "1" else im
 
+    def plane_image(self, plane, shift, mode="L"):
+        # build an image band from a plane of clipped output values, shifted down to 8 bits if needed
+        if np is not None:
+            plane = plane >> shift if shift else plane
+            data = plane.astype(np.uint8 if mode == "L" else "<u2").tobytes()
+        elif mode == "L":
+            data = b"".join(bytes([v >> shift for v in row] if shift else row) for row in plane)
         else:
-            y_data = self.primary_plane.ImagePlane[0]
+            data = array.array("H", [v for row in plane for v in row])
+            if sys.byteorder != "little":
+                data.byteswap()
 
-            for y in range(self.image_height):
-                for x in range(self.image_width):
-                    pixels[x, y] = y_data[x][y]
+        return Image.frombuffer(mode, (self.image_width, self.image_height), data, "raw", mode, 0, 1)
 
-        del pixels
-        return im
+
+def decode_tiles(data, tiles):
+    # runs in a worker process, the image header is parsed again to set up the planes
+    jxr_image = JXRImage(data)
+    jxr_image.ds = Deserializer(data)
+    jxr_image.coded_image_header(set(tiles))
+    return jxr_image.decode_tile_group(tiles)
 
 
 class ImgPlane(object):
@@ -600,6 +674,9 @@ class ImgPlane(object):
             first_MBx = image.LeftMBIndexOfTile[Tx]
             tile_mb_width = image.tile_width_in_mb[Tx]
             for Ty in range(image.NumTileRows):
+                if image.decoded_tiles is not None and (Tx, Ty) not in image.decoded_tiles:
+                    continue
+
                 first_MBy = image.TopMBIndexOfTile[Ty]
                 tile_mb_hight = image.tile_height_in_mb[Ty]
 
@@ -611,8 +688,6 @@ class ImgPlane(object):
                                 MBx, MBy, MBxt, MByt, tile_mb_width, self.NumComponents,
                                 self.Mb[MBx-1][MBy] if MBx > 0 else None, self.Mb[MBx][MBy-1] if MBy > 0 else None)
 
-        self.image_data = Array(self.NumComponents, self.image.width, self.image.height)
-
         self.ds.discard_remainder_bits()
 
         if DEBUG0:
@@ -648,6 +723,23 @@ class ImgPlane(object):
             self.second_level_overlap_filtering()
 
     def FirstLevelInverseTransform(self):
+        if np is not None:
+            # from here on the MB buffers of each component are held in one array, indexed [MBy, MBx, block, coefficient],
+            # and the DC/LP coefficients of all macroblocks are transformed at once
+            self.MBPlanes = []
+            for i in range(self.NumComponents):
+                mbp = np.array(
+                    [[self.Mb[MBx][MBy].MBBuffer[i] for MBx in range(self.image.MBWidth)] for MBy in range(self.image.MBHeight)],
+                    dtype=np.int64).reshape(self.image.MBHeight, self.image.MBWidth, 16, 16)
+
+                DCLP1 = strIDCT4x4Stage2([mbp[:, :, j, 0].copy() for j in range(16)])
+                for j in range(16):
+                    mbp[:, :, j, 0] = DCLP1[j] * 2 if i > 0 and self.scaled_flag else DCLP1[j]
+
+                self.MBPlanes.append(mbp)
+
+            return
+
         for i in range(self.NumComponents):
             for MBy in range(self.image.MBHeight):
                 for MBx in range(self.image.MBWidth):
@@ -673,6 +765,17 @@ class ImgPlane(object):
                         mbp[j*16] = DCLP1[j]
 
     def FirstLevelOverlapFiltering(self):
+        if np is not None:
+            # the DC coefficients of the 4x4 blocks laid out as a plane, indexed [y, x] in blocks, are filtered the
+            # same way as the pixels are in the second level, with macroblocks of 4 blocks
+            for mbp in self.MBPlanes:
+                dc = mbp.reshape(self.image.MBHeight, self.image.MBWidth, 4, 4, 16)[..., 0]
+                plane = np.ascontiguousarray(dc.transpose(0, 3, 1, 2)).reshape(self.image.MBHeight * 4, self.image.MBWidth * 4)
+                self.overlap_filtering(plane, 4, strPost4x4Stage2Split_alternate)
+                dc[...] = plane.reshape(self.image.MBHeight, 4, self.image.MBWidth, 4).transpose(0, 2, 3, 1)
+
+            return
+
         image = self.image
 
         LE1 = [(0, 0, 8), (0, 0, 12), (0, 1, 0), (0, 1, 4)]
@@ -791,133 +894,160 @@ class ImgPlane(object):
                             OverlapPostFilter4_(last_MBx, last_MBy, BE2)
 
     def SecondLevelInverseTransform(self):
+        if np is not None:
+            # transform all blocks of a component at once, each coefficient held in an array over the blocks
+            for mbp in self.MBPlanes:
+                coeff1 = strIDCT4x4Stage1([mbp[:, :, :, k].copy() for k in range(16)])
+                for k in range(16):
+                    mbp[:, :, :, k] = coeff1[k]
+
+            return
+
         for i in range(self.NumComponents):
             for MBy in range(self.image.MBHeight):
                 for MBx in range(self.image.MBWidth):
                     mbp = self.Mb[MBx][MBy].MBBuffer[i]
 
-                    for j in range(0, 16):
-                        coeff0 = [mbp[j*16+k] for k in range(16)]
+                    for j in range(0, 256, 16):
+                        coeff0 = mbp[j:j+16]
                         if DEBUG1:
-                            log.info("MB[%d,%d] COEF[%d]0=%s" % (MBx, MBy, j, ", ".join(["%d" % z for z in coeff0])))
+                            log.info("MB[%d,%d] COEF[%d]0=%s" % (MBx, MBy, j >> 4, ", ".join(["%d" % z for z in coeff0])))
 
                         coeff1 = strIDCT4x4Stage1(coeff0)
                         if DEBUG1:
-                            log.info("MB[%d,%d] COEF[%d]1=%s" % (MBx, MBy, j, ", ".join(["%d" % z for z in coeff1])))
+                            log.info("MB[%d,%d] COEF[%d]1=%s" % (MBx, MBy, j >> 4, ", ".join(["%d" % z for z in coeff1])))
 
-                        for k in range(16):
-                            mbp[j*16+k] = coeff1[k]
+                        mbp[j:j+16] = coeff1
 
     def SecondLevelCoefficientCombination(self):
-        self.ImagePlane = Array(self.NumComponents, self.image.width, self.image.height, None)
+        # image planes are stored by row, ImagePlane[i][y][x]
+        self.ImagePlane = []
+
+        if np is not None:
+            for mbp in self.MBPlanes:
+                # MB buffer index is (bx * 4 + by) * 16 + mb_pixel_map[px + py * 4]
+                pixels = mbp.reshape(self.image.MBHeight, self.image.MBWidth, 4, 4, 16)[..., mb_pixel_map]
+                pixels = pixels.reshape(self.image.MBHeight, self.image.MBWidth, 4, 4, 4, 4).transpose(0, 3, 4, 1, 2, 5)
+                self.ImagePlane.append(np.ascontiguousarray(pixels).reshape(self.image.height, self.image.width))
+
+            del self.MBPlanes
+            del self.Mb
+            return
+
+        row_getters = [operator.itemgetter(*[((px >> 2) << 6) + ((py >> 2) << 4) + mb_pixel_map[(px & 3) + ((py & 3) << 2)]
+                                             for px in range(16)]) for py in range(16)]
 
         for i in range(self.NumComponents):
-            ip = self.ImagePlane[i]
+            ip = []
             for MBy in range(self.image.MBHeight):
-                MByy = MBy << 4
-                for MBx in range(self.image.MBWidth):
-                    MBxx = MBx << 4
-                    mbp = self.Mb[MBx][MBy].MBBuffer[i]
+                mbps = [self.Mb[MBx][MBy].MBBuffer[i] for MBx in range(self.image.MBWidth)]
+                for row_getter in row_getters:
+                    row = []
+                    for mbp in mbps:
+                        row.extend(row_getter(mbp))
 
-                    for by in range(4):
-                        by_x4 = MByy + (by << 2)
-                        by_x16 = by << 4
-                        for bx in range(4):
-                            bx_x4 = MBxx + (bx << 2)
-                            bx_x64 = bx << 6
+                    ip.append(row)
 
-                            for py in range(4):
-                                py_x4 = py << 2
-                                for px in range(4):
-                                    ip[bx_x4+px][by_x4+py] = mbp[by_x16+bx_x64+mb_pixel_map[px+py_x4]]
+            self.ImagePlane.append(ip)
 
         del self.Mb
 
     def second_level_overlap_filtering(self):
+        for i in range(self.NumComponents):
+            self.overlap_filtering(self.ImagePlane[i], 16, OverlapPostFilter4x4)
+
+    def overlap_filtering(self, ip, mb_size, filter4x4):
+        # filters the plane ip[y][x] holding mb_size values per macroblock in each direction
+        # x and y are either a position or a range of positions, filtered all at once when using NumPy
+        # since the values filtered at each position do not overlap
+
+        def call_filter(filter_fn, x, y, xy_list):
+            if np is not None:
+                slices = [(offset_slice(y, yy), offset_slice(x, xx)) for xx, yy in xy_list]
+                arrayLocal = filter_fn([ip[sl].copy() for sl in slices])
+                for sl, value in zip(slices, arrayLocal):
+                    ip[sl] = value
+
+                return
+
+            for x1 in (x if isinstance(x, range) else [x]):
+                for y1 in (y if isinstance(y, range) else [y]):
+                    arrayLocal = filter_fn([ip[y1+yy][x1+xx] for xx, yy in xy_list])
+                    for (xx, yy), value in zip(xy_list, arrayLocal):
+                        ip[y1+yy][x1+xx] = value
+
         def OverlapPostFilter4x4_(x, y, xy_list):
-            arrayLocal = OverlapPostFilter4x4([ip[x+xx][y+yy] for xx, yy in xy_list])
-            for xx, yy in xy_list:
-                ip[x+xx][y+yy] = arrayLocal.pop(0)
+            call_filter(filter4x4, x, y, xy_list)
 
         def OverlapPostFilter4_(x, y, xy_list):
-            arrayLocal = OverlapPostFilter4([ip[x+xx][y+yy] for xx, yy in xy_list])
-            for xx, yy in xy_list:
-                ip[x+xx][y+yy] = arrayLocal.pop(0)
+            call_filter(OverlapPostFilter4, x, y, xy_list)
 
         image = self.image
-        for i in range(self.NumComponents):
-            ip = self.ImagePlane[i]
+        for Tx in range(image.NumTileCols):
+            for Ty in range(image.NumTileRows):
+                first_MBx = image.LeftMBIndexOfTile[Tx]*mb_size
+                next_MBx = image.LeftMBIndexOfTile[Tx+1]*mb_size
+                first_MBy = image.TopMBIndexOfTile[Ty]*mb_size
+                next_MBy = image.TopMBIndexOfTile[Ty+1]*mb_size
 
-            for Tx in range(image.NumTileCols):
-                for Ty in range(image.NumTileRows):
-                    first_MBx = image.LeftMBIndexOfTile[Tx]*16
-                    next_MBx = image.LeftMBIndexOfTile[Tx+1]*16
-                    first_MBy = image.TopMBIndexOfTile[Ty]*16
-                    next_MBy = image.TopMBIndexOfTile[Ty+1]*16
+                x_range = range(first_MBx+2, next_MBx-2, 4)
+                y_range = range(first_MBy+2, next_MBy-2, 4)
 
-                    for x in range(first_MBx+2, next_MBx-2, 4):
-                        for y in range(first_MBy+2, next_MBy-2, 4):
-                            OverlapPostFilter4x4_(x, y, XY4)
+                OverlapPostFilter4x4_(x_range, y_range, XY4)
 
-                    if Tx == 0 or image.hard_tiling_flag:
-                        for y in range(first_MBy+2, next_MBy-2, 4):
-                            for xx in [0, 1]:
-                                OverlapPostFilter4_(first_MBx+xx, y, Y4)
+                if Tx == 0 or image.hard_tiling_flag:
+                    for xx in [0, 1]:
+                        OverlapPostFilter4_(first_MBx+xx, y_range, Y4)
 
-                    if Ty == 0 or image.hard_tiling_flag:
-                        for x in range(first_MBx+2, next_MBx-2, 4):
-                            for yy in [0, 1]:
-                                OverlapPostFilter4_(x, first_MBy+yy, X4)
+                if Ty == 0 or image.hard_tiling_flag:
+                    for yy in [0, 1]:
+                        OverlapPostFilter4_(x_range, first_MBy+yy, X4)
 
-                    if Tx == image.NumTileCols-1 or image.hard_tiling_flag:
-                        for y in range(first_MBy+2, next_MBy-2, 4):
-                            for xx in [-2, -1]:
-                                OverlapPostFilter4_(next_MBx+xx, y, Y4)
+                if Tx == image.NumTileCols-1 or image.hard_tiling_flag:
+                    for xx in [-2, -1]:
+                        OverlapPostFilter4_(next_MBx+xx, y_range, Y4)
 
-                    if Ty == image.NumTileRows-1 or image.hard_tiling_flag:
-                        for x in range(first_MBx+2, next_MBx-2, 4):
-                            for yy in [-2, -1]:
-                                OverlapPostFilter4_(x, next_MBy+yy, X4)
+                if Ty == image.NumTileRows-1 or image.hard_tiling_flag:
+                    for yy in [-2, -1]:
+                        OverlapPostFilter4_(x_range, next_MBy+yy, X4)
 
-                    if (Tx == 0 and Ty == 0) or image.hard_tiling_flag:
-                        OverlapPostFilter4_(first_MBx, first_MBy, XY2)
+                if (Tx == 0 and Ty == 0) or image.hard_tiling_flag:
+                    OverlapPostFilter4_(first_MBx, first_MBy, XY2)
 
-                    if (Tx == image.NumTileCols-1 and Ty == 0) or image.hard_tiling_flag:
-                        OverlapPostFilter4_(next_MBx-2, first_MBy, XY2)
+                if (Tx == image.NumTileCols-1 and Ty == 0) or image.hard_tiling_flag:
+                    OverlapPostFilter4_(next_MBx-2, first_MBy, XY2)
 
-                    if (Tx == 0 and Ty == image.NumTileRows-1) or image.hard_tiling_flag:
-                        OverlapPostFilter4_(first_MBx, next_MBy-2, XY2)
+                if (Tx == 0 and Ty == image.NumTileRows-1) or image.hard_tiling_flag:
+                    OverlapPostFilter4_(first_MBx, next_MBy-2, XY2)
 
-                    if (Tx == image.NumTileCols-1 and Ty == image.NumTileRows-1) or image.hard_tiling_flag:
-                        OverlapPostFilter4_(next_MBx-2, next_MBy-2, XY2)
+                if (Tx == image.NumTileCols-1 and Ty == image.NumTileRows-1) or image.hard_tiling_flag:
+                    OverlapPostFilter4_(next_MBx-2, next_MBy-2, XY2)
 
-                    if not image.hard_tiling_flag:
-                        if Tx != image.NumTileCols-1:
-                            for y in range(first_MBy+2, next_MBy-2, 4):
-                                OverlapPostFilter4x4_(next_MBx-2, y, XY4)
+                if not image.hard_tiling_flag:
+                    if Tx != image.NumTileCols-1:
+                        OverlapPostFilter4x4_(next_MBx-2, y_range, XY4)
 
-                        if Ty != image.NumTileRows-1:
-                            for x in range(first_MBx+2, next_MBx-2, 4):
-                                OverlapPostFilter4x4_(x, next_MBy-2, XY4)
+                    if Ty != image.NumTileRows-1:
+                        OverlapPostFilter4x4_(x_range, next_MBy-2, XY4)
 
-                        if Tx != image.NumTileCols-1 and Ty != image.NumTileRows-1:
-                            OverlapPostFilter4x4_(next_MBx-2, next_MBy-2, XY4)
+                    if Tx != image.NumTileCols-1 and Ty != image.NumTileRows-1:
+                        OverlapPostFilter4x4_(next_MBx-2, next_MBy-2, XY4)
 
-                        if Tx == 0 and Ty != image.NumTileRows-1:
-                            for xx in range(2):
-                                OverlapPostFilter4_(first_MBx+xx, next_MBy-2, Y4)
+                    if Tx == 0 and Ty != image.NumTileRows-1:
+                        for xx in range(2):
+                            OverlapPostFilter4_(first_MBx+xx, next_MBy-2, Y4)
 
-                        if Tx != image.NumTileCols-1 and Ty == 0:
-                            for yy in range(2):
-                                OverlapPostFilter4_(next_MBx-2, first_MBy+yy, X4)
+                    if Tx != image.NumTileCols-1 and Ty == 0:
+                        for yy in range(2):
+                            OverlapPostFilter4_(next_MBx-2, first_MBy+yy, X4)
 
-                        if Tx == image.NumTileCols-1 and Ty != image.NumTileRows-1:
-                            for xx in [-2, -1]:
-                                OverlapPostFilter4_(next_MBx+xx, next_MBy-2, Y4)
+                    if Tx == image.NumTileCols-1 and Ty != image.NumTileRows-1:
+                        for xx in [-2, -1]:
+                            OverlapPostFilter4_(next_MBx+xx, next_MBy-2, Y4)
 
-                        if Tx != image.NumTileCols-1 and Ty == image.NumTileRows-1:
-                            for yy in [-2, -1]:
-                                OverlapPostFilter4_(next_MBx-2, next_MBy+yy, X4)
+                    if Tx != image.NumTileCols-1 and Ty == image.NumTileRows-1:
+                        for yy in [-2, -1]:
+                            OverlapPostFilter4_(next_MBx-2, next_MBy+yy, X4)
 
     def OutputFormatting(self):
         self.ConvertInternalToOutputClrFmt()
@@ -932,30 +1062,34 @@ class ImgPlane(object):
                 raise Exception("Color format of alpha plane must by YONLY")
 
         elif self.internal_clr_fmt == YONLY and self.image.output_clr_fmt == RGB:
-            self.ImagePlane.append(Array(self.image.width, self.image.height, None))
-            self.ImagePlane.append(Array(self.image.width, self.image.height, None))
-
-            for y in range(self.image.height):
-                for x in range(self.image.width):
-                    self.ImagePlane[1][x][y] = self.ImagePlane[2][x][y] = self.ImagePlane[0][x][y]
+            for i in range(2):
+                self.ImagePlane.append(self.ImagePlane[0].copy() if np is not None else [row[:] for row in self.ImagePlane[0]])
 
             self.internal_clr_fmt == RGB
             self.NumComponents = 3
 
         elif self.internal_clr_fmt == YUV444 and self.image.output_clr_fmt == RGB:
             do_swap = self.image.output_bitdepth in [BD5, BD565, BD10] and not self.image.red_blue_not_swapped_flag
-            for y in range(self.image.height):
-                for x in range(self.image.width):
-                    tempT = -self.ImagePlane[1][x][y]
-                    Out1 = self.ImagePlane[0][x][y] - int(math.floor(tempT / 2))
-                    Out0 = tempT + Out1 - int(math.ceil(self.ImagePlane[2][x][y] / 2))
-                    Out2 = self.ImagePlane[2][x][y] + Out0
-
-                    if do_swap:
-                        Out0, Out2 = (Out2, Out0)
-
-                    self.ImagePlane[0][x][y], self.ImagePlane[1][x][y], self.ImagePlane[2][x][y] = (Out0, Out1, Out2)
 
+            # with tempT = -U, Y - floor(tempT / 2) is Y + ceil(U / 2) and ceil(x / 2) is (x + 1) >> 1
+            if np is not None:
+                Y, U, V = self.ImagePlane[0:3]
+                Out1 = Y + ((U + 1) >> 1)
+                Out0 = Out1 - U - ((V + 1) >> 1)
+                rgb = [Out0, Out1, V + Out0]
+            else:
+                rgb = [[], [], []]
+                for Y_row, U_row, V_row in zip(self.ImagePlane[0], self.ImagePlane[1], self.ImagePlane[2]):
+                    Out1_row = [Y + ((U + 1) >> 1) for Y, U in zip(Y_row, U_row)]
+                    Out0_row = [Out1 - U - ((V + 1) >> 1) for Out1, U, V in zip(Out1_row, U_row, V_row)]
+                    rgb[0].append(Out0_row)
+                    rgb[1].append(Out1_row)
+                    rgb[2].append([V + Out0 for V, Out0 in zip(V_row, Out0_row)])
+
+            if do_swap:
+                rgb[0], rgb[2] = (rgb[2], rgb[0])
+
+            self.ImagePlane[0:3] = rgb
             self.internal_clr_fmt == RGB
 
         elif INTERNAL_COLOR_NAME[self.internal_clr_fmt] != OUTPUT_COLOR_NAME[self.image.output_clr_fmt]:
@@ -972,11 +1106,10 @@ class ImgPlane(object):
 
         if iBias:
             for i in range(self.NumComponents):
-                ip = self.ImagePlane[i]
-                for x in range(0, self.image.width):
-                    ipx = ip[x]
-                    for y in range(0, self.image.height):
-                        ipx[y] += iBias
+                if np is not None:
+                    self.ImagePlane[i] += iBias
+                else:
+                    self.ImagePlane[i] = [[v + iBias for v in row] for row in self.ImagePlane[i]]
 
     def ComputeScaling(self):
         iScale = 0
@@ -991,15 +1124,15 @@ class ImgPlane(object):
         outputComponents = 3 if self.internal_clr_fmt in [RGB, RGBE, YUV444] else self.NumComponents
         for i in range(outputComponents):
             jScale = iScale + 1 if self.image.output_bitdepth == BD565 and i != 1 else iScale
-            ip = self.ImagePlane[i]
 
             if iRoundingFactor or jScale:
                 if DEBUG1:
                     log.info("rounding factor = %d, scale = %d" % (iRoundingFactor, jScale))
 
-                for y in range(self.image.height):
-                    for x in range(self.image.width):
-                        ip[x][y] = (ip[x][y] + iRoundingFactor) >> jScale
+                if np is not None:
+                    self.ImagePlane[i] = (self.ImagePlane[i] + iRoundingFactor) >> jScale
+                else:
+                    self.ImagePlane[i] = [[(v + iRoundingFactor) >> jScale for v in row] for row in self.ImagePlane[i]]
 
     def PostscalingProcess(self):
         if self.image.output_clr_fmt == RGBE:
@@ -1012,9 +1145,10 @@ class ImgPlane(object):
 
             if self.image.output_bitdepth in [BD16, BD16S, BD32S] and self.shift_bits != 0:
                 for i in range(self.NumComponents):
-                    for y in range(self.image.height):
-                        for x in range(self.image.width):
-                            self.ImagePlane[i][x][y] = self.ImagePlane[i][x][y] << self.shift_bits
+                    if np is not None:
+                        self.ImagePlane[i] = self.ImagePlane[i] << self.shift_bits
+                    else:
+                        self.ImagePlane[i] = [[v << self.shift_bits for v in row] for row in self.ImagePlane[i]]
 
     def ClippingAndPackingStage(self):
 
@@ -1028,21 +1162,16 @@ class ImgPlane(object):
             n = self.image.ExtraPixelsTop
             m = self.image.ExtraPixelsLeft
 
+            # planes are cropped to the output image size here
             for i in range(self.NumComponents):
                 ip = self.ImagePlane[i]
 
-                if m == 0 and n == 0:
-                    for y in range(outputHeight):
-                        for x in range(outputWidth):
-                            v = ip[x][y]
-                            if v < clip_low:
-                                ip[x][y] = clip_low
-                            if v > clip_high:
-                                ip[x][y] = clip_high
+                if np is not None:
+                    self.ImagePlane[i] = np.clip(ip[n:n+outputHeight, m:m+outputWidth], clip_low, clip_high)
                 else:
-                    for y in range(outputHeight):
-                        for x in range(outputWidth):
-                            ip[x][y] = Clip(ip[x+m][y+n], clip_low, clip_high)
+                    self.ImagePlane[i] = [
+                        [clip_low if v < clip_low else (clip_high if v > clip_high else v) for v in row[m:m+outputWidth]]
+                        for row in ip[n:n+outputHeight]]
         else:
             raise Exception("Output bit depth %s is not supported" % (OUTPUT_BITDEPTH_NAME[self.image.output_bitdepth]))
 
@@ -2244,6 +2373,13 @@ def Clip(x, iLow, iHigh):
     return x
 
 
+def offset_slice(v, offset):
+    if isinstance(v, range):
+        return slice(v.start + offset, v.stop + offset, v.step)
+
+    return slice(v + offset, v + offset + 1)
+
+
 def Array(*args):
     if len(args) == 2:
         init = args[1]
@@ -9,14 +9,60 @@ __copyright__ = "2016-2025, John Howell <jhowell@acm.org>"
 
 DEBUG = False
 
+ACCUMULATOR_BITS = 64
+
+
+class HuffmanTable(dict):
+    # maps codes (with a leading 1 bit) to values, plus a lookup table indexed by the next max code length bits
+    # that gives the (value, code length) of the code found there, or None if the bits do not start with a code
+
+    def __init__(self, codes):
+        dict.__init__(self, codes)
+        self.bits = max(code.bit_length() for code in codes) - 1
+        self.lookup = [None] * (1 << self.bits)
+
+        for code, value in sorted(codes.items(), reverse=True):
+            size = code.bit_length() - 1
+            first = (code - (1 << size)) << (self.bits - size)
+            self.lookup[first:first + (1 << (self.bits - size))] = [(value, size)] * (1 << (self.bits - size))
+
 
 class Deserializer(object):
+    # bits are read ahead into an accumulator, the whole bytes of which are given back before any byte-level access
+
     def __init__(self, data):
         self.buffer = data
-        self.offset = 0
+        self.byte_offset = 0
         self.bits_remaining = self.remainder = 0
 
+    @property
+    def offset(self):
+        return self.byte_offset - (self.bits_remaining >> 3)
+
+    @offset.setter
+    def offset(self, value):
+        self.return_whole_bytes()
+        self.byte_offset = value
+
+    def return_whole_bytes(self):
+        if self.bits_remaining >= 8:
+            self.byte_offset -= self.bits_remaining >> 3
+            self.bits_remaining &= 7
+            self.remainder &= (1 << self.bits_remaining) - 1
+
+    def fill_bits(self, size):
+        count = max(ACCUMULATOR_BITS - self.bits_remaining, size - self.bits_remaining + 7) >> 3
+        data = self.buffer[self.byte_offset:self.byte_offset + count]
+        self.remainder = (self.remainder << (len(data) * 8)) | int.from_bytes(data, "big")
+        self.bits_remaining += len(data) * 8
+        self.byte_offset += len(data)
+
+        if self.bits_remaining < size:
+            raise Exception("Deserializer: Insufficient data (need %d bits, have %d bits)" % (size, self.bits_remaining))
+
     def extract(self, size=None, upto=None, advance=True, check_remaining=True):
+        self.return_whole_bytes()
+
         if check_remaining and self.bits_remaining:
             raise Exception("Deserializer: unexpected %d bit remaining" % self.bits_remaining)
 
@@ -34,6 +80,8 @@ class Deserializer(object):
         return data
 
     def unpack(self, fmt, name="", advance=True):
+        self.return_whole_bytes()
+
         if self.bits_remaining:
             raise Exception("Deserializer: unexpected %d bit remaining" % self.bits_remaining)
 
@@ -48,18 +96,12 @@ class Deserializer(object):
         return result
 
     def unpack_bits(self, size, name=""):
-
-        while self.bits_remaining < size:
-            self.remainder = (self.remainder << 8) + ord(self.extract(1, check_remaining=False))
-            self.bits_remaining += 8
+        if self.bits_remaining < size:
+            self.fill_bits(size)
 
         self.bits_remaining -= size
         value = self.remainder >> self.bits_remaining
-
-        if value > (1 << size) - 1:
-            raise Exception()
-
-        self.remainder = self.remainder & (0xff >> (8 - self.bits_remaining))
+        self.remainder &= (1 << self.bits_remaining) - 1
 
         if DEBUG:
             log.info("%d: unpack_bits(%d)=%u (%s) %s" % (self.offset, size, value, ("{0:0%sb}" % size).format(value), name))
@@ -70,7 +112,7 @@ class Deserializer(object):
         return self.unpack_bits(1, name) == 1
 
     def push_bit(self, value):
-        self.remainder &= (value & 1) << self.bits_remaining
+        self.remainder |= (value & 1) << self.bits_remaining
         self.bits_remaining += 1
 
     def check_bit_field(self, size, name, expected_values, name_table={}):
@@ -87,6 +129,24 @@ class Deserializer(object):
         return value
 
     def huff(self, table, name):
+        if self.bits_remaining < table.bits:
+            self.fill_bits(0)
+
+        if self.bits_remaining >= table.bits:
+            entry = table.lookup[self.remainder >> (self.bits_remaining - table.bits)]
+            if entry is None:
+                raise Exception("decode using huffman table failed")
+
+            value, size = entry
+            self.bits_remaining -= size
+            self.remainder &= (1 << self.bits_remaining) - 1
+
+            if DEBUG:
+                log.info("%d: huff(%d bits)=%s %s" % (self.offset, size, repr(value), name))
+
+            return value
+
+        # too few bits left in the data for a table lookup
         k = 1
         while k <= 0xff:
             k = (k << 1) + self.unpack_bits(1, name)
@@ -97,6 +157,7 @@ class Deserializer(object):
         raise Exception("decode using huffman table failed")
 
     def discard_remainder_bits(self):
+        self.return_whole_bytes()
         self.bits_remaining = self.remainder = 0
 
     def __len__(self):
@@ -8,7 +8,7 @@ from .utilities import (
         Deserializer, Serializer)
 from .yj_container import (
         CONTAINER_FORMAT_KFX_MAIN, CONTAINER_FORMAT_KFX_METADATA, CONTAINER_FORMAT_KFX_ATTACHABLE, YJContainer, YJFragment,
-        CONTAINER_FRAGMENT_TYPES, DRMION_SIGNATURE, RAW_FRAGMENT_TYPES)
+        YJLazyFragment, CONTAINER_FRAGMENT_TYPES, DRMION_SIGNATURE, RAW_FRAGMENT_TYPES)
 from .yj_symbol_catalog import SYSTEM_SYMBOL_TABLE
 
 
@@ -53,7 +53,7 @@ class KfxContainer(YJContainer):
     def __init__(self, symtab, datafile=None, fragments=None):
         YJContainer.__init__(self, symtab, datafile=datafile, fragments=fragments)
 
-    def deserialize(self, ignore_drm=False):
+    def deserialize(self, ignore_drm=False, validate=True):
         self.doc_symbols = None
         self.format_capabilities = None
         self.container_info = None
@@ -61,6 +61,7 @@ class KfxContainer(YJContainer):
         self.fragments.clear()
 
         data = self.datafile.get_data()
+        view = memoryview(data)
 
         if len(data) < KfxContainer.MIN_LENGTH:
             raise Exception("Container is too short (%d bytes)" % len(data))
@@ -86,7 +87,7 @@ class KfxContainer(YJContainer):
         container_info_offset = header.unpack(b"<L")
         container_info_length = header.unpack(b"<L")
 
-        container_info_data = data[container_info_offset:container_info_offset + container_info_length]
+        container_info_data = view[container_info_offset:container_info_offset + container_info_length]
         container_info = IonBinary(self.symtab).deserialize_single_value(container_info_data)
         if DEBUG:
             log.debug("container info:\n%s" % repr(container_info))
@@ -104,7 +105,7 @@ class KfxContainer(YJContainer):
         doc_symbol_offset = container_info.pop("$415", None)
         doc_symbol_length = container_info.pop("$416", 0)
         if doc_symbol_length:
-            doc_symbol_data = data[doc_symbol_offset:doc_symbol_offset + doc_symbol_length]
+            doc_symbol_data = view[doc_symbol_offset:doc_symbol_offset + doc_symbol_length]
             self.doc_symbols = IonBinary(self.symtab).deserialize_annotated_value(
                     doc_symbol_data, expect_annotation="$ion_symbol_table")
             if DEBUG:
@@ -124,7 +125,7 @@ class KfxContainer(YJContainer):
             format_capabilities_offset = container_info.pop("$594", None)
             format_capabilities_length = container_info.pop("$595", 0)
             if format_capabilities_length:
-                format_capabilities_data = data[format_capabilities_offset:format_capabilities_offset + format_capabilities_length]
+                format_capabilities_data = view[format_capabilities_offset:format_capabilities_offset + format_capabilities_length]
                 self.format_capabilities = IonBinary(self.symtab).deserialize_annotated_value(
                     format_capabilities_data, expect_annotation="$593")
                 if DEBUG:
@@ -137,7 +138,8 @@ class KfxContainer(YJContainer):
         if len(container_info):
             log.error("container_info has extra data: %s" % repr(container_info))
 
-        payload_sha1 = sha1(data[header_len:]).hex()
+        # hashing the whole payload only serves the kfxgen_payload_sha1 check below
+        payload_sha1 = sha1(view[header_len:]).hex() if validate else None
 
         kfxgen_package_version = ""
         kfxgen_application_version = ""
@@ -164,7 +166,7 @@ class KfxContainer(YJContainer):
                 kfxgen_package_version = value
 
             elif key == "kfxgen_payload_sha1":
-                if value != payload_sha1:
+                if payload_sha1 is not None and value != payload_sha1:
                     log.error("Incorrect kfxgen_payload_sha1 in container %s" % container_id)
                     log.info("value=%s sha1=%s" % (value, payload_sha1))
 
@@ -179,7 +181,7 @@ class KfxContainer(YJContainer):
                 log.error("kfxgen_info has extra data: %s" % repr(info))
 
         if index_table_length:
-            entity_table = Deserializer(data[index_table_offset:index_table_offset + index_table_length])
+            entity_table = Deserializer(view[index_table_offset:index_table_offset + index_table_length])
 
             while len(entity_table):
                 id_idnum = entity_table.unpack("<L")
@@ -199,7 +201,7 @@ class KfxContainer(YJContainer):
 
                 self.entities.append(
                         KfxContainerEntity(self.symtab, id_idnum, type_idnum,
-                                           serialized_data=data[entity_start:entity_start + entity_len]))
+                                           serialized_data=view[entity_start:entity_start + entity_len]))
 
         if type_idnums & KFX_MAIN_CONTAINER_FRAGMENT_IDNUMS:
             container_format = CONTAINER_FORMAT_KFX_MAIN
@@ -370,7 +372,7 @@ class KfxContainerEntity(object):
         if data is None:
             data = self.serialized_data
 
-        cont_entity = Deserializer(data)
+        cont_entity = Deserializer(memoryview(data))
         signature = cont_entity.unpack("4s")
         version = cont_entity.unpack("<H")
         header_len = cont_entity.unpack("<L")
@@ -384,7 +386,7 @@ class KfxContainerEntity(object):
         if header_len < KfxContainerEntity.MIN_LENGTH:
             raise Exception("Container entity header is too short (%d)" % header_len)
 
-        self.header = data[:header_len]
+        self.header = bytes(data[:header_len])
 
         entity_info = IonBinary(self.symtab).deserialize_single_value(cont_entity.extract(upto=header_len))
         compression_type = entity_info.pop("$410", DEFAULT_COMPRESSION_TYPE)
@@ -407,19 +409,28 @@ class KfxContainerEntity(object):
         fid = self.symtab.get_symbol(self.id_idnum)
         ftype = self.symtab.get_symbol(self.type_idnum)
 
+        # the value is only deserialized when first used, unless it may be an annotation that supplies the fid
+        if fid != "$348" or ftype in RAW_FRAGMENT_TYPES or (entity_data[4:5] and entity_data[4] >> 4 not in {0, 14}):
+            return YJLazyFragment(fid=fid if fid != "$348" else None, ftype=ftype,
+                                  loader=lambda: self.deserialize_value(entity_data, fid, ftype)[1])
+
+        fid, self.value = self.deserialize_value(entity_data, fid, ftype)
+        return YJFragment(fid=fid if fid != "$348" else None, ftype=ftype, value=self.value)
+
+    def deserialize_value(self, entity_data, fid, ftype):
         if ftype in RAW_FRAGMENT_TYPES:
-            self.value = IonBLOB(entity_data)
+            value = IonBLOB(entity_data)
         else:
-            self.value = IonBinary(self.symtab).deserialize_single_value(entity_data)
+            value = IonBinary(self.symtab).deserialize_single_value(entity_data)
 
-        if isinstance(self.value, IonAnnotation):
-            if self.value.is_annotation(ftype) and fid == "$348":
+        if isinstance(value, IonAnnotation):
+            if value.is_annotation(ftype) and fid == "$348":
                 fid = ftype
-                self.value = self.value.value
+                value = value.value
             else:
-                log.error("Entity %s has IonAnnotation as value: %s" % (repr(self), repr(self.value)))
+                log.error("Entity %s has IonAnnotation as value: %s" % (repr(self), repr(value)))
 
-        return YJFragment(fid=fid if fid != "$348" else None, ftype=ftype, value=self.value)
+        return (fid, value)
 
     def serialize(self):
         entity = Serializer()
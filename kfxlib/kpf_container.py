@@ -37,7 +37,7 @@ class KpfContainer(YJContainer):
         YJContainer.__init__(self, symtab, datafile=datafile, fragments=fragments)
         self.book = book
 
-    def deserialize(self, ignore_drm=False):
+    def deserialize(self, ignore_drm=False, validate=True):
         self.ignore_drm = ignore_drm
         self.fragments.clear()
 
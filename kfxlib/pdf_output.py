@@ -0,0 +1,256 @@
+import binascii
+import hashlib
+import io
+from PIL import Image
+import zlib
+
+from .message_logging import log
+from .utilities import disable_debug_log
+
+
+__license__ = "GPL v3"
+__copyright__ = "2016-2025, John Howell <jhowell@acm.org>"
+
+
+PDF_HEADER = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+FLATE_LEVEL = 6
+
+JPEG_COLOR_SPACES = {"L": "/DeviceGray", "RGB": "/DeviceRGB", "CMYK": "/DeviceCMYK"}
+
+
+class PdfName(str):
+    pass
+
+
+class PdfRef(int):
+    pass
+
+
+class PdfPageImage(object):
+    # An image ready to be placed on a PDF page: JPEG data is used as is, anything else is decoded and stored
+    # flate compressed, with any alpha channel as a soft mask
+
+    def __init__(self, image_data):
+        with disable_debug_log():
+            img = Image.open(io.BytesIO(image_data))
+            self.width, self.height = img.size
+            self.smask = None
+
+            if img.format == "JPEG" and img.mode in JPEG_COLOR_SPACES:
+                self.color_space = JPEG_COLOR_SPACES[img.mode]
+                self.bits = 8
+                self.filter = "/DCTDecode"
+                self.data = image_data
+
+                # Adobe CMYK JPEG data is stored inverted
+                self.decode = [1, 0] * 4 if img.mode == "CMYK" and "adobe" in img.info else None
+            else:
+                if img.mode == "P":
+                    img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+                elif img.mode == "LA":
+                    img = img.convert("RGBA")
+                elif img.mode == "I" or img.mode.startswith("I;16"):
+                    # 16 bit grayscale is scaled down rather than clipped by the conversion to 8 bits
+                    img = img.convert("I").point(lambda v: v / 256).convert("L")
+                elif img.mode not in ["1", "L", "RGB", "RGBA"]:
+                    img = img.convert("RGB" if img.mode in ["CMYK", "YCbCr", "LAB", "HSV"] else "L")
+
+                if img.mode == "RGBA":
+                    self.smask = zlib.compress(img.getchannel("A").tobytes(), FLATE_LEVEL)
+                    img = img.convert("RGB")
+
+                self.color_space = "/DeviceRGB" if img.mode == "RGB" else "/DeviceGray"
+                self.bits = 1 if img.mode == "1" else 8
+                self.filter = "/FlateDecode"
+                self.data = zlib.compress(img.tobytes(), FLATE_LEVEL)
+                self.decode = None
+
+            img.close()
+
+
+class PdfOutput(object):
+    # Writes a PDF made of full page images. Objects are written to the output file as soon as they are added and
+    # only their offsets are kept for the cross-reference table.
+
+    def __init__(self, outfile):
+        self.outfile = outfile
+        self.offset = 0
+        self.object_offsets = [None]
+        self.page_refs = []
+        self.id_hash = hashlib.md5()
+
+        self.write(PDF_HEADER)
+        self.pages_ref = self.reserve_object()
+
+    def write(self, data):
+        self.outfile.write(data)
+        self.offset += len(data)
+
+    def reserve_object(self):
+        self.object_offsets.append(None)
+        return PdfRef(len(self.object_offsets) - 1)
+
+    def write_object(self, value, stream=None, ref=None):
+        if ref is None:
+            ref = self.reserve_object()
+
+        if stream is not None:
+            value["/Length"] = len(stream)
+
+        self.object_offsets[ref] = self.offset
+        self.write(b"%d 0 obj\n" % ref)
+        self.write(serialize(value))
+
+        if stream is not None:
+            self.write(b"\nstream\n")
+            self.write(stream)
+            self.write(b"\nendstream")
+
+        self.write(b"\nendobj\n")
+        return ref
+
+    def add_image_page(self, page_image):
+        image = {
+            "/Type": PdfName("/XObject"),
+            "/Subtype": PdfName("/Image"),
+            "/Width": page_image.width,
+            "/Height": page_image.height,
+            "/ColorSpace": PdfName(page_image.color_space),
+            "/BitsPerComponent": page_image.bits,
+            "/Filter": PdfName(page_image.filter),
+            }
+
+        if page_image.decode is not None:
+            image["/Decode"] = page_image.decode
+
+        if page_image.smask is not None:
+            image["/SMask"] = self.write_object({
+                "/Type": PdfName("/XObject"),
+                "/Subtype": PdfName("/Image"),
+                "/Width": page_image.width,
+                "/Height": page_image.height,
+                "/ColorSpace": PdfName("/DeviceGray"),
+                "/BitsPerComponent": 8,
+                "/Filter": PdfName("/FlateDecode"),
+                }, page_image.smask)
+
+        self.id_hash.update(page_image.data[:1024])
+        image_ref = self.write_object(image, page_image.data)
+
+        # one image pixel per point, as for images saved as PDF by PIL
+        contents_ref = self.write_object({}, b"q %d 0 0 %d 0 0 cm /Im0 Do Q" % (page_image.width, page_image.height))
+
+        self.page_refs.append(self.write_object({
+            "/Type": PdfName("/Page"),
+            "/Parent": self.pages_ref,
+            "/MediaBox": [0, 0, page_image.width, page_image.height],
+            "/Resources": {"/XObject": {"/Im0": image_ref}},
+            "/Contents": contents_ref,
+            }))
+
+    def finish(self, metadata=None, is_rtl=False, outline=None):
+        self.write_object({
+            "/Type": PdfName("/Pages"),
+            "/Kids": self.page_refs,
+            "/Count": len(self.page_refs),
+            }, ref=self.pages_ref)
+
+        catalog = {"/Type": PdfName("/Catalog"), "/Pages": self.pages_ref}
+
+        if is_rtl:
+            catalog["/ViewerPreferences"] = {"/Direction": PdfName("/R2L")}
+
+        if outline:
+            catalog["/Outlines"] = self.write_outline(outline)
+
+        catalog_ref = self.write_object(catalog)
+        info_ref = self.write_object(dict(metadata)) if metadata else None
+
+        xref_offset = self.offset
+        self.write(b"xref\n0 %d\n0000000000 65535 f \n" % len(self.object_offsets))
+        self.write(b"".join(b"%010d 00000 n \n" % offset for offset in self.object_offsets[1:]))
+
+        file_id = PdfHexString(self.id_hash.digest())
+        trailer = {"/Size": len(self.object_offsets), "/Root": catalog_ref, "/ID": [file_id, file_id]}
+        if info_ref is not None:
+            trailer["/Info"] = info_ref
+
+        self.write(b"trailer\n" + serialize(trailer) + b"\nstartxref\n%d\n%%%%EOF\n" % xref_offset)
+
+    def write_outline(self, outline_entries):
+        outlines_ref = self.reserve_object()
+        first, last, count = self.write_outline_items(outline_entries, outlines_ref)
+        self.write_object({"/Type": PdfName("/Outlines"), "/First": first, "/Last": last, "/Count": count}, ref=outlines_ref)
+        return outlines_ref
+
+    def write_outline_items(self, outline_entries, parent_ref):
+        # returns the first and last item and the number of items in this part of the tree, all shown open
+        refs = [self.reserve_object() for outline_entry in outline_entries]
+        count = len(refs)
+
+        for i, (outline_entry, ref) in enumerate(zip(outline_entries, refs)):
+            item = {"/Title": outline_entry.title, "/Parent": parent_ref}
+
+            if i > 0:
+                item["/Prev"] = refs[i - 1]
+
+            if i < len(refs) - 1:
+                item["/Next"] = refs[i + 1]
+
+            if outline_entry.page_num is not None:
+                if 0 <= outline_entry.page_num < len(self.page_refs):
+                    item["/Dest"] = [self.page_refs[outline_entry.page_num], PdfName("/Fit")]
+                else:
+                    log.warning("Outline entry \"%s\" refers to missing page %d" % (outline_entry.title, outline_entry.page_num))
+
+            if outline_entry.children:
+                item["/First"], item["/Last"], item["/Count"] = self.write_outline_items(outline_entry.children, ref)
+                count += item["/Count"]
+
+            self.write_object(item, ref=ref)
+
+        return refs[0], refs[-1], count
+
+
+class PdfHexString(bytes):
+    pass
+
+
+def serialize(value):
+    if isinstance(value, PdfRef):
+        return b"%d 0 R" % value
+
+    if isinstance(value, PdfName):
+        return value.encode("ascii")
+
+    if isinstance(value, bool):
+        return b"true" if value else b"false"
+
+    if isinstance(value, int):
+        return b"%d" % value
+
+    if isinstance(value, float):
+        return (b"%0.4f" % value).rstrip(b"0").rstrip(b".")
+
+    if isinstance(value, PdfHexString):
+        return b"<" + binascii.hexlify(value) + b">"
+
+    if isinstance(value, str):
+        try:
+            data = value.encode("ascii")
+        except UnicodeEncodeError:
+            return b"<feff" + binascii.hexlify(value.encode("utf-16-be")) + b">"
+
+        return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)").replace(
+            b"\r", b"\\r").replace(b"\n", b"\\n") + b")"
+
+    if isinstance(value, (list, tuple)):
+        return b"[" + b" ".join(serialize(v) for v in value) + b"]"
+
+    if isinstance(value, dict):
+        return b"<<" + b"".join(PdfName(k).encode("ascii") + b" " + serialize(v) for k, v in value.items()) + b">>"
+
+    if value is None:
+        return b"null"
+
+    raise Exception("Cannot serialize %s in PDF" % type(value).__name__)
@@ -1,13 +1,19 @@
+import hashlib
 import io
+import multiprocessing
 import os
 from PIL import Image
+import shutil
+import subprocess
+import threading
 import time
 
 from .jxr_container import JXRContainer
 from .message_logging import log
 from .utilities import (
-    add_plugin_path, calibre_numeric_version, create_temp_dir, disable_debug_log, natural_sort_key,
+    add_plugin_path, calibre_numeric_version, create_temp_dir, disable_debug_log, file_read_binary, natural_sort_key,
     remove_plugin_path, temp_filename)
+from .version import __version__
 
 if calibre_numeric_version is not None:
     add_plugin_path()
@@ -28,6 +34,11 @@ TILE_SIZE_REPORT_PERCENTAGE = 10
 DEBUG_TILES = False
 
 CONVERT_JXR_LOSSLESS = False
+JXR_JPEG_MODES = {"L", "RGB"}
+MAX_JXR_TILE_WORKERS = 8
+JXR_CACHE_VERSION = 2
+DEFAULT_JXR_CACHE_SIZE = 1024 * 1024 * 1024
+MAX_CONVERTED_IMAGES_SIZE = 256 * 1024 * 1024
 
 IMAGE_COLOR_MODES = [
     "1",
@@ -224,12 +235,28 @@ EXTS_OF_MIMETYPE = {
 
 
 class ImageResource(object):
-    def __init__(self, format, location, raw_media, height=None, width=None):
+    def __init__(self, format, location, raw_media, height=None, width=None, raw_media_loader=None):
         self.format = format
         self.location = location
         self.raw_media = raw_media
         self.height = height
         self.width = width
+        self.raw_media_loader = raw_media_loader
+
+    @property
+    def raw_media(self):
+        if self._raw_media is None and self.raw_media_loader is not None:
+            self._raw_media = self.raw_media_loader()
+
+        return self._raw_media
+
+    @raw_media.setter
+    def raw_media(self, value):
+        self._raw_media = value
+
+    def release_raw_media(self):
+        if self.raw_media_loader is not None:
+            self._raw_media = None
 
 
 class PdfImageResource(ImageResource):
@@ -242,46 +269,175 @@ class PdfImageResource(ImageResource):
         return self.page_nums == list(range(1, self.total_pages + 1))
 
     def page_number_ranges(self):
-        ranges = []
-        start = end = None
-
-        for page_num in self.page_nums:
-            if start is None:
-                start = end = page_num
-            elif page_num == end + 1:
-                end = page_num
-            else:
-                ranges.append((start, end + 1))
-                start = end = page_num
-
-        if start is not None:
+        return page_number_ranges(self.page_nums)
+
+
+def page_number_ranges(page_nums):
+    # runs of consecutive page numbers as (first, last + 1)
+    ranges = []
+    start = end = None
+
+    for page_num in page_nums:
+        if start is None:
+            start = end = page_num
+        elif page_num == end + 1:
+            end = page_num
+        else:
             ranges.append((start, end + 1))
+            start = end = page_num
+
+    if start is not None:
+        ranges.append((start, end + 1))
+
+    return ranges
+
+
+class JXRConversionCache(object):
+    # JPEG/PNG conversions of JPEG-XR images kept on disk, keyed by a hash of the JPEG-XR data and the converter version.
+    # The least recently used entries are removed once the total size exceeds max_size.
+
+    def __init__(self, cache_dir, max_size=DEFAULT_JXR_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.total_size = None
+        self.version = "%s/%d/%s/%s" % (
+            __version__, JXR_CACHE_VERSION, "lossless" if CONVERT_JXR_LOSSLESS else "lossy",
+            "calibre" if calibre_numeric_version is not None else "kfxlib")
+
+    def filename(self, jxr_data, image_type):
+        h = hashlib.sha256(self.version.encode("ascii"))
+        h.update(jxr_data)
+        return os.path.join(self.cache_dir, "%s.%s" % (h.hexdigest(), SYMBOL_FORMATS[image_type]))
+
+    def get(self, jxr_data):
+        for image_type in ["$285", "$284"]:
+            filename = self.filename(jxr_data, image_type)
+            try:
+                image_data = file_read_binary(filename)
+                os.utime(filename)
+            except Exception:
+                continue
+
+            if image_data:
+                return image_data, image_type
+
+        return None
+
+    def put(self, jxr_data, image_data, image_type):
+        filename = self.filename(jxr_data, image_type)
+        tmp_filename = "%s.%d.tmp" % (filename, os.getpid())
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+
+            with io.open(tmp_filename, "wb") as of:
+                of.write(image_data)
+
+            os.replace(tmp_filename, filename)
+        except Exception as e:
+            log.warning("Failed to save JPEG-XR conversion to cache: %s" % repr(e))
+            return
+
+        # the directory is only scanned once and again whenever the estimated size exceeds the limit
+        if self.total_size is not None:
+            self.total_size += len(image_data)
+
+        if self.total_size is None or self.total_size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total_size += st.st_size
+
+        entries.sort()
+        while total_size > self.max_size and entries:
+            mtime, size, filename = entries.pop(0)
+            try:
+                os.remove(filename)
+            except Exception:
+                pass
+
+            total_size -= size
+
+        self.total_size = total_size
+
+
+jxr_conversion_cache = None
+
+
+def set_jxr_conversion_cache(cache_dir, max_size=DEFAULT_JXR_CACHE_SIZE):
+    global jxr_conversion_cache
+    jxr_conversion_cache = JXRConversionCache(cache_dir, max_size) if cache_dir else None
+
+
+def jxr_conversion_cache_settings():
+    # arguments for set_jxr_conversion_cache, used to set up the same cache in worker processes
+    if jxr_conversion_cache is None:
+        return (None,)
+
+    return (jxr_conversion_cache.cache_dir, jxr_conversion_cache.max_size)
+
+
+class ConvertedImages(object):
+    # Image conversions shared between the outputs of a book, by (location, PDF page number or None for JPEG-XR). JPEG-XR
+    # conversions are left to the JPEG-XR conversion cache when there is one. Once the conversions held reach max_size
+    # no more are added, so that the pages of a large book are converted again instead of all being held in memory.
+
+    def __init__(self, max_size=MAX_CONVERTED_IMAGES_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.images = {}
 
-        return ranges
+    def get(self, key):
+        return self.images.get(key)
+
+    def add(self, key, image_data, fmt):
+        if (fmt == "$548" or key in self.images or (key[1] is None and jxr_conversion_cache is not None) or
+                self.size + len(image_data) > self.max_size):
+            return
+
+        self.images[key] = (image_data, fmt)
+        self.size += len(image_data)
 
 
 def convert_jxr_to_jpeg_or_png(jxr_data, resource_name, return_mime=False):
+    cache = jxr_conversion_cache
+    cached = cache.get(jxr_data) if cache is not None else None
+    if cached is not None:
+        image_data, image_type = cached
+        return image_data, MIMETYPE_OF_EXT["." + SYMBOL_FORMATS[image_type]] if return_mime else image_type
+
     try:
-        image_data = convert_jxr_to_tiff(jxr_data, resource_name)
-    except Exception as e:
-        log.error("Exception during conversion of JPEG-XR '%s' to TIFF: %s" % (resource_name, repr(e)))
-        image_data = jxr_data
-        image_type = "$548"
-    else:
+        img = convert_jxr_to_image(jxr_data, resource_name)
+
         with disable_debug_log():
-            img = Image.open(io.BytesIO(image_data))
-            image_type, ofmt, optimize = ("$284", "PNG", False) if CONVERT_JXR_LOSSLESS or img.mode == "RGBA" else ("$285", "JPEG", True)
+            # images with an alpha plane, bilevel or 16-bit images cannot be stored as JPEG
+            image_type, ofmt, optimize = (
+                ("$284", "PNG", False) if CONVERT_JXR_LOSSLESS or img.mode not in JXR_JPEG_MODES else ("$285", "JPEG", True))
             outfile = io.BytesIO()
             img.save(outfile, ofmt, quality=95, optimize=optimize)
             img.close()
-
+            del img
+    except Exception as e:
+        log.error("Exception during conversion of JPEG-XR '%s': %s" % (resource_name, repr(e)))
+        image_data = jxr_data
+        image_type = "$548"
+    else:
         image_data = outfile.getvalue()
         outfile.close()
 
+        if cache is not None:
+            cache.put(jxr_data, image_data, image_type)
+
     return image_data, MIMETYPE_OF_EXT["." + SYMBOL_FORMATS[image_type]] if return_mime else image_type
 
 
-def convert_jxr_to_tiff(jxr_data, resource_name):
+def convert_jxr_to_image(jxr_data, resource_name):
 
     if calibre_numeric_version is not None:
 
@@ -291,7 +447,7 @@ def convert_jxr_to_tiff(jxr_data, resource_name):
             tiff_data = image_to_data(img, fmt="TIFF")
 
             if tiff_data:
-                return tiff_data
+                return Image.open(io.BytesIO(tiff_data))
         except Exception as e:
             log.warning("Conversion of JPEG-XR resource failed: %s" % repr(e))
 
@@ -299,48 +455,113 @@ def convert_jxr_to_tiff(jxr_data, resource_name):
 
     start_time = time.time()
 
-    im = JXRContainer(jxr_data).unpack_image()
+    im = JXRContainer(jxr_data).unpack_image(tile_workers=jxr_tile_workers())
 
     duration = time.time() - start_time
     if duration >= 5.0:
-        log.info("JPEG-XR to TIFF conversion took %0.1f sec" % duration)
+        log.info("JPEG-XR decoding took %0.1f sec" % duration)
 
-    outfile = io.BytesIO()
-    with disable_debug_log():
-        im.save(outfile, "TIFF")
-        im.close()
-        del im
+    return im
 
-    return outfile.getvalue()
+
+def jxr_tile_workers():
+    # tiles are only decoded in parallel when not already running as one of several concurrent page conversions
+    if (calibre_numeric_version is not None or multiprocessing.parent_process() is not None or
+            threading.current_thread() is not threading.main_thread()):
+        return 1
+
+    return min(os.cpu_count() or 1, MAX_JXR_TILE_WORKERS)
 
 
 def convert_pdf_to_jpeg(pdf_data, page_num, dpi=150, reported_errors=None):
-    pdf_file = temp_filename("pdf", pdf_data)
-    jpeg_dir = create_temp_dir()
+    return list(convert_pdf_pages_to_jpeg(pdf_data, [page_num], dpi))[0]
+
+
+def convert_pdf_pages_to_jpeg(pdf_data, page_nums, dpi=150, rasterizer=None):
+    with PdfPageRasterizer(pdf_data, dpi, rasterizer) as pdf_rasterizer:
+        for jpeg_data in pdf_rasterizer.render(page_nums):
+            yield jpeg_data
 
+
+class PdfPageRasterizer(object):
+    # Renders pages of a PDF resource as JPEG. The PDF is written to a temporary file once, when first needed, and each
+    # run of consecutive pages is rendered by a single rasterizer call. The rasterizer is called as
+    # rasterizer(pdf_file, jpeg_dir, first_page, last_page, dpi) and must leave one JPEG file per page in jpeg_dir,
+    # named so that they sort into page order.
+
+    def __init__(self, pdf_data, dpi=150, rasterizer=None):
+        self.pdf_data = pdf_data
+        self.dpi = dpi
+        self.rasterizer = rasterizer or rasterize_pdf_pages
+        self.pdf_file = None
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def render(self, page_nums):
+        # yields the JPEG data of each page in order, page files are removed as soon as they have been read
+        with self.lock:
+            if self.pdf_file is None:
+                self.pdf_file = temp_filename("pdf", self.pdf_data)
+                self.pdf_data = None
+
+            pdf_file = self.pdf_file
+
+        for first, end in page_number_ranges(page_nums):
+            jpeg_dir = create_temp_dir()
+            try:
+                self.rasterizer(pdf_file, jpeg_dir, first, end - 1, self.dpi)
+
+                filenames = sorted(os.listdir(jpeg_dir), key=natural_sort_key)
+                if len(filenames) != end - first:
+                    raise Exception("PDF rasterizer created %d files for %d pages" % (len(filenames), end - first))
+
+                for filename in filenames:
+                    if not (filename.endswith(".jpg") or filename.endswith(".jpeg")):
+                        raise Exception("PDF rasterizer created unexpected file: %s" % filename)
+
+                for filename in filenames:
+                    jpeg_file = os.path.join(jpeg_dir, filename)
+                    with io.open(jpeg_file, "rb") as of:
+                        jpeg_data = of.read()
+
+                    os.remove(jpeg_file)
+                    yield jpeg_data
+            finally:
+                shutil.rmtree(jpeg_dir, ignore_errors=True)
+
+    def close(self):
+        with self.lock:
+            if self.pdf_file is not None:
+                try:
+                    os.remove(self.pdf_file)
+                except Exception:
+                    pass
+
+                self.pdf_file = None
+
+
+def rasterize_pdf_pages(pdf_file, jpeg_dir, first, last, dpi):
     if calibre_numeric_version is not None:
 
         if dpi != 150:
             raise Exception("calibre PDF page_images supports only default 150dpi")
 
         from calibre.ebooks.metadata.pdf import page_images
-        page_images(pdf_file, jpeg_dir, first=page_num, last=page_num)
+        page_images(pdf_file, jpeg_dir, first=first, last=last)
+        return
 
-    for dirpath, dirnames, filenames in os.walk(jpeg_dir):
-        if len(filenames) != 1:
-            raise Exception("pdftoppm created %d files" % len(filenames))
-
-        if not (filenames[0].endswith(".jpg") or filenames[0].endswith(".jpeg")):
-            raise Exception("pdftoppm created unexpected file: %s" % filenames[0])
-
-        with io.open(os.path.join(dirpath, filenames[0]), "rb") as of:
-            jpeg_data = of.read()
-
-        break
-    else:
-        raise Exception("pdftoppm created no files")
+    pdftoppm = shutil.which("pdftoppm")
+    if pdftoppm is None:
+        raise Exception("Conversion of PDF pages requires calibre or pdftoppm")
 
-    return jpeg_data
+    subprocess.run(
+        [pdftoppm, "-jpeg", "-r", "%d" % dpi, "-f", "%d" % first, "-l", "%d" % last, pdf_file, os.path.join(jpeg_dir, "page")],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
 
 
 def convert_image_to_pdf(image_resource):
@@ -761,6 +761,10 @@ class Serializer(object):
 
 class Deserializer(object):
     def __init__(self, data):
+        # given a memoryview, extract() returns views into it instead of copies
+        if isinstance(data, memoryview) and data.format != "B":
+            data = data.cast("B")
+
         self.buffer = data
         self.offset = 0
 
@@ -26,8 +26,11 @@ __copyright__ = "2016-2025, John Howell <jhowell@acm.org>"
 
 
 class YJ_Book(BookStructure, BookPosLoc, BookMetadata, KpfBook):
-    def __init__(self, file, credentials=[], is_netfs=False, symbol_catalog_filename=None):
+    def __init__(self, file, credentials=[], is_netfs=False, symbol_catalog_filename=None, files=None):
+        # files, if given, holds (name, data) for each file of the book, such as the decrypted members of a KFX-ZIP, and
+        # is used in place of the files found at file
         self.datafile = DataFile(file)
+        self.files = files
         self.credentials = credentials
         self.is_netfs = is_netfs
         self.symbol_catalog_filename = symbol_catalog_filename
@@ -99,28 +102,90 @@ class YJ_Book(BookStructure, BookPosLoc, BookMetadata, KpfBook):
         self.final_actions()
         return result
 
-    def convert_to_epub(self, epub2_desired=False, force_cover=False, progress_fn=None):
+    def convert_to_epub(self, epub2_desired=False, force_cover=False, progress_fn=None, converted_images=None):
         from .yj_to_epub import KFX_EPUB
         self.decode_book()
         result = KFX_EPUB(self, epub2_desired=epub2_desired, force_cover=force_cover,
-                          progress=make_progress(progress_fn)).decompile_to_epub()
+                          progress=make_progress(progress_fn), converted_images=converted_images).decompile_to_epub()
         self.final_actions()
         return result
 
-    def convert_to_cbz(self, split_landscape_comic_images=False, progress_fn=None):
+    def convert_to_cbz(self, split_landscape_comic_images=False, progress_fn=None, outfile=None, compress=False,
+                       converted_images=None):
         from .yj_to_image_book import KFX_IMAGE_BOOK
         self.decode_book()
-        result = KFX_IMAGE_BOOK(self).convert_book_to_cbz(split_landscape_comic_images, make_progress(progress_fn))
+        result = KFX_IMAGE_BOOK(self, converted_images).convert_book_to_cbz(
+            split_landscape_comic_images, make_progress(progress_fn), outfile, compress)
         self.final_actions()
         return result
 
-    def convert_to_pdf(self, split_landscape_comic_images=False, progress_fn=None):
+    def convert_to_cbz_and_pdf(self, split_landscape_comic_images=False, progress_fn=None, cbz_outfile=None, pdf_outfile=None,
+                               compress=False, converted_images=None):
         from .yj_to_image_book import KFX_IMAGE_BOOK
         self.decode_book()
-        result = KFX_IMAGE_BOOK(self).convert_book_to_pdf(split_landscape_comic_images, make_progress(progress_fn))
+        result = KFX_IMAGE_BOOK(self, converted_images).convert_book_to_cbz_and_pdf(
+            split_landscape_comic_images, make_progress(progress_fn), cbz_outfile, pdf_outfile, compress)
         self.final_actions()
         return result
 
+    def convert_to_pdf(self, split_landscape_comic_images=False, progress_fn=None, outfile=None, converted_images=None):
+        from .yj_to_image_book import KFX_IMAGE_BOOK
+        self.decode_book()
+        result = KFX_IMAGE_BOOK(self, converted_images).convert_book_to_pdf(
+            split_landscape_comic_images, make_progress(progress_fn), outfile)
+        self.final_actions()
+        return result
+
+    def convert_to_formats(self, formats, outfiles=None, split_landscape_comic_images=False, progress_fn=None, compress=False,
+                           epub2_desired=False, force_cover=False):
+        # Produces each of the formats "cbz", "pdf" and "epub" from a single decode of the book, converting each
+        # JPEG-XR image and PDF page once for all of them as far as ConvertedImages allows. Results are returned by
+        # format, written to outfiles[format] (a path or file object) if given, else as data. An output that fails is
+        # logged and returned as None so that the others are still produced.
+        from .resources import ConvertedImages
+        outfiles = outfiles or {}
+        converted_images = ConvertedImages() if "epub" in formats and ("cbz" in formats or "pdf" in formats) else None
+        results = {}
+
+        image_formats = [fmt for fmt in ["cbz", "pdf"] if fmt in formats]
+        if image_formats:
+            try:
+                if len(image_formats) == 2:
+                    results["cbz"], results["pdf"] = self.convert_to_cbz_and_pdf(
+                        split_landscape_comic_images, progress_fn, outfiles.get("cbz"), outfiles.get("pdf"), compress,
+                        converted_images)
+                elif "cbz" in formats:
+                    results["cbz"] = self.convert_to_cbz(
+                        split_landscape_comic_images, progress_fn, outfiles.get("cbz"), compress, converted_images)
+                else:
+                    results["pdf"] = self.convert_to_pdf(
+                        split_landscape_comic_images, progress_fn, outfiles.get("pdf"), converted_images)
+            except Exception as e:
+                traceback.print_exc()
+                log.error("Exception creating %s output: %s" % (" and ".join(image_formats).upper(), repr(e)))
+                for fmt in image_formats:
+                    results[fmt] = None
+
+        if "epub" in formats:
+            try:
+                results["epub"] = epub_data = self.convert_to_epub(epub2_desired, force_cover, progress_fn, converted_images)
+                outfile = outfiles.get("epub")
+
+                if outfile is not None:
+                    if isinstance(outfile, str):
+                        with open(outfile, "wb") as of:
+                            of.write(epub_data)
+                    else:
+                        outfile.write(epub_data)
+
+                    results["epub"] = outfile
+            except Exception as e:
+                traceback.print_exc()
+                log.error("Exception creating EPUB output: %s" % repr(e))
+                results["epub"] = None
+
+        return results
+
     def get_metadata(self):
 
         self.locate_book_datafiles()
@@ -200,7 +265,7 @@ class YJ_Book(BookStructure, BookPosLoc, BookMetadata, KpfBook):
         self.final_actions()
         return result
 
-    def decode_book(self, set_metadata=None, set_approximate_pages=None, pure=False, retain_yj_locals=False):
+    def decode_book(self, set_metadata=None, set_approximate_pages=None, pure=False, retain_yj_locals=False, validate=True):
         if self.fragments:
             if set_metadata is not None or set_approximate_pages is not None or retain_yj_locals:
                 raise Exception("Attempt to change metadata after book has already been decoded")
@@ -211,7 +276,7 @@ class YJ_Book(BookStructure, BookPosLoc, BookMetadata, KpfBook):
         for datafile in self.container_datafiles:
             log.info("Processing container: %s" % datafile.name)
             container = self.get_container(datafile)
-            container.deserialize()
+            container.deserialize(validate=validate)
             self.yj_containers.append(container)
 
         for container in self.yj_containers:
@@ -220,7 +285,7 @@ class YJ_Book(BookStructure, BookPosLoc, BookMetadata, KpfBook):
         if self.is_kpf_prepub:
             self.fix_kpf_prepub_book(not pure, retain_yj_locals)
 
-        if True:
+        if validate:
             self.check_consistency()
 
         if not pure:
@@ -234,21 +299,28 @@ class YJ_Book(BookStructure, BookPosLoc, BookMetadata, KpfBook):
                     traceback.print_exc()
                     log.error("Exception creating approximate page numbers: %s" % repr(e))
 
-        try:
-            self.report_features_and_metadata(unknown_only=False)
-        except Exception as e:
-            traceback.print_exc()
-            log.error("Exception checking book features and metadata: %s" % repr(e))
+        if validate:
+            try:
+                self.report_features_and_metadata(unknown_only=False)
+            except Exception as e:
+                traceback.print_exc()
+                log.error("Exception checking book features and metadata: %s" % repr(e))
 
-        self.check_fragment_usage(rebuild=not pure, ignore_extra=False)
-        self.check_symbol_table(rebuild=not pure, ignore_unused=self.is_scribe_notebook)
+        if validate or not pure:
+            # the rebuild drops duplicate, unreferenced and per-container fragments, so trusted input needs it too
+            self.check_fragment_usage(rebuild=not pure, ignore_extra=False)
+            self.check_symbol_table(rebuild=not pure, ignore_unused=self.is_scribe_notebook)
 
         self.final_actions()
 
     def locate_book_datafiles(self):
         self.container_datafiles = []
 
-        if self.datafile.is_real_file and os.path.isdir(self.datafile.name):
+        if self.files is not None:
+            for name, data in self.files:
+                self.check_located_file(name, data)
+
+        elif self.datafile.is_real_file and os.path.isdir(self.datafile.name):
             self.locate_files_from_dir(self.datafile.name)
 
         elif self.datafile.ext in [".azw8", ".ion", ".kfx", ".kpf"]:
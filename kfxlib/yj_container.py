@@ -269,6 +269,32 @@ class YJFragment(IonAnnotation):
     def ftype(self, value):
         raise Exception("Attempt to modify YJFragment ftype")
 
+    def uncached_value(self):
+        return self.value
+
+
+class YJLazyFragment(YJFragment):
+    # value is deserialized by the loader when it is first accessed
+
+    def __init__(self, ftype=None, fid=None, loader=None):
+        YJFragment.__init__(self, ftype=ftype, fid=fid)
+        del self.value
+        self.loader = loader
+
+    def __getattr__(self, name):
+        loader = self.__dict__.get("loader")
+        if name != "value" or loader is None:
+            raise AttributeError("'%s' object has no attribute '%s'" % (type_name(self), name))
+
+        value = self.value = loader()
+        self.__dict__.pop("loader", None)
+        return value
+
+    def uncached_value(self):
+        # deserialize without keeping the result, for large raw media that is only used once
+        loader = self.__dict__.get("loader")
+        return self.value if loader is None else loader()
+
 
 class YJFragmentList(IonList):
     def __init__(self, *args):
@@ -495,7 +495,7 @@ class BookMetadata(object):
                         if "$165" in cover_resource:
                             cover_raw_media = self.fragments.get(ftype="$417", fid=cover_resource["$165"])
                             if cover_raw_media is not None:
-                                cover_raw_data = cover_raw_media.value.tobytes()
+                                cover_raw_data = cover_raw_media.uncached_value().tobytes()
 
                         resource_height = cover_resource.get("$423", 0)
                         resource_width = cover_resource.get("$422", 0)
@@ -551,7 +551,7 @@ class BookMetadata(object):
         if cover_raw_media is None:
             return None
 
-        return ("jpeg" if cover_fmt == "jpg" else cover_fmt, cover_raw_media.value.tobytes())
+        return ("jpeg" if cover_fmt == "jpg" else cover_fmt, cover_raw_media.uncached_value().tobytes())
 
     def fix_cover_image_data(self, cover_image_data):
         fmt = cover_image_data[0]
@@ -1,4 +1,6 @@
+import bisect
 import collections
+import itertools
 
 from .ion import (ion_type, IonAnnotation, IonInt, IonList, IonSExp, IonString, IonStruct, IonSymbol, IS, unannotated)
 from .message_logging import log
@@ -84,6 +86,43 @@ class ConditionalTemplate(object):
                                      " ".join([str(x.eid) for x in self.pos_info]))
 
 
+class PositionIndex(object):
+    def __init__(self, pos_info):
+        self.pos_info = pos_info
+        self.length = len(pos_info)
+
+        eid_chunks = collections.defaultdict(list)
+        for chunk in pos_info:
+            eid_chunks[chunk.eid].append(chunk)
+
+        self.eid_chunks = {}
+        for eid, chunks in eid_chunks.items():
+            chunks.sort(key=lambda chunk: chunk.eid_offset)
+            self.eid_chunks[eid] = ([chunk.eid_offset for chunk in chunks], chunks)
+
+    def pid_for_eid(self, eid, eid_offset):
+        if eid not in self.eid_chunks:
+            return None
+
+        eid_offsets, chunks = self.eid_chunks[eid]
+        end = bisect.bisect_right(eid_offsets, eid_offset)
+        start = bisect.bisect_left(eid_offsets, eid_offsets[end - 1]) if end > 0 else 0
+
+        # try the chunks starting nearest before the offset first, then any earlier ones
+        for i in itertools.chain(range(start, end), range(start - 1, -1, -1)):
+            chunk = chunks[i]
+            if eid_offset <= chunk.eid_offset + chunk.length:
+                return chunk.pid + eid_offset - chunk.eid_offset
+
+        return None
+
+    @staticmethod
+    def page_for_pid(pid, page_pids):
+        # page_pids holds the starting pid of each page and must be in ascending order, as the content position order
+        # of get_ordered_image_resources() is, since it is bisected. The first page at or after pid is used.
+        return max(min(bisect.bisect_left(page_pids, pid), len(page_pids) - 1), 0)
+
+
 class MatchReport(object):
     def __init__(self, no_limit=False):
         self.count = 0
@@ -957,29 +996,16 @@ class BookPosLoc(object):
 
         return (has_spim, has_position_id_offset)
 
-    def pid_for_eid(self, eid, eid_offset, pos_info):
-        if not hasattr(self, "last_pii_"):
-            self.last_pii_ = 0
-
-        if len(pos_info) > 0:
-            if self.last_pii_ >= len(pos_info):
-                self.last_pii_ = 0
+    def position_index(self, pos_info):
+        # the index of the most recently used position info is kept for reuse
+        position_index = getattr(self, "position_index_", None)
+        if position_index is None or position_index.pos_info is not pos_info or position_index.length != len(pos_info):
+            position_index = self.position_index_ = PositionIndex(pos_info)
 
-            start_pii = self.last_pii_
+        return position_index
 
-            while True:
-                pi = pos_info[self.last_pii_]
-                if pi.eid == eid and eid_offset >= pi.eid_offset and eid_offset <= pi.eid_offset + pi.length:
-                    return pi.pid + eid_offset - pi.eid_offset
-
-                self.last_pii_ += 1
-                if self.last_pii_ >= len(pos_info):
-                    self.last_pii_ = 0
-
-                if self.last_pii_ == start_pii:
-                    break
-
-        return None
+    def pid_for_eid(self, eid, eid_offset, pos_info):
+        return self.position_index(pos_info).pid_for_eid(eid, eid_offset)
 
     def eid_for_pid(self, pid, pos_info):
         low = 0
@@ -1202,14 +1228,14 @@ class BookPosLoc(object):
             log.error("Cannot produce approximate page numbers - No content found for reading order %s" % reading_order_name)
             return
 
+        page_pos_info = self.page_numbering_position_info(pos_info, page_template_eids, section_names[0])
+
         if self.is_fixed_layout:
-            pages, new_section_page_count = self.determine_approximate_pages(
-                    pos_info, page_template_eids, section_names[0], 999999, True)
+            pages, new_section_page_count = self.determine_approximate_pages(page_pos_info, 999999, True)
             log.info("Created %d fixed layout page numbers" % len(pages))
 
         elif desired_num_pages == 0:
-            pages, new_section_page_count = self.determine_approximate_pages(
-                    pos_info, page_template_eids, section_names[0], TYPICAL_POSITIONS_PER_PAGE)
+            pages, new_section_page_count = self.determine_approximate_pages(page_pos_info, TYPICAL_POSITIONS_PER_PAGE)
             log.info("Created %d approximate page numbers (%d for chapters)" % (len(pages), new_section_page_count))
 
         else:
@@ -1218,8 +1244,7 @@ class BookPosLoc(object):
 
             while min_ppp <= max_ppp:
                 positions_per_page = (min_ppp + max_ppp) // 2
-                pages, new_section_page_count = self.determine_approximate_pages(
-                        pos_info, page_template_eids, section_names[0], positions_per_page)
+                pages, new_section_page_count = self.determine_approximate_pages(page_pos_info, positions_per_page)
 
                 if len(pages) == desired_num_pages:
                     break
@@ -1257,24 +1282,21 @@ class BookPosLoc(object):
                 self.fragments.append(YJFragment(ftype="$391", fid=nav_container_name, value=nav_container_data))
                 nav_containers.append(nav_container_name)
 
-    def determine_approximate_pages(self, pos_info, page_template_eids, first_section_name, positions_per_page, fixed_layout=False):
+    def page_numbering_position_info(self, pos_info, page_template_eids, first_section_name):
+        # content that can hold page numbers, selected once for all of the page count trials
+        return [chunk for chunk in pos_info if chunk.eid not in page_template_eids and (
+            GEN_COVER_PAGE_NUMBER or chunk.section_name != first_section_name)]
+
+    def determine_approximate_pages(self, pos_info, positions_per_page, fixed_layout=False):
 
         pages = []
         new_section_page_count = 0
         next_page_pid = prev_section_name = None
 
         if DEBUG_PAGES:
-            log.info("determine_approximate_pages: first_section_name=%s, positions_per_page=%d" % (
-                first_section_name, positions_per_page))
+            log.info("determine_approximate_pages: positions_per_page=%d" % positions_per_page)
 
         for chunk in pos_info:
-
-            if chunk.eid in page_template_eids:
-                continue
-
-            if chunk.section_name == first_section_name and not GEN_COVER_PAGE_NUMBER:
-                continue
-
             new_section = chunk.section_name != prev_section_name
             prev_section_name = chunk.section_name
 
@@ -15,7 +15,7 @@ from .utilities import (disable_debug_log, list_symbols, list_truncated, natural
 from .version import __version__
 from .yj_container import (
         CONTAINER_FORMAT_KFX_MAIN, YJFragment, YJFragmentKey, YJFragmentList,
-        ALLOWED_BOOK_FRAGMENT_TYPES, CONTAINER_FRAGMENT_TYPES, KNOWN_FRAGMENT_TYPES,
+        ALLOWED_BOOK_FRAGMENT_TYPES, CONTAINER_FRAGMENT_TYPES, KNOWN_FRAGMENT_TYPES, RAW_FRAGMENT_TYPES,
         REQUIRED_BOOK_FRAGMENT_TYPES, ROOT_FRAGMENT_TYPES, SINGLETON_FRAGMENT_TYPES)
 from .yj_versions import (is_known_aux_metadata, is_known_kcb_data)
 
@@ -200,7 +200,7 @@ class BookStructure(object):
             elif fragment.ftype == fragment.fid:
                 log.error("Non-root fragment has same id and type: %s" % str(fragment))
 
-            if fragment.ftype in FRAGMENT_ID_KEYS:
+            if fragment.ftype in FRAGMENT_ID_KEYS and fragment.ftype not in RAW_FRAGMENT_TYPES:
                 value_fid = None
 
                 if ion_type(fragment.value) is IonStruct:
@@ -501,7 +501,7 @@ class BookStructure(object):
 
                     raw_media = self.fragments.get(ftype="$417", fid=location, first=True)
                     if raw_media is not None:
-                        image_data = raw_media.value.tobytes()
+                        image_data = raw_media.uncached_value().tobytes()
 
                         if format_fmt in UNCHECKED_IMAGE_FMTS or mime_fmt in UNCHECKED_IMAGE_FMTS:
                             img_ok = True
@@ -946,6 +946,10 @@ class BookStructure(object):
                     if not (data_type is IonInt and data == 0 and fragment.ftype == "$265"):
                         eid_refs.add(data)
 
+        if fragment.ftype in RAW_FRAGMENT_TYPES:
+            # raw media contains no references, so leave its data unloaded
+            return
+
         try:
             walk(fragment, top_level=True)
         except Exception:
@@ -1014,8 +1018,8 @@ class BookStructure(object):
 
         for fragment in self.fragments:
             if fragment.ftype == "$419":
-                container_entity_map = fragment.value
-                old_entity_dependencies = container_entity_map.get("$253", None)
+                if entity_dependencies is None:
+                    old_entity_dependencies = fragment.value.get("$253", None)
             else:
                 new_fragments.append(fragment)
 
@@ -1103,7 +1107,9 @@ class BookStructure(object):
         used_symbols = set()
         original_symbols = set()
         for fragment in self.fragments:
-            if fragment.ftype not in CONTAINER_FRAGMENT_TYPES:
+            if fragment.ftype in RAW_FRAGMENT_TYPES:
+                used_symbols.update(fragment.annotations)
+            elif fragment.ftype not in CONTAINER_FRAGMENT_TYPES:
                 self.find_symbol_references(fragment, used_symbols)
 
             if fragment.ftype == "$ion_symbol_table":
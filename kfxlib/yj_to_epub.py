@@ -49,7 +49,7 @@ class KFX_EPUB(
 
     DEBUG = False
 
-    def __init__(self, book, epub2_desired=False, force_cover=False, metadata_only=False, progress=None):
+    def __init__(self, book, epub2_desired=False, force_cover=False, metadata_only=False, progress=None, converted_images=None):
         decimal.getcontext().prec = 6
         KFX_EPUB_Content.__init__(self)
         KFX_EPUB_Illustrated_Layout.__init__(self)
@@ -58,12 +58,12 @@ class KFX_EPUB(
         KFX_EPUB_Navigation.__init__(self)
         KFX_EPUB_Notebook.__init__(self)
         KFX_EPUB_Properties.__init__(self)
-        KFX_EPUB_Resources.__init__(self)
+        KFX_EPUB_Resources.__init__(self, converted_images)
         EPUB_Output.__init__(self, epub2_desired, force_cover, not metadata_only)
 
         self.book = book
         self.book_symbols = set()
-        self.book_data = self.organize_fragments_by_type(book.fragments)
+        self.book_data = self.organize_fragments_by_type(book.fragments, metadata_only)
         self.is_kpf = book.kpf_container is not None
         self.book_has_illustrated_layout_conditional_page_template = book.has_illustrated_layout_conditional_page_template
         self.used_fragments = {}
@@ -176,7 +176,7 @@ class KFX_EPUB(
     def decompile_to_epub(self):
         return self.generate_epub()
 
-    def organize_fragments_by_type(self, fragment_list):
+    def organize_fragments_by_type(self, fragment_list, metadata_only=False):
         font_count = 0
         categorized_data = {}
         last_container_id = None
@@ -185,6 +185,9 @@ class KFX_EPUB(
             id = fragment.fid
             self.book_symbols.add(id)
 
+            if metadata_only and fragment.ftype == "$417" and not self.book.is_kpf_prepub:
+                continue    # raw media is not needed for metadata and may not have been loaded yet
+
             if fragment.ftype == "$270":
                 id = last_container_id = IonSymbol("%s:%s" % (fragment.value.get("$161", ""), fragment.value.get("$409", "")))
             elif fragment.ftype == "$593":
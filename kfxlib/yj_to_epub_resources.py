@@ -25,7 +25,9 @@ class Obj(object):
 
 
 class KFX_EPUB_Resources(object):
-    def __init__(self):
+    def __init__(self, converted_images=None):
+        # JPEG-XR and PDF page conversions shared with other outputs of the book, by (location, PDF page number)
+        self.converted_images = converted_images
         self.resource_cache = {}
         self.used_raw_media = set()
         self.save_resources = True
@@ -121,7 +123,8 @@ class KFX_EPUB_Resources(object):
             self.process_external_resource(resource.pop("$214"), save=False)
 
         if FIX_JPEG_XR and (resource_format == "$548") and (raw_media is not None):
-            raw_media, resource_format = convert_jxr_to_jpeg_or_png(raw_media, location_fn)
+            raw_media, resource_format = self.convert_image(
+                (location, None), lambda: convert_jxr_to_jpeg_or_png(raw_media, location_fn))
             extension = "." + SYMBOL_FORMATS[resource_format]
             location_fn = location_fn.rpartition(".")[0] + extension
 
@@ -146,7 +149,8 @@ class KFX_EPUB_Resources(object):
 
             if FIX_PDF:
                 try:
-                    jpeg_data = convert_pdf_to_jpeg(raw_media, page_num, reported_errors=self.reported_pdf_errors)
+                    jpeg_data = self.convert_image((location, page_num), lambda: (
+                        convert_pdf_to_jpeg(raw_media, page_num, reported_errors=self.reported_pdf_errors), "$285"))[0]
                 except Exception as e:
                     log.error("Exception during conversion of PDF \"%s\" page %d to JPEG: %s" % (location_fn, page_num, repr(e)))
                 else:
@@ -179,6 +183,17 @@ class KFX_EPUB_Resources(object):
 
         return resource_obj
 
+    def convert_image(self, key, convert_fn):
+        if self.converted_images is None:
+            return convert_fn()
+
+        converted = self.converted_images.get(key)
+        if converted is None:
+            converted = convert_fn()
+            self.converted_images.add(key, *converted)
+
+        return converted
+
     def process_external_resource(self, resource_name, save=True, process_referred=False, save_referred=False,
                                   is_plugin=False, is_referred=False):
 
@@ -1,14 +1,19 @@
 import collections
+import concurrent.futures
 import datetime
 import io
+import os
+import pickle
 import re
 import zipfile
 
-from .message_logging import log
+from .message_logging import (get_current_logger, log, set_logger)
+from .pdf_output import (PdfOutput, PdfPageImage)
 from .resources import (
-    combine_image_tiles, convert_image_to_pdf, convert_jxr_to_jpeg_or_png, convert_pdf_to_jpeg,
-    crop_image, ImageResource, PdfImageResource, pypdf, SYMBOL_FORMATS)
-from .utilities import (json_serialize_compact, list_counts)
+    combine_image_tiles, convert_image_to_pdf, convert_jxr_to_jpeg_or_png, crop_image, ImageResource,
+    jxr_conversion_cache_settings, PdfImageResource, PdfPageRasterizer, pypdf, set_jxr_conversion_cache, SYMBOL_FORMATS)
+from .utilities import (calibre_numeric_version, json_serialize_compact, list_counts)
+from .yj_position_location import PositionIndex
 from .yj_to_epub import KFX_EPUB
 
 __license__ = "GPL v3"
@@ -17,16 +22,48 @@ __copyright__ = "2016-2025, John Howell <jhowell@acm.org>"
 USE_HIGHEST_RESOLUTION_IMAGE_VARIANT = True
 DEBUG_VARIANTS = False
 
+PARALLEL_MIN_PAGES = 8
+MAX_PAGE_WORKERS = 8
+PAGE_MEMORY_BUDGET = 256 * 1024 * 1024
+PDF_BATCH_PAGES = 16
+
 
 class KFX_IMAGE_BOOK(object):
-    def __init__(self, book):
+    def __init__(self, book, converted_images=None):
+        # converted_images, if given, is a ConvertedImages sharing JPEG-XR and PDF page conversions with other outputs of the book
         self.book = book
+        self.converted_images = converted_images
 
-    def convert_book_to_cbz(self, split_landscape_comic_images, progress):
+    def convert_book_to_cbz(self, split_landscape_comic_images, progress, outfile=None, compress=False):
         kfx_epub = KFX_EPUB(self.book, metadata_only=True)
         is_rtl = kfx_epub.page_progression_direction == "rtl"
         ordered_images = self.get_ordered_images(split_landscape_comic_images, kfx_epub.is_comic, is_rtl, progress)[0]
+        return combine_images_into_cbz(ordered_images, self.get_cbz_metadata(), outfile, compress, self.converted_images)
+
+    def convert_book_to_pdf(self, split_landscape_comic_images, progress, outfile=None):
+        kfx_epub = KFX_EPUB(self.book, metadata_only=True)
+        is_rtl = kfx_epub.page_progression_direction == "rtl"
+        ordered_images, ordered_image_pids, content_pos_info = self.get_ordered_images(
+            split_landscape_comic_images, kfx_epub.is_comic, is_rtl, progress)
+
+        self.add_page_nums_to_toc(kfx_epub, ordered_image_pids, content_pos_info)
+        return combine_images_into_pdf(
+            ordered_images, self.get_pdf_metadata(), is_rtl, kfx_epub.ncx_toc, outfile, self.converted_images)
 
+    def convert_book_to_cbz_and_pdf(self, split_landscape_comic_images, progress, cbz_outfile=None, pdf_outfile=None,
+                                    compress=False):
+        # the page images are located and converted once for both files
+        kfx_epub = KFX_EPUB(self.book, metadata_only=True)
+        is_rtl = kfx_epub.page_progression_direction == "rtl"
+        ordered_images, ordered_image_pids, content_pos_info = self.get_ordered_images(
+            split_landscape_comic_images, kfx_epub.is_comic, is_rtl, progress)
+
+        self.add_page_nums_to_toc(kfx_epub, ordered_image_pids, content_pos_info)
+        return combine_images_into_cbz_and_pdf(
+            ordered_images, self.get_cbz_metadata(), self.get_pdf_metadata(), is_rtl, kfx_epub.ncx_toc,
+            cbz_outfile, pdf_outfile, compress, self.converted_images)
+
+    def get_cbz_metadata(self):
         yj_metadata = self.book.get_yj_metadata_from_book()
         comic_book_info = {}
 
@@ -51,15 +88,9 @@ class KFX_IMAGE_BOOK(object):
                 comic_book_info["publicationMonth"] = pubdate.month
                 comic_book_info["publicationYear"] = pubdate.year
 
-        cbz_metadata = {"ComicBookInfo/1.0": comic_book_info} if comic_book_info else None
-        return combine_images_into_cbz(ordered_images, cbz_metadata)
-
-    def convert_book_to_pdf(self, split_landscape_comic_images, progress):
-        kfx_epub = KFX_EPUB(self.book, metadata_only=True)
-        is_rtl = kfx_epub.page_progression_direction == "rtl"
-        ordered_images, ordered_image_pids, content_pos_info = self.get_ordered_images(
-            split_landscape_comic_images, kfx_epub.is_comic, is_rtl, progress)
+        return {"ComicBookInfo/1.0": comic_book_info} if comic_book_info else None
 
+    def get_pdf_metadata(self):
         yj_metadata = self.book.get_yj_metadata_from_book()
         current_date = datetime.datetime.now().strftime("D\072%Y%m%d%H%M%S")
         pdf_metadata = {}
@@ -74,29 +105,26 @@ class KFX_IMAGE_BOOK(object):
         if yj_metadata.authors:
             pdf_metadata["/Author"] = " & ".join(yj_metadata.authors)
 
-        outline1 = []
+        return pdf_metadata
+
+    def add_page_nums_to_toc(self, kfx_epub, ordered_image_pids, content_pos_info):
+        position_index = self.book.position_index(content_pos_info)
 
         def add_pages_nums_to_toc(toc):
             for toc_entry in toc:
                 toc_entry.page_num = None
                 eid, eid_offset = kfx_epub.position_of_anchor(toc_entry.anchor)
                 if eid is not None:
-                    toc_pid = self.book.pid_for_eid(eid, eid_offset, content_pos_info)
+                    toc_pid = position_index.pid_for_eid(eid, eid_offset)
                     if toc_pid is not None:
-                        toc_entry.page_num = 0
-                        for ordered_page_num, ordered_page_pid in enumerate(ordered_image_pids):
-                            toc_entry.page_num = ordered_page_num
-                            if toc_pid <= ordered_page_pid:
-                                break
+                        toc_entry.page_num = PositionIndex.page_for_pid(toc_pid, ordered_image_pids)
                     else:
                         log.error("Failed to locate pid toc_entry: label=%s, eid=%s, eid_offset=%s" % (
                             toc_entry.title, repr(eid), eid_offset))
 
-                outline1.append((toc_entry.title, toc_entry.page_num))
                 add_pages_nums_to_toc(toc_entry.children)
 
         add_pages_nums_to_toc(kfx_epub.ncx_toc)
-        return combine_images_into_pdf(ordered_images, pdf_metadata, is_rtl, kfx_epub.ncx_toc)
 
     def get_ordered_images(self, split_landscape_comic_images=False, is_comic=False, is_rtl=False, progress=None):
 
@@ -108,41 +136,22 @@ class KFX_IMAGE_BOOK(object):
         ordered_images = []
         ordered_image_pids = []
         split_image_count = 0
-        for cnt, (fid, pid) in enumerate(zip(ordered_image_resources, ordered_image_resource_pids)):
-            image_resource = self.get_resource_image(fid)
-            if image_resource is not None:
-                if (
-                        split_landscape_comic_images and image_resource is not None and is_comic and image_resource.format != "$565" and
-                        image_resource.width > image_resource.height):
-                    split_image_count += 1
 
-                    new_width = image_resource.width // 2
-                    left_image = crop_image(
-                        image_resource.raw_media, image_resource.location, image_resource.width, image_resource.height,
-                        0, new_width, 0, 0)
-                    left = ImageResource(
-                        image_resource.format, suffix_location(image_resource.location, "-L"), left_image, image_resource.height, new_width)
-
-                    right_image = crop_image(
-                        image_resource.raw_media, image_resource.location, image_resource.width, image_resource.height,
-                        new_width, 0, 0, 0)
-                    right = ImageResource(
-                        image_resource.format, suffix_location(image_resource.location, "-R"), right_image, image_resource.height, new_width)
-
-                    if not is_rtl:
-                        ordered_images.append(left)
-                        ordered_image_pids.append(pid)
-                        image_resource = right
-                    else:
-                        ordered_images.append(right)
-                        ordered_image_pids.append(pid)
-                        image_resource = left
+        with PagePool(len(ordered_image_resources)) as pool:
+            page_images = pool.imap(
+                (self.get_page_images, (fid, split_landscape_comic_images and is_comic, is_rtl), PagePool.THREAD)
+                for fid in ordered_image_resources)
 
-                ordered_images.append(image_resource)
-                ordered_image_pids.append(pid)
+            for cnt, (pid, images) in enumerate(zip(ordered_image_resource_pids, page_images)):
+                if len(images) > 1:
+                    split_image_count += 1
 
-            if progress is not None:
-                progress.update_count(cnt)
+                for image_resource in images:
+                    ordered_images.append(image_resource)
+                    ordered_image_pids.append(pid)
+
+                if progress is not None:
+                    progress.update_count(cnt)
 
         if split_image_count:
             log.warning("Split %d landscape comic images into left/right image pairs" % split_image_count)
@@ -154,6 +163,29 @@ class KFX_IMAGE_BOOK(object):
 
         return (ordered_images, ordered_image_pids, content_pos_info)
 
+    def get_page_images(self, fid, split_landscape, is_rtl):
+        image_resource = self.get_resource_image(fid)
+        if image_resource is None:
+            return []
+
+        if not (split_landscape and image_resource.format != "$565" and image_resource.width > image_resource.height):
+            return [image_resource]
+
+        new_width = image_resource.width // 2
+        left_image = crop_image(
+            image_resource.raw_media, image_resource.location, image_resource.width, image_resource.height,
+            0, new_width, 0, 0)
+        left = ImageResource(
+            image_resource.format, suffix_location(image_resource.location, "-L"), left_image, image_resource.height, new_width)
+
+        right_image = crop_image(
+            image_resource.raw_media, image_resource.location, image_resource.width, image_resource.height,
+            new_width, 0, 0, 0)
+        right = ImageResource(
+            image_resource.format, suffix_location(image_resource.location, "-R"), right_image, image_resource.height, new_width)
+
+        return [left, right] if not is_rtl else [right, left]
+
     def get_resource_image(self, resource_name, ignore_variants=False):
         fragment = self.book.fragments.get(ftype="$164", fid=resource_name)
         if fragment is None:
@@ -165,6 +197,8 @@ class KFX_IMAGE_BOOK(object):
         resource_width = resource.get("$422", None) or resource.get("$66", None)
         page_index = resource.get("$564", 0)
 
+        raw_media_fragment = None
+
         if "$636" in resource:
             yj_tiles = resource.get("$636")
             tile_height = resource.get("$638")
@@ -176,19 +210,15 @@ class KFX_IMAGE_BOOK(object):
             for row in yj_tiles:
                 for tile_location in row:
                     tile_raw_media_frag = self.book.fragments.get(ftype="$417", fid=tile_location)
-                    tiles_raw_media.append(None if tile_raw_media_frag is None else tile_raw_media_frag.value)
+                    tiles_raw_media.append(None if tile_raw_media_frag is None else tile_raw_media_frag.uncached_value())
 
             raw_media, resource_format = combine_image_tiles(
                 resource_name, resource_height, resource_width, resource_format, tile_height, tile_width, tile_padding,
                 yj_tiles, tiles_raw_media, ignore_variants)
         else:
             location = resource.get("$165")
-            if location is not None:
-                raw_media = self.book.fragments.get(ftype="$417", fid=location)
-                if raw_media is not None:
-                    raw_media = raw_media.value
-            else:
-                raw_media = None
+            raw_media = None
+            raw_media_fragment = self.book.fragments.get(ftype="$417", fid=location) if location is not None else None
 
         if resource_format != "$565" and not ignore_variants:
             for rr in resource.get("$635", []):
@@ -202,6 +232,15 @@ class KFX_IMAGE_BOOK(object):
 
                     location, resource_format, raw_media, resource_width, resource_height = (
                         variant.location, variant.format, variant.raw_media, variant.width, variant.height)
+                    raw_media_fragment = None
+
+        if raw_media is None and raw_media_fragment is not None:
+            if resource_format == "$565":
+                raw_media = raw_media_fragment.value
+            else:
+                # page images are only loaded when used so that a whole book is never held in memory at once
+                return ImageResource(resource_format, location, None, resource_height, resource_width,
+                                     raw_media_loader=raw_media_fragment.uncached_value)
 
         if raw_media is None:
             return None
@@ -212,24 +251,97 @@ class KFX_IMAGE_BOOK(object):
         return ImageResource(resource_format, location, raw_media, resource_height, resource_width)
 
 
-def combine_images_into_pdf(ordered_images, metadata=None, is_rtl=False, outline=None):
+def combine_images_into_pdf(ordered_images, metadata=None, is_rtl=False, outline=None, outfile=None, converted_images=None):
+    # written to outfile (a path or file object) if given, else returned as bytes
     if len(ordered_images) == 0:
         return None
 
+    if any(image_resource.format == "$565" for image_resource in ordered_images):
+        # pages from PDF resources can only be combined using pypdf
+        pdf_data = combine_pdf_resources(ordered_images, metadata, is_rtl, outline)
+        if outfile is None or pdf_data is None:
+            return pdf_data
+
+        if isinstance(outfile, str):
+            with open(outfile, "wb") as of:
+                of.write(pdf_data)
+        else:
+            outfile.write(pdf_data)
+
+        return outfile
+
+    image_resource_formats = collections.defaultdict(set)
+    pdf_file = io.BytesIO() if outfile is None else (open(outfile, "wb") if isinstance(outfile, str) else outfile)
+
+    try:
+        pdf_output = PdfOutput(pdf_file)
+
+        with PagePool(len(ordered_images)) as pool:
+            page_images = pool.imap(page_image_job(image_resource, converted_images) for image_resource in ordered_images)
+
+            for image_resource, (fmt, image_data, page_image) in zip(ordered_images, page_images):
+                image_resource_formats[SYMBOL_FORMATS[image_resource.format].upper()].add(image_resource.location)
+                record_converted_image(converted_images, image_resource, fmt, image_data)
+
+                if page_image is None:
+                    # a JPEG-XR image that failed to convert cannot be a PDF page
+                    log.error("Abandoning PDF output: page %d image %s could not be converted" % (
+                        ordered_images.index(image_resource) + 1, image_resource.location))
+                    discard_output(pdf_file, outfile)
+                    return None
+
+                pdf_output.add_image_page(page_image)
+                del image_data, page_image
+                image_resource.release_raw_media()
+
+        pdf_output.finish(metadata, is_rtl, outline)
+    except Exception:
+        if isinstance(outfile, str):
+            pdf_file.close()
+            if os.path.isfile(outfile):
+                os.remove(outfile)
+
+        raise
+
+    log.info("Combined %s resources into a %d page PDF file" % (list_counts(image_resource_formats), len(ordered_images)))
+
+    if outfile is not None:
+        if isinstance(outfile, str):
+            pdf_file.close()
+
+        return outfile
+
+    pdf_data = pdf_file.getvalue()
+    pdf_file.close()
+    return pdf_data
+
+
+def combine_pdf_resources(ordered_images, metadata, is_rtl, outline):
     image_resource_formats = collections.defaultdict(set)
     combined_pdf_images = []
-    for image_resource in ordered_images:
-        image_resource_formats[SYMBOL_FORMATS[image_resource.format].upper()].add(image_resource.location)
 
-        if image_resource.format == "$565":
-            if combined_pdf_images and combined_pdf_images[-1].format == "$565" and combined_pdf_images[-1].location == image_resource.location:
-                combined_pdf_images[-1].page_nums.extend(image_resource.page_nums)
+    with PagePool(len(ordered_images)) as pool:
+        pdf_pages = pool.imap(
+            (None, (image_resource,), PagePool.INLINE) if image_resource.format == "$565" else (
+                convert_image_to_pdf, (ImageResource(
+                    image_resource.format, image_resource.location, image_resource.raw_media,
+                    image_resource.height, image_resource.width),),
+                PagePool.PROCESS if image_resource.format == "$548" else PagePool.THREAD)
+            for image_resource in ordered_images)
+
+        for image_resource, pdf_page in zip(ordered_images, pdf_pages):
+            image_resource_formats[SYMBOL_FORMATS[image_resource.format].upper()].add(image_resource.location)
+
+            if image_resource.format == "$565":
+                if combined_pdf_images and combined_pdf_images[-1].format == "$565" and combined_pdf_images[-1].location == image_resource.location:
+                    combined_pdf_images[-1].page_nums.extend(image_resource.page_nums)
+                else:
+                    pdf = pypdf.PdfReader(io.BytesIO(image_resource.raw_media))
+                    image_resource.total_pages = len(pdf.pages)
+                    combined_pdf_images.append(image_resource)
             else:
-                pdf = pypdf.PdfReader(io.BytesIO(image_resource.raw_media))
-                image_resource.total_pages = len(pdf.pages)
-                combined_pdf_images.append(image_resource)
-        else:
-            combined_pdf_images.append(convert_image_to_pdf(image_resource))
+                combined_pdf_images.append(pdf_page)
+                image_resource.release_raw_media()
 
     if len(combined_pdf_images) == 1 and combined_pdf_images[0].entire_resource_used():
         combined = False
@@ -299,51 +411,344 @@ def add_pdf_outline(pdf_writer, outline_entries, parent=None):
             add_pdf_outline(pdf_writer, outline_entry.children, new_entry)
 
 
-def combine_images_into_cbz(ordered_images, metadata=None):
+def combine_images_into_cbz(ordered_images, metadata=None, outfile=None, compress=False, converted_images=None):
+    # pages are written as they are converted, to outfile (a path or file object) if given, else returned as bytes
     if len(ordered_images) == 0:
         return None
 
+    for image_resource in ordered_images:
+        if image_resource.format not in {"$286", "$285", "$284", "$565", "$548"}:
+            raise Exception("Unexpected image format: %s" % image_resource.format)
+
     image_resource_formats = collections.defaultdict(set)
-    page_images = []
+    cbz_file = io.BytesIO() if outfile is None else outfile
+
+    # pages of each PDF resource are rendered from a single temporary copy of the PDF, runs of consecutive pages in
+    # batches of up to PDF_BATCH_PAGES so that long runs can still be spread across workers
+    pdf_rasterizers = {}
+    last_batch = {}
+    batches = []
     for image_resource in ordered_images:
-        image_resource_formats[SYMBOL_FORMATS[image_resource.format].upper()].add(image_resource.location)
-
-        if image_resource.format in {"$286", "$285", "$284"}:
-            page_images.append(image_resource)
-        elif image_resource.format == "$565":
-            for page_num in image_resource.page_nums:
-                image_data = convert_pdf_to_jpeg(image_resource.raw_media, page_num)
-                page_images.append(ImageResource("$285", None, image_data))
-        elif image_resource.format == "$548":
-            image_data, fmt = convert_jxr_to_jpeg_or_png(image_resource.raw_media, image_resource.location)
-            page_images.append(ImageResource(fmt, None, image_data))
+        if image_resource.format == "$565":
+            pdf_rasterizer = pdf_rasterizers.get(image_resource.location)
+            if pdf_rasterizer is None:
+                pdf_rasterizer = pdf_rasterizers[image_resource.location] = PdfPageRasterizer(image_resource.raw_media)
+            elif batches[-1][0] is pdf_rasterizer and (sum(len(ir.page_nums) for ir in batches[-1][1]) +
+                                                        len(image_resource.page_nums) <= PDF_BATCH_PAGES):
+                batches[-1][1].append(image_resource)
+                continue
+
+            last_batch[pdf_rasterizer] = len(batches)
+            batches.append((pdf_rasterizer, [image_resource]))
         else:
-            raise Exception("Unexpected image format: %s" % image_resource.format)
+            batches.append((None, [image_resource]))
 
-    cbz_file = io.BytesIO()
+    def page_job(pdf_rasterizer, image_resources):
+        if pdf_rasterizer is not None:
+            return (render_pdf_pages, (pdf_rasterizer, [
+                page_num for image_resource in image_resources for page_num in image_resource.page_nums]), PagePool.THREAD)
 
-    with zipfile.ZipFile(cbz_file, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-        for i, image_resource in enumerate(page_images):
-            zf.writestr("%04d.%s" % (i + 1, SYMBOL_FORMATS[image_resource.format]), image_resource.raw_media)
+        image_resource = image_resources[0]
+        if image_resource.format == "$548":
+            converted = converted_images.get((image_resource.location, None)) if converted_images is not None else None
+            if converted is not None:
+                image_data, fmt = converted
+                return (None, ([(fmt, image_data)],), PagePool.INLINE)
 
-        if metadata:
-            comment = json_serialize_compact(metadata).encode("utf-8")
-            if len(comment) <= 65535:
-                zf.comment = comment
-            else:
-                log.warning("Discarding CBZ metadata -- too long for ZIP comment")
+            return (convert_jxr_page, (image_resource.raw_media, image_resource.location), PagePool.PROCESS)
 
-    cbz_data = cbz_file.getvalue()
-    cbz_file.close()
+        return (None, ([(image_resource.format, image_resource.raw_media)],), PagePool.INLINE)
+
+    try:
+        with zipfile.ZipFile(cbz_file, "w", compression=zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED) as zf, \
+                PagePool(len(ordered_images)) as pool:
+            page_count = 0
+            for i, page_images in enumerate(pool.imap(page_job(*batch) for batch in batches)):
+                pdf_rasterizer, image_resources = batches[i]
+
+                for fmt, image_data in page_images:
+                    page_count += 1
+                    zf.writestr("%04d.%s" % (page_count, SYMBOL_FORMATS[fmt]), image_data)
+
+                if converted_images is not None:
+                    if pdf_rasterizer is not None:
+                        page_keys = [(ir.location, page_num) for ir in image_resources for page_num in ir.page_nums]
+                        for page_key, (fmt, image_data) in zip(page_keys, page_images):
+                            converted_images.add(page_key, image_data, fmt)
+                    else:
+                        record_converted_image(converted_images, image_resources[0], *page_images[0])
+
+                del page_images
+
+                for image_resource in image_resources:
+                    image_resource_formats[SYMBOL_FORMATS[image_resource.format].upper()].add(image_resource.location)
+                    image_resource.release_raw_media()
+
+                if pdf_rasterizer is not None and last_batch[pdf_rasterizer] == i:
+                    pdf_rasterizer.close()
+
+            set_cbz_metadata(zf, metadata)
+    except Exception:
+        if isinstance(outfile, str) and os.path.isfile(outfile):
+            os.remove(outfile)
+
+        raise
+    finally:
+        for pdf_rasterizer in pdf_rasterizers.values():
+            pdf_rasterizer.close()
 
     log.info("Combined %s resources into a %d page CBZ file" % (
         list_counts(image_resource_formats), len(ordered_images)))
 
+    if outfile is not None:
+        return outfile
+
+    cbz_data = cbz_file.getvalue()
+    cbz_file.close()
     return cbz_data
 
 
+def combine_images_into_cbz_and_pdf(ordered_images, cbz_metadata=None, pdf_metadata=None, is_rtl=False, outline=None,
+                                    cbz_outfile=None, pdf_outfile=None, compress=False, converted_images=None):
+    # each page image is converted once and written to both files, returns (cbz, pdf) as for the separate functions
+    if len(ordered_images) == 0:
+        return (None, None)
+
+    if any(image_resource.format == "$565" for image_resource in ordered_images):
+        # PDF resources are rasterized for the CBZ but copied into the PDF, so there is no conversion to share
+        return (combine_images_into_cbz(ordered_images, cbz_metadata, cbz_outfile, compress, converted_images),
+                combine_images_into_pdf(ordered_images, pdf_metadata, is_rtl, outline, pdf_outfile, converted_images))
+
+    for image_resource in ordered_images:
+        if image_resource.format not in {"$286", "$285", "$284", "$548"}:
+            raise Exception("Unexpected image format: %s" % image_resource.format)
+
+    image_resource_formats = collections.defaultdict(set)
+    cbz_file = io.BytesIO() if cbz_outfile is None else cbz_outfile
+    pdf_file = io.BytesIO() if pdf_outfile is None else (
+        open(pdf_outfile, "wb") if isinstance(pdf_outfile, str) else pdf_outfile)
+
+    try:
+        with zipfile.ZipFile(cbz_file, "w", compression=zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED) as zf, \
+                PagePool(len(ordered_images)) as pool:
+            pdf_output = PdfOutput(pdf_file)
+            page_images = pool.imap(page_image_job(image_resource, converted_images) for image_resource in ordered_images)
+
+            for page_count, (image_resource, (fmt, image_data, page_image)) in enumerate(
+                    zip(ordered_images, page_images), start=1):
+                image_resource_formats[SYMBOL_FORMATS[image_resource.format].upper()].add(image_resource.location)
+                record_converted_image(converted_images, image_resource, fmt, image_data)
+                zf.writestr("%04d.%s" % (page_count, SYMBOL_FORMATS[fmt]), image_data)
+
+                if pdf_output is not None:
+                    if page_image is not None:
+                        pdf_output.add_image_page(page_image)
+                    else:
+                        # a JPEG-XR image that failed to convert is kept as is in the CBZ but cannot be a PDF page
+                        log.error("Abandoning PDF output: page %d image %s could not be converted" % (
+                            page_count, image_resource.location))
+                        pdf_output = None
+                        discard_output(pdf_file, pdf_outfile)
+
+                del image_data, page_image
+                image_resource.release_raw_media()
+
+            set_cbz_metadata(zf, cbz_metadata)
+
+            if pdf_output is not None:
+                pdf_output.finish(pdf_metadata, is_rtl, outline)
+    except Exception:
+        discard_output(pdf_file, pdf_outfile)
+
+        if isinstance(cbz_outfile, str) and os.path.isfile(cbz_outfile):
+            os.remove(cbz_outfile)
+
+        raise
+
+    log.info("Combined %s resources into %d page %s" % (
+        list_counts(image_resource_formats), len(ordered_images), "CBZ file" if pdf_output is None else "CBZ and PDF files"))
+
+    if cbz_outfile is None:
+        cbz_result = cbz_file.getvalue()
+        cbz_file.close()
+    else:
+        cbz_result = cbz_outfile
+
+    if pdf_output is None:
+        pdf_result = None
+    elif pdf_outfile is None:
+        pdf_result = pdf_file.getvalue()
+        pdf_file.close()
+    else:
+        if isinstance(pdf_outfile, str):
+            pdf_file.close()
+
+        pdf_result = pdf_outfile
+
+    return (cbz_result, pdf_result)
+
+
+def discard_output(outfile, outfile_arg):
+    # closes and removes an output file that was opened or created here
+    if outfile_arg is None or isinstance(outfile_arg, str):
+        outfile.close()
+
+    if isinstance(outfile_arg, str) and os.path.isfile(outfile_arg):
+        os.remove(outfile_arg)
+
+
+def set_cbz_metadata(zf, metadata):
+    if metadata:
+        comment = json_serialize_compact(metadata).encode("utf-8")
+        if len(comment) <= 65535:
+            zf.comment = comment
+        else:
+            log.warning("Discarding CBZ metadata -- too long for ZIP comment")
+
+
 def suffix_location(location, suffix):
     if "." in location:
         return re.sub("\\.", suffix + ".", location, count=1)
 
     return location + suffix
+
+
+def render_pdf_pages(pdf_rasterizer, page_nums):
+    return [("$285", jpeg_data) for jpeg_data in pdf_rasterizer.render(page_nums)]
+
+
+def page_image_job(image_resource, converted_images):
+    # a copy of the resource is passed so that its raw media is not retained by the pool, or a JPEG-XR image already
+    # converted for another output is used instead
+    fmt, image_data = image_resource.format, image_resource.raw_media
+    converted = converted_images.get((image_resource.location, None)) if fmt == "$548" and converted_images is not None else None
+
+    if converted is not None:
+        image_data, fmt = converted
+
+    return (convert_page_image, (ImageResource(fmt, image_resource.location, image_data, image_resource.height,
+                                               image_resource.width),),
+            PagePool.PROCESS if fmt == "$548" else PagePool.THREAD)
+
+
+def convert_page_image(image_resource):
+    # returns the page image as stored in a CBZ file along with its form for a PDF page
+    fmt, image_data = image_resource.format, image_resource.raw_media
+
+    if fmt == "$548":
+        image_data, fmt = convert_jxr_to_jpeg_or_png(image_data, image_resource.location)
+
+    # there is no PDF page for a JPEG-XR image that could not be converted
+    return (fmt, image_data, None if fmt == "$548" else PdfPageImage(image_data))
+
+
+def record_converted_image(converted_images, image_resource, fmt, image_data):
+    if converted_images is not None and image_resource.format == "$548":
+        converted_images.add((image_resource.location, None), image_data, fmt)
+
+
+def convert_jxr_page(jxr_data, resource_name):
+    image_data, fmt = convert_jxr_to_jpeg_or_png(jxr_data, resource_name)
+    return [(fmt, image_data)]
+
+
+def run_with_logger(logger, fn, args):
+    set_logger(logger)
+    try:
+        return fn(*args)
+    finally:
+        set_logger()
+
+
+class PagePool(object):
+    # Prepares page images concurrently while returning them in page order. JPEG-XR decoding is pure Python
+    # (unless calibre is present) so it runs in worker processes, other page work is mostly done by PIL or
+    # pdftoppm with the GIL released so threads are enough. Pages are only submitted ahead while the image data
+    # held for pending pages stays within PAGE_MEMORY_BUDGET.
+
+    INLINE = 0
+    THREAD = 1
+    PROCESS = 2
+
+    def __init__(self, page_count):
+        self.workers = min(os.cpu_count() or 1, MAX_PAGE_WORKERS) if page_count >= PARALLEL_MIN_PAGES else 1
+        self.logger = get_current_logger()
+        self.thread_pool = self.process_pool = None
+        self.use_processes = calibre_numeric_version is None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for pool in [self.thread_pool, self.process_pool]:
+            if pool is not None:
+                pool.shutdown()
+
+        self.thread_pool = self.process_pool = None
+
+    def imap(self, jobs):
+        # jobs are (fn, args, mode) tuples, yields fn(*args) for each in order, or args[0] for INLINE jobs without fn
+        pending = collections.deque()
+        pending_size = 0
+
+        try:
+            for job in jobs:
+                size = job_size(job[1])
+
+                while pending and (len(pending) >= self.workers * 2 or pending_size + size > PAGE_MEMORY_BUDGET):
+                    pending_job, future, pending_job_size = pending.popleft()
+                    pending_size -= pending_job_size
+                    yield self.result(pending_job, future)
+
+                pending.append((job, self.submit(*job), size))
+                pending_size += size
+
+            while pending:
+                pending_job, future, pending_job_size = pending.popleft()
+                yield self.result(pending_job, future)
+        finally:
+            for job, future, size in pending:
+                if future is not None:
+                    future.cancel()
+
+    def submit(self, fn, args, mode):
+        if fn is None or mode == PagePool.INLINE or self.workers < 2:
+            return None
+
+        if mode == PagePool.PROCESS and self.use_processes:
+            try:
+                if self.process_pool is None:
+                    self.process_pool = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=self.workers, initializer=set_jxr_conversion_cache,
+                        initargs=jxr_conversion_cache_settings())
+
+                return self.process_pool.submit(fn, *args)
+            except (OSError, RuntimeError, ImportError) as e:
+                self.processes_unavailable(e)
+
+        if self.thread_pool is None:
+            self.thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+
+        return self.thread_pool.submit(run_with_logger, self.logger, fn, args)
+
+    def result(self, job, future):
+        fn, args, mode = job
+        if future is None:
+            return args[0] if fn is None else fn(*args)
+
+        try:
+            return future.result()
+        except (concurrent.futures.process.BrokenProcessPool, pickle.PicklingError) as e:
+            # no usable process pool here (frozen build, sandbox, ...)
+            self.processes_unavailable(e)
+            return fn(*args)
+
+    def processes_unavailable(self, e):
+        if self.use_processes:
+            log.warning("Parallel page conversion unavailable (%s), converting in threads" % repr(e))
+            self.use_processes = False
+
+
+def job_size(args):
+    return sum(len(arg) for arg in args if isinstance(arg, bytes)) + sum(
+        len(arg.raw_media) for arg in args if isinstance(arg, ImageResource) and arg.raw_media is not None)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+JPEG-XR デコードの段階ごとの処理時間を計測する
+
+    python tests/bench_jxr_stages.py [--no-numpy] [--tile-workers N] 画像.jxr|本.kfx ...
+
+KFX の本を指定した場合は本に含まれる JPEG-XR 画像をすべて使う。
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import kfxlib.jxr_image as jxr_image
+from kfxlib.jxr_container import JXRContainer
+
+JXR_SIGNATURE = b"\x49\x49\xbc\x01"
+
+STAGES = [
+    (jxr_image.JXRImage, "coded_image"),
+    (jxr_image.ImgPlane, "FirstLevelInverseTransform"),
+    (jxr_image.ImgPlane, "FirstLevelOverlapFiltering"),
+    (jxr_image.ImgPlane, "SecondLevelInverseTransform"),
+    (jxr_image.ImgPlane, "SecondLevelCoefficientCombination"),
+    (jxr_image.ImgPlane, "second_level_overlap_filtering"),
+    (jxr_image.ImgPlane, "OutputFormatting"),
+    (jxr_image.JXRImage, "construct_image"),
+    ]
+
+
+def book_images(filename):
+    from kfxlib.yj_book import YJ_Book
+
+    book = YJ_Book(filename)
+    book.decode_book(validate=False)
+    for fragment in book.fragments.get_all("$417"):
+        data = bytes(fragment.value)
+        if data.startswith(JXR_SIGNATURE):
+            yield "%s %s" % (os.path.basename(filename), fragment.fid), data
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-numpy", action="store_true", help="NumPy を使わずに計測する")
+    parser.add_argument("--tile-workers", type=int, default=1)
+    parser.add_argument("files", nargs="+")
+    args = parser.parse_args()
+
+    if args.no_numpy:
+        jxr_image.np = None
+
+    images = []
+    for filename in args.files:
+        if filename.lower().endswith(".jxr"):
+            with open(filename, "rb") as f:
+                images.append((os.path.basename(filename), f.read()))
+        else:
+            images.extend(book_images(filename))
+
+    times = {}
+
+    def timed(cls, name):
+        fn = getattr(cls, name)
+
+        def wrapper(self, *a, **kw):
+            start = time.perf_counter()
+            try:
+                return fn(self, *a, **kw)
+            finally:
+                times[name] = times.get(name, 0.0) + time.perf_counter() - start
+
+        setattr(cls, name, wrapper)
+
+    for cls, name in STAGES:
+        timed(cls, name)
+
+    print("NumPy: %s, tile workers: %d" % ("no" if jxr_image.np is None else "yes", args.tile_workers))
+    total = 0.0
+    for label, data in images:
+        times.clear()
+        container = JXRContainer(data)
+        start = time.perf_counter()
+        image = jxr_image.JXRImage(container.image_data)
+        im = image.decode(args.tile_workers)
+        elapsed = time.perf_counter() - start
+        total += elapsed
+
+        print("\n%s: %s %dx%d, overlap mode %d, %.3fs" % (label, im.mode, im.size[0], im.size[1], image.overlap_mode, elapsed))
+        for cls, name in STAGES:
+            if name in times:
+                print("  %-36s %8.3fs" % (name, times[name]))
+
+    print("\ntotal %.3fs for %d images" % (total, len(images)))
+
+
+if __name__ == "__main__":
+    main()
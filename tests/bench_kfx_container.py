@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+KFX コンテナのデコードの処理時間とメモリ割り当てを計測する
+
+    python tests/bench_kfx_container.py [--scale N] [--baseline 旧リポジトリ] ...
+
+合成したコンテナ（ネストした構造体のストーリーライン 3000 個と 200 KB の画像 300 個、
+--scale 1 で約 60 MB）を作り、deserialize() と全フラグメントの値の取り出しにかかる
+CPU 時間と tracemalloc のピークを表示する。--baseline に以前の版の kfxlib を含む
+ディレクトリ（git worktree add などで用意する）を指定すると、同じコンテナを両方で
+計測し、デコード結果が一致することも確かめる。
+"""
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STORYLINES = 3000
+STRUCT_DEPTH = 20
+RAW_MEDIA = 300
+RAW_MEDIA_SIZE = 200 * 1024
+
+
+def build_container(scale):
+    from kfxlib.ion import IonBLOB, IonStruct, IS
+    from kfxlib.ion_symbol_table import LocalSymbolTable
+    from kfxlib.kfx_container import KfxContainer
+    from kfxlib.yj_container import YJFragment, YJFragmentList
+    from kfxlib.yj_symbol_catalog import YJ_SYMBOLS
+
+    storylines = STORYLINES * scale
+    raw_media = RAW_MEDIA * scale
+    local = ["story%d" % i for i in range(storylines)] + ["loc%d" % i for i in range(raw_media)]
+    symdata = IonStruct(IS("imports"), [IonStruct(IS("name"), "YJ_symbols", IS("version"), 10,
+                                                  IS("max_id"), len(YJ_SYMBOLS.symbols))], IS("symbols"), local)
+    symtab = LocalSymbolTable(YJ_SYMBOLS.name)
+    symtab.create(symdata)
+
+    fragments = YJFragmentList([
+        YJFragment(ftype="$ion_symbol_table", value=symdata),
+        YJFragment(ftype="$270", value=IonStruct(IS("$409"), "CR!BENCHMARK", IS("$587"), "", IS("$588"), "")),
+        YJFragment(ftype="$593", value=[])])
+
+    for i in range(storylines):
+        content = IonStruct(IS("$155"), 100000 + i, IS("$159"), IS("$269"), IS("$145"), "text %d" % i)
+        for depth in range(STRUCT_DEPTH):
+            content = IonStruct(IS("$155"), 200000 + i * STRUCT_DEPTH + depth, IS("$159"), IS("$270"),
+                                IS("$156"), IS("$326"), IS("$146"), [content])
+        fragments.append(YJFragment(ftype="$259", fid=IS("story%d" % i), value=IonStruct(
+            IS("$176"), IS("story%d" % i), IS("$146"), [content])))
+
+    for i in range(raw_media):
+        data = hashlib.sha256(b"%d" % i).digest() * (RAW_MEDIA_SIZE // 32)
+        fragments.append(YJFragment(ftype="$417", fid=IS("loc%d" % i), value=IonBLOB(data)))
+
+    return KfxContainer(symtab, fragments=fragments).serialize()
+
+
+def measure(filename):
+    # 計測対象の kfxlib で実行され、結果を JSON で出力する
+    from kfxlib.ion_symbol_table import LocalSymbolTable
+    from kfxlib.kfx_container import KfxContainer
+    from kfxlib.utilities import DataFile
+    from kfxlib.yj_symbol_catalog import YJ_SYMBOLS
+
+    with open(filename, "rb") as f:
+        data = f.read()
+
+    container = KfxContainer(LocalSymbolTable(YJ_SYMBOLS.name), DataFile(filename, data))
+
+    tracemalloc.start()
+    start = time.process_time()
+    container.deserialize()
+    fragments = list(container.get_fragments())
+    values = [fragment.value for fragment in fragments]
+    elapsed = time.process_time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    digest = hashlib.sha256()
+    for fragment, value in zip(fragments, values):
+        digest.update(repr((fragment.ftype, fragment.fid, value)).encode("utf-8"))
+
+    print(json.dumps({"fragments": len(fragments), "seconds": elapsed, "peak": peak, "digest": digest.hexdigest()}))
+
+
+def run(root, filename):
+    env = dict(os.environ, PYTHONPATH=root)
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", filename], env=env, cwd=root,
+                            stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=int, default=1, help="コンテナの大きさの倍率")
+    parser.add_argument("--baseline", action="append", default=[], help="比較する kfxlib を含むディレクトリ")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure)
+        return
+
+    sys.path.insert(0, ROOT)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filename = os.path.join(temp_dir, "bench.kfx")
+        with open(filename, "wb") as f:
+            f.write(build_container(args.scale))
+
+        print("container: %.1f MB" % (os.path.getsize(filename) / (1024 * 1024)))
+        results = []
+        for root in args.baseline + [ROOT]:
+            result = run(os.path.abspath(root), filename)
+            results.append(result)
+            print("%-40s %6d fragments %8.2fs CPU %9.1f MB peak" % (
+                root, result["fragments"], result["seconds"], result["peak"] / (1024 * 1024)))
+
+        if len(set(result["digest"] for result in results)) > 1:
+            print("decoded fragments differ")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+# azw2zip.py と同じ検索パスでモジュールを読み込む
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "DeDRM_Plugin"), os.path.join(ROOT, "KindleUnpack", "lib")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
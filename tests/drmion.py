@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# テスト用の DRMION コンテナを作る（ion.DrmIon が復号できる最小限の構造）
+import lzma
+import os
+
+try:
+    from Cryptodome.Cipher import AES
+except ImportError:
+    from Crypto.Cipher import AES
+
+import ion
+
+SID = dict((name, 10 + i) for i, name in enumerate(ion.SYM_NAMES))
+
+
+class Voucher(object):
+    # DrmIon が使う復号済みバウチャーの代わり
+    def __init__(self, secretkey=None):
+        self.secretkey = secretkey or os.urandom(16)
+
+
+def varuint(n):
+    out = [n & 0x7f | 0x80]
+    n >>= 7
+    while n:
+        out.insert(0, n & 0x7f)
+        n >>= 7
+    return bytes(out)
+
+
+def typed(tid, body):
+    if len(body) < 14 and not (tid == 0xD and len(body) == 1):
+        return bytes([tid << 4 | len(body)]) + body
+    return bytes([tid << 4 | 14]) + varuint(len(body)) + body
+
+
+def uint(n):
+    return n.to_bytes((n.bit_length() + 7) // 8, "big")
+
+
+def symbol(sid):
+    return typed(7, uint(sid))
+
+
+def string(s):
+    return typed(8, s.encode("utf-8"))
+
+
+def blob(b):
+    return typed(0xA, b)
+
+
+def integer(n):
+    return typed(2, uint(n))
+
+
+def struct(fields):
+    return typed(0xD, b"".join(varuint(f) + v for f, v in fields))
+
+
+def ion_list(items):
+    return typed(0xB, b"".join(items))
+
+
+def annotated(sids, value):
+    annots = b"".join(varuint(sid) for sid in sids)
+    return typed(0xE, varuint(len(annots)) + annots + value)
+
+
+def drmion(voucher, data, page_size=4096, compress=True, envelopes=2):
+    """
+    data を page_size ごとの暗号化ページに分け、DRMION ヘッダーとトレーラ付きで返す
+    """
+    pages = [data[i:i + page_size] for i in range(0, len(data), page_size)] or [b""]
+    out = b"\xe0\x01\x00\xea"
+    out += annotated([3], struct([(6, ion_list([struct([
+        (4, string("ProtectedData")), (5, integer(1)), (8, integer(len(ion.SYM_NAMES)))])]))]))
+    out += annotated([SID["doctype"]], symbol(SID["com.amazon.drm.Envelope@1.0"]))
+
+    envelopes = min(envelopes, len(pages))
+    per_envelope = (len(pages) + envelopes - 1) // envelopes
+    for e in range(envelopes):
+        items = [annotated([SID["com.amazon.drm.EnvelopeMetadata@1.0"]], struct([(SID["encryption_voucher"], string("v1"))]))]
+        for page in pages[e * per_envelope:(e + 1) * per_envelope]:
+            plain = b"\0" + lzma.compress(page, format=lzma.FORMAT_ALONE) if compress else page
+            iv = os.urandom(16)
+            padding = 16 - len(plain) % 16
+            cipher_text = blob(AES.new(voucher.secretkey, AES.MODE_CBC, iv).encrypt(plain + bytes([padding]) * padding))
+            if compress:
+                cipher_text = annotated([SID["com.amazon.drm.Compressed@1.0"]], cipher_text)
+            items.append(annotated([SID["com.amazon.drm.EncryptedPage@1.0"]], struct([
+                (SID["cipher_text"], cipher_text), (SID["cipher_iv"], blob(iv))])))
+        out += annotated([SID["com.amazon.drm.Envelope@1.0"]], ion_list(items))
+
+    out += annotated([SID["enddoc"]], symbol(SID["enddoc"]))
+    return b"\xeaDRMION\xee" + out + b"\0" * 8
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# テスト用の固定レイアウト KFX ブックを合成する
+import io
+import re
+import zipfile
+
+from PIL import Image, ImageDraw
+
+from kfxlib.ion import IonBLOB, IonStruct, IS
+from kfxlib.ion_symbol_table import LocalSymbolTable
+from kfxlib.kfx_container import KfxContainer
+from kfxlib.yj_container import YJFragment, YJFragmentList
+from kfxlib.yj_symbol_catalog import YJ_SYMBOLS
+
+ASSET_ID = "CR!SYNTHETICCOMIC00000000000000"
+
+
+def page_image(i, width, height, fmt="JPEG", mode="RGB"):
+    im = Image.new("RGB", (width, height), ((i * 37) % 256, (i * 91) % 256, (i * 53) % 256))
+    draw = ImageDraw.Draw(im)
+    for k in range(20):
+        draw.line((0, k * height // 20, width, (k * 7 * height // 20) % height), fill=(255 - (i * 5) % 256, k * 12, 90), width=3)
+    draw.text((width // 3, height // 2), "page %d" % i, fill=(255, 255, 255))
+    if mode != "RGB":
+        im = im.convert(mode)
+    data = io.BytesIO()
+    if fmt == "JPEG":
+        im.save(data, fmt, quality=90)
+    else:
+        im.save(data, fmt)
+    return data.getvalue()
+
+
+def build_book(npages=4, width=160, height=240, images=None, resource_container=False, extra_fragments=False):
+    """
+    KFX コンテナのデータを {ファイル名: bytes} で返す
+
+    images: ページ番号 -> (フォーマットシンボル, 画像データ) で既定の JPEG を置き換える
+    resource_container: 後半のページのリソースを別コンテナ (.res) に入れる
+    extra_fragments: 重複フラグメントと参照されないフラグメントを追加する
+    """
+    images = images or {}
+    names = {}
+    for i in range(npages):
+        for k in ("sec", "story", "img", "res", "loc"):
+            names[(k, i)] = "%s%d" % (k, i)
+
+    local = list(names.values()) + ["unused_loc", ASSET_ID]
+    symdata = IonStruct(IS("imports"), [IonStruct(IS("name"), "YJ_symbols", IS("version"), 10, IS("max_id"), len(YJ_SYMBOLS.symbols))],
+                        IS("symbols"), local)
+    symtab = LocalSymbolTable(YJ_SYMBOLS.name)
+    symtab.create(symdata)
+
+    def N(k, i):
+        return IS(names[(k, i)])
+
+    def container_fragments(container_id):
+        return YJFragmentList([
+            YJFragment(ftype="$ion_symbol_table", value=symdata),
+            YJFragment(ftype="$270", value=IonStruct(IS("$409"), container_id, IS("$587"), "", IS("$588"), "")),
+            YJFragment(ftype="$593", value=[])])
+
+    main = container_fragments(ASSET_ID)
+    res = container_fragments(ASSET_ID + "-res")
+    sections = []
+    pos_map = []
+    pid_map = []
+    eid = 1000
+    for i in range(npages):
+        pt_eid, img_eid = eid, eid + 1
+        eid += 2
+        fmt, data = images.get(i) or ("$285", page_image(i, width, height))
+        main.append(YJFragment(ftype="$260", fid=N("sec", i), value=IonStruct(
+            IS("$174"), N("sec", i),
+            IS("$141"), [IonStruct(IS("$155"), pt_eid, IS("$159"), IS("$270"), IS("$156"), IS("$326"),
+                                   IS("$176"), N("story", i), IS("$66"), width, IS("$67"), height)])))
+        main.append(YJFragment(ftype="$259", fid=N("story", i), value=IonStruct(
+            IS("$176"), N("story", i),
+            IS("$146"), [IonStruct(IS("$155"), img_eid, IS("$159"), IS("$271"), IS("$175"), N("res", i))])))
+        target = res if resource_container and i >= npages // 2 else main
+        resource = YJFragment(ftype="$164", fid=N("res", i), value=IonStruct(
+            IS("$175"), N("res", i), IS("$161"), IS(fmt), IS("$165"), names[("loc", i)], IS("$422"), width, IS("$423"), height))
+        target.append(resource)
+        target.append(YJFragment(ftype="$417", fid=IS(names[("loc", i)]), value=IonBLOB(data)))
+        if extra_fragments and i == 0:
+            res.append(resource)
+        sections.append(N("sec", i))
+        pos_map.append(IonStruct(IS("$181"), [pt_eid, img_eid], IS("$174"), N("sec", i)))
+        pid_map.append(IonStruct(IS("$184"), 2 * i, IS("$185"), pt_eid))
+        pid_map.append(IonStruct(IS("$184"), 2 * i + 1, IS("$185"), img_eid))
+
+    if extra_fragments:
+        main.append(YJFragment(ftype="$417", fid=IS("unused_loc"), value=IonBLOB(page_image(99, 8, 8))))
+
+    pid_map.append(IonStruct(IS("$184"), 2 * npages, IS("$185"), 0))
+    main.append(YJFragment(ftype="$538", value=IonStruct(
+        IS("$169"), [IonStruct(IS("$178"), IS("$351"), IS("$170"), sections)])))
+    main.append(YJFragment(ftype="$490", value=IonStruct(IS("$491"), [
+        IonStruct(IS("$495"), "kindle_title_metadata", IS("$258"), [
+            IonStruct(IS("$492"), "title", IS("$307"), "Synthetic Comic"),
+            IonStruct(IS("$492"), "author", IS("$307"), "Test Author"),
+            IonStruct(IS("$492"), "language", IS("$307"), "en"),
+            IonStruct(IS("$492"), "asset_id", IS("$307"), ASSET_ID),
+            IonStruct(IS("$492"), "cde_content_type", IS("$307"), "EBOK"),
+            IonStruct(IS("$492"), "book_id", IS("$307"), "SYNTHCOMIC"),
+            IonStruct(IS("$492"), "cover_image", IS("$307"), N("res", 0)),
+            ]),
+        IonStruct(IS("$495"), "kindle_capability_metadata", IS("$258"), [
+            IonStruct(IS("$492"), "yj_fixed_layout", IS("$307"), 1),
+            ]),
+        ])))
+    main.append(YJFragment(ftype="$389", value=[IonStruct(IS("$178"), IS("$351"), IS("$392"), [])]))
+    main.append(YJFragment(ftype="$264", value=pos_map))
+    main.append(YJFragment(ftype="$265", value=pid_map))
+    main.append(YJFragment(ftype="$550", value=[IonStruct(IS("$182"), [IonStruct(IS("$155"), 1000, IS("$143"), 0)])]))
+
+    containers = {"book.kfx": main}
+    if len(res) > 3:
+        containers["book.res"] = res
+
+    main.append(YJFragment(ftype="$419", value=IonStruct(IS("$252"), [IonStruct(
+        IS("$155"), fragments.get("$270").value["$409"],
+        IS("$181"), [f.fid for f in fragments if not f.is_single()]) for fragments in containers.values()])))
+
+    return dict((name, KfxContainer(symtab, fragments=fragments).serialize()) for name, fragments in containers.items())
+
+
+def write_book(directory, **kwargs):
+    for name, data in build_book(**kwargs).items():
+        with open(str(directory / name), "wb") as f:
+            f.write(data)
+    return str(directory)
+
+
+def epub_members(data):
+    # dcterms:modified は変換時刻なので比較から外す
+    members = {}
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        for info in zf.infolist():
+            members[info.filename] = re.sub(br"<meta property=\"dcterms:modified\">[^<]*</meta>", b"", zf.read(info))
+    return members
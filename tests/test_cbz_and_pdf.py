@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import re
+import tracemalloc
+import zipfile
+
+import pytest
+from PIL import Image
+
+import kfxlib.yj_to_image_book as yj_to_image_book
+from kfxlib.resources import ImageResource
+from kfxlib.yj_book import YJ_Book
+from kfxlib.yj_to_image_book import combine_images_into_cbz_and_pdf, combine_images_into_pdf
+
+from kfxbook import page_image, write_book
+
+
+def ordered_images(broken_page=None):
+    images = []
+    for i in range(3):
+        if i == broken_page:
+            # JPEG-XR として変換できないデータ
+            images.append(ImageResource("$548", "page%d.jxr" % i, b"II\xbc\x01 not a JPEG-XR image", 240, 160))
+        else:
+            images.append(ImageResource("$285", "page%d.jpg" % i, page_image(i, 160, 240), 240, 160))
+    return images
+
+
+def convert(tmp_path, images):
+    cbz_path = str(tmp_path / "book.cbz")
+    pdf_path = str(tmp_path / "book.pdf")
+    return combine_images_into_cbz_and_pdf(images, cbz_outfile=cbz_path, pdf_outfile=pdf_path), cbz_path, pdf_path
+
+
+def test_cbz_and_pdf(tmp_path):
+    (cbz_result, pdf_result), cbz_path, pdf_path = convert(tmp_path, ordered_images())
+
+    assert (cbz_result, pdf_result) == (cbz_path, pdf_path)
+    with open(pdf_path, "rb") as f:
+        assert len(re.findall(br"/Type /Page\b(?!s)", f.read())) == 3
+
+
+def test_unconverted_jxr_abandons_only_pdf(tmp_path):
+    (cbz_result, pdf_result), cbz_path, pdf_path = convert(tmp_path, ordered_images(broken_page=1))
+
+    # CBZ には変換できなかったページも元のまま入り、PDF だけが作成されない
+    assert cbz_result == cbz_path
+    assert pdf_result is None
+    assert not os.path.exists(pdf_path)
+
+    with zipfile.ZipFile(cbz_path) as zf:
+        assert zf.namelist() == ["0001.jpg", "0002.jxr", "0003.jpg"]
+
+
+def test_unconverted_jxr_in_memory():
+    cbz_data, pdf_data = combine_images_into_cbz_and_pdf(ordered_images(broken_page=0))
+
+    assert cbz_data.startswith(b"PK")
+    assert pdf_data is None
+
+
+def test_unconverted_jxr_abandons_standalone_pdf(tmp_path):
+    pdf_path = str(tmp_path / "book.pdf")
+
+    assert combine_images_into_pdf(ordered_images(broken_page=2), outfile=pdf_path) is None
+    assert not os.path.exists(pdf_path)
+    assert combine_images_into_pdf(ordered_images(broken_page=0)) is None
+    assert combine_images_into_pdf(ordered_images(), outfile=pdf_path) == pdf_path
+
+
+def noise_jpeg(size):
+    data = io.BytesIO()
+    Image.frombytes("L", (size, size), os.urandom(size * size)).save(data, "JPEG", quality=95)
+    return data.getvalue()
+
+
+@pytest.mark.parametrize("fmt", ["cbz", "pdf"])
+def test_page_raw_media_freed_after_write(monkeypatch, tmp_path, fmt):
+    npages = 8
+    # 先読みを 2 ページまでにする
+    monkeypatch.setattr(yj_to_image_book, "PARALLEL_MIN_PAGES", npages + 1)
+    page_data = noise_jpeg(1000)
+    path = write_book(tmp_path, npages=npages, width=1000, height=1000,
+                      images=dict((i, ("$285", page_data)) for i in range(npages)))
+    book = YJ_Book(path)
+    book.decode_book(validate=False)
+
+    # 各ページの画像データを読み込む時点で、書き出し済みのページのデータが残っていないこと
+    in_use = []
+    for fragment in book.fragments.get_all("$417"):
+        def loader(load=fragment.loader):
+            in_use.append(tracemalloc.get_traced_memory()[0])
+            return load()
+
+        fragment.loader = loader
+
+    outfile = str(tmp_path / ("book." + fmt))
+    tracemalloc.start()
+    try:
+        if fmt == "cbz":
+            book.convert_to_cbz(outfile=outfile)
+        else:
+            book.convert_to_pdf(outfile=outfile)
+    finally:
+        tracemalloc.stop()
+
+    # 表紙のメタデータでも 1 回読み込まれる
+    assert len(in_use) == npages + 1
+    assert max(in_use) < 4 * len(page_data)
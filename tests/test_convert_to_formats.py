@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import re
+import zipfile
+
+import azw2zip
+from kfxlib.yj_book import YJ_Book
+
+from kfxbook import epub_members, write_book
+from test_converted_images import JXR_DATA
+
+
+def cbz_members(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        return [(name, zf.read(name)) for name in zf.namelist()]
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def page_count(pdf_data):
+    return len(re.findall(br"/Type /Page\b(?!s)", pdf_data))
+
+
+def book_dir(tmp_path):
+    path = tmp_path / "book"
+    path.mkdir()
+    return write_book(path, npages=3, width=120, height=90, images={1: ("$548", JXR_DATA)})
+
+
+def test_formats_match_separate_conversions(tmp_path):
+    path = book_dir(tmp_path)
+    outfiles = dict((fmt, str(tmp_path / ("out." + fmt))) for fmt in ["cbz", "pdf", "epub"])
+
+    results = YJ_Book(path).convert_to_formats(["cbz", "pdf", "epub"], outfiles)
+    assert results == outfiles
+
+    assert cbz_members(read(outfiles["cbz"])) == cbz_members(YJ_Book(path).convert_to_cbz())
+    assert epub_members(read(outfiles["epub"])) == epub_members(YJ_Book(path).convert_to_epub())
+    assert page_count(read(outfiles["pdf"])) == page_count(YJ_Book(path).convert_to_pdf()) == 3
+
+
+def test_failed_output_does_not_stop_others(monkeypatch, tmp_path):
+    path = book_dir(tmp_path)
+
+    def fail(*args, **kwargs):
+        raise Exception("page conversion failed")
+
+    monkeypatch.setattr(YJ_Book, "convert_to_cbz_and_pdf", fail)
+    results = YJ_Book(path).convert_to_formats(["cbz", "pdf", "epub"])
+
+    assert results["cbz"] is None and results["pdf"] is None
+    assert epub_members(results["epub"]) == epub_members(YJ_Book(path).convert_to_epub())
+
+
+def test_azw2zip_converts_all_formats_together(monkeypatch, tmp_path):
+    path = book_dir(tmp_path)
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+
+    calls = []
+    convert_to_formats = YJ_Book.convert_to_formats
+
+    def record(self, formats, *args, **kwargs):
+        calls.append(list(formats))
+        return convert_to_formats(self, formats, *args, **kwargs)
+
+    monkeypatch.setattr(YJ_Book, "convert_to_formats", record)
+    result = azw2zip.process_kfx_to_images(path, str(out_dir), "out", True, True, False, False, output_pdf=True)
+
+    # azw2zip は $260 のある本を固定レイアウトの画像本として扱わないので、CBZ の代わりに EPUB を作る
+    expected = [str(out_dir / ("out." + fmt)) for fmt in ["pdf", "epub"]]
+    assert calls == [["pdf", "epub"]]
+    assert result["output"] == expected
+    assert all(os.path.isfile(outfile) for outfile in expected)
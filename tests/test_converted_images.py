@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import zipfile
+
+import kfxlib.resources as resources
+from kfxlib.resources import ConvertedImages
+from kfxlib.yj_book import YJ_Book
+
+from kfxbook import epub_members, write_book
+
+JXR_DATA = open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "tiled_alpha.jxr"), "rb").read()
+
+
+def test_size_limit():
+    converted_images = ConvertedImages(max_size=10)
+    converted_images.add(("a.pdf", 1), b"123456", "$285")
+    converted_images.add(("a.pdf", 2), b"123456", "$285")
+    converted_images.add(("b.jxr", None), b"1234", "$284")
+    converted_images.add(("c.jxr", None), b"1", "$548")
+
+    # 上限を超える変換結果と変換に失敗した JPEG-XR は保持しない
+    assert converted_images.get(("a.pdf", 1)) == (b"123456", "$285")
+    assert converted_images.get(("a.pdf", 2)) is None
+    assert converted_images.get(("b.jxr", None)) == (b"1234", "$284")
+    assert converted_images.get(("c.jxr", None)) is None
+    assert converted_images.size == 10
+
+
+def test_jxr_left_to_conversion_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(resources, "jxr_conversion_cache", resources.JXRConversionCache(str(tmp_path)))
+    converted_images = ConvertedImages()
+    converted_images.add(("a.pdf", 1), b"123456", "$285")
+    converted_images.add(("b.jxr", None), b"1234", "$284")
+
+    assert converted_images.get(("a.pdf", 1)) == (b"123456", "$285")
+    assert converted_images.get(("b.jxr", None)) is None
+
+
+def cbz_members(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        return [(name, zf.read(name)) for name in zf.namelist()]
+
+
+def convert(path, converted_images):
+    book = YJ_Book(path)
+    cbz_data = book.convert_to_cbz(converted_images=converted_images)
+    book = YJ_Book(path)
+    return cbz_data, book.convert_to_epub(converted_images=converted_images)
+
+
+def test_bounded_conversions_give_same_output(monkeypatch, tmp_path):
+    path = write_book(tmp_path, npages=3, width=120, height=90, images={0: ("$548", JXR_DATA), 2: ("$548", JXR_DATA)})
+    cbz_data, epub_data = convert(path, None)
+    assert [name for name, data in cbz_members(cbz_data)] == ["0001.png", "0002.jpg", "0003.png"]
+
+    for max_size in [0, len(epub_data), 1024 * 1024]:
+        converted_images = ConvertedImages(max_size)
+        cbz_shared, epub_shared = convert(path, converted_images)
+        assert cbz_members(cbz_shared) == cbz_members(cbz_data)
+        assert epub_members(epub_shared) == epub_members(epub_data)
+        assert converted_images.size <= max_size
+        assert (converted_images.size > 0) == (max_size > 0)
+
+    # 変換キャッシュがあれば JPEG-XR の変換結果はメモリに保持しない
+    monkeypatch.setattr(resources, "jxr_conversion_cache", resources.JXRConversionCache(str(tmp_path / "cache")))
+    converted_images = ConvertedImages()
+    cbz_cached, epub_cached = convert(path, converted_images)
+    assert converted_images.size == 0
+    assert cbz_members(cbz_cached) == cbz_members(cbz_data)
+    assert epub_members(epub_cached) == epub_members(epub_data)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from kfxlib.yj_book import YJ_Book
+from kfxlib.yj_container import YJLazyFragment
+
+from kfxbook import epub_members, write_book
+
+
+def convert(path, fmt, validate):
+    book = YJ_Book(path)
+    book.decode_book(validate=validate)
+    return book.convert_to_cbz() if fmt == "cbz" else book.convert_to_epub()
+
+
+@pytest.mark.parametrize("multi_container", [False, True])
+def test_trusted_decode_output_matches(tmp_path, multi_container):
+    path = write_book(tmp_path, npages=4, resource_container=multi_container, extra_fragments=multi_container)
+
+    assert convert(path, "cbz", False) == convert(path, "cbz", True)
+    assert epub_members(convert(path, "epub", False)) == epub_members(convert(path, "epub", True))
+
+
+def test_trusted_decode_drops_extra_fragments(tmp_path):
+    path = write_book(tmp_path, npages=4, resource_container=True, extra_fragments=True)
+    validated = YJ_Book(path)
+    validated.decode_book()
+    trusted = YJ_Book(path)
+    trusted.decode_book(validate=False)
+
+    assert list(trusted.fragments) == list(validated.fragments)
+    assert len(trusted.fragments.get_all("$ion_symbol_table")) == 1
+    assert trusted.fragments.get(ftype="$417", fid="unused_loc") is None
+
+
+@pytest.mark.parametrize("validate", [False, True])
+def test_raw_media_left_unloaded(tmp_path, validate):
+    path = write_book(tmp_path, npages=6, resource_container=True)
+    book = YJ_Book(path)
+    book.decode_book(validate=validate)
+
+    # 参照をたどるのに必要な構造だけを読み込み、画像データは使われるまで読み込まない
+    lazy = [fragment for fragment in book.fragments if isinstance(fragment, YJLazyFragment)]
+    unloaded = [fragment for fragment in lazy if "loader" in fragment.__dict__]
+    assert len(lazy) == 30
+    assert sorted(set(fragment.ftype for fragment in unloaded)) == ["$417"]
+    assert len(unloaded) == 6
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import decimal
+import random
+
+import kfxlib.ion_binary as ion_binary
+from kfxlib.ion import IonAnnotation, IonBLOB, IonCLOB, IonNop, IonSExp, IonStruct, IonTimestamp, IS
+from kfxlib.ion_binary import IonBinary
+from kfxlib.ion_symbol_table import LocalSymbolTable
+from kfxlib.message_logging import log
+from kfxlib.utilities import Deserializer
+from kfxlib.yj_symbol_catalog import YJ_SYMBOLS
+
+
+def decode(data, debug, monkeypatch):
+    # debug=True で従来の deserialize_value_ を、False で表駆動の decode_value を使う
+    monkeypatch.setattr(ion_binary, "DEBUG", debug)
+    monkeypatch.setattr(log, "debug", lambda *args, **kwargs: None)
+    serial = Deserializer(memoryview(data))
+    try:
+        value = IonBinary(LocalSymbolTable(YJ_SYMBOLS.name)).deserialize_value(serial)
+    except Exception as e:
+        return ("error", type(e), str(e).startswith("Deserializer: Insufficient data"))
+
+    return ("value", None if isinstance(value, IonNop) else repr(value), type(value), serial.offset)
+
+
+def assert_same(data, monkeypatch):
+    old = decode(data, True, monkeypatch)
+    assert decode(data, False, monkeypatch) == old, data.hex()
+    return old
+
+
+def encode(value):
+    return IonBinary(LocalSymbolTable(YJ_SYMBOLS.name)).serialize_value(value)
+
+
+VALUES = [
+    None, True, False, 0, 1, 255, 256, 65535, 65536, -1, -300, 2 ** 63 + 3, -(2 ** 64 - 1), 1.5, -0.25,
+    decimal.Decimal("0"), decimal.Decimal("-12.345"), decimal.Decimal("1E+10"),
+    IonTimestamp(2024, 2, 29, 12, 30, 15), "", "short", "x" * 13, "x" * 14, "日本語" * 100,
+    IS("$155"), IS("$ion_symbol_table"), IonBLOB(b""), IonBLOB(bytes(range(256)) * 3), IonCLOB(b"clob"),
+    [], [1, "two", [IS("$3")]], IonSExp([IS("$4"), 5]),
+    IonStruct(), IonStruct(IS("$155"), 1, IS("$159"), IS("$269"), IS("$146"), [IonStruct(IS("$145"), "t" * 200)]),
+    IonAnnotation([IS("$164")], IonStruct(IS("$175"), IS("$4"))),
+    IonAnnotation([IS("$3"), IS("$4")], [1, 2, 3]),
+    ]
+
+
+def test_values_and_truncations(monkeypatch):
+    for value in VALUES:
+        data = encode(value)
+        result = assert_same(data, monkeypatch)
+        assert result[0] == "value" and result[3] == len(data)
+
+        for size in range(len(data)):
+            result = assert_same(data[:size], monkeypatch)
+            assert result[0] == "error" and result[2], data[:size].hex()
+
+
+def test_every_descriptor(monkeypatch):
+    rng = random.Random(36)
+    for descriptor in range(256):
+        for payload_size in [0, 1, 2, 3, 8, 13, 20, 200]:
+            payload = bytes(rng.randrange(256) for i in range(payload_size))
+            assert_same(bytes([descriptor]) + payload, monkeypatch)
+
+            if descriptor & 0x0f == 14:
+                for length in [0, payload_size, payload_size + 1]:
+                    assert_same(bytes([descriptor]) + ion_binary.serialize_vluint(length) + payload, monkeypatch)
+
+
+def test_nested_length_past_container(monkeypatch):
+    # 構造体の中の値が構造体の終わりを越えて親のデータを読まないこと
+    data = bytearray(encode(IonStruct(IS("$155"), [1, 2, 3])))
+    data[2] = 0xbe
+    assert_same(bytes(data) + ion_binary.serialize_vluint(10) + bytes(10), monkeypatch)
+
+    for tail in [b"\x01", b"\x01\x02", b"\x01\x02\x83"]:
+        assert_same(b"\xd3" + tail + b"\x21\x05", monkeypatch)
+        assert_same(b"\xe4" + tail + b"\x21\x05", monkeypatch)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+
+import pytest
+
+from kfxlib.jxr_container import JXRContainer
+
+TILED_ALPHA_JXR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "tiled_alpha.jxr")
+
+# 表引きによるハフマン復号の導入前のデコーダーでの画素の SHA-256
+TILED_ALPHA_SHA256 = "6f2b315e747470d04ca4505991544678854150e16afb03ef5a71888d78359d80"
+
+
+def test_tiled_alpha_pinned():
+    with open(TILED_ALPHA_JXR, "rb") as f:
+        image = JXRContainer(f.read()).unpack_image()
+
+    assert (image.mode, image.size) == ("RGBA", (120, 90))
+    assert hashlib.sha256(image.tobytes()).hexdigest() == TILED_ALPHA_SHA256
+
+
+def make_image(height, width, channels):
+    np = pytest.importorskip("numpy")
+    rng = np.random.default_rng(height * width * channels)
+    y, x = np.mgrid[0:height, 0:width]
+    planes = [(x * (3 + c) + y * (5 - c)) % 256 for c in range(channels)]
+    noise = rng.integers(0, 64, (height, width, channels))
+    image = (np.stack(planes, axis=-1) + noise) % 256
+    return image.astype(np.uint8)[..., 0] if channels == 1 else image.astype(np.uint8)
+
+
+# これより低い品質では色差が間引かれ (YUV420)、デコーダーが対応していない
+@pytest.mark.parametrize("level", [1.0, 0.9, 0.7, 0.5])
+@pytest.mark.parametrize("channels", [1, 3, 4])
+@pytest.mark.parametrize("height,width", [(16, 16), (37, 53), (90, 120), (17, 300)])
+def test_matches_reference_decoder(height, width, channels, level):
+    imagecodecs = pytest.importorskip("imagecodecs")
+    np = pytest.importorskip("numpy")
+    if not imagecodecs.JPEGXR.available:
+        pytest.skip("imagecodecs has no JPEG-XR codec")
+
+    data = imagecodecs.jpegxr_encode(make_image(height, width, channels), level=level)
+    expected = imagecodecs.jpegxr_decode(data)
+    actual = np.asarray(JXRContainer(data).unpack_image())
+
+    if channels == 4:
+        # 32bppRGBA のインターリーブされたアルファは復号しないので、色だけを比べる
+        expected = expected[..., :3]
+
+    assert actual.shape == expected.shape
+    assert (actual == expected).all()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import os
+
+import kfxlib.jxr_image as jxr_image
+from kfxlib.jxr_container import JXRContainer
+from kfxlib.jxr_misc import Deserializer
+
+# 120x90 RGBA、空間モード、3x2 タイル、インデックステーブルあり、アルファプレーンあり、オーバーラップモード 2
+TILED_ALPHA_JXR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "tiled_alpha.jxr")
+
+
+def decode_coefficients(tile_workers):
+    with open(TILED_ALPHA_JXR, "rb") as f:
+        image = jxr_image.JXRImage(JXRContainer(f.read()).image_data)
+
+    image.ds = Deserializer(image.data)
+    image.coded_image(tile_workers)
+    planes = [[[mb.MBBuffer for mb in column] for column in plane.Mb] for plane in image.planes]
+    return image, planes
+
+
+def test_parallel_tiles_match_sequential(monkeypatch):
+    sequential_image, sequential = decode_coefficients(1)
+    assert sequential_image.NumTileCols * sequential_image.NumTileRows == 6
+    assert sequential_image.alpha_plane is not None
+    assert len(sequential) == 2
+
+    # 小さな画像でもタイルを並列にデコードさせ、逐次デコードへのフォールバックは失敗にする
+    monkeypatch.setattr(jxr_image, "PARALLEL_MIN_MBS", 1)
+
+    def no_sequential_fallback(self):
+        raise AssertionError("tiles were decoded sequentially")
+
+    monkeypatch.setattr(jxr_image.JXRImage, "coded_tiles", no_sequential_fallback)
+
+    for tile_workers in [2, 3, 6]:
+        parallel_image, parallel = decode_coefficients(tile_workers)
+        assert parallel_image.parallel_tiles_possible()
+        assert parallel == sequential
+        assert parallel_image.ds.offset == sequential_image.ds.offset
+
+
+def test_parallel_tiles_image(monkeypatch):
+    with open(TILED_ALPHA_JXR, "rb") as f:
+        data = f.read()
+
+    sequential = JXRContainer(data).unpack_image()
+    monkeypatch.setattr(jxr_image, "PARALLEL_MIN_MBS", 1)
+    parallel = JXRContainer(data).unpack_image(tile_workers=3)
+
+    assert sequential.mode == parallel.mode == "RGBA"
+    assert parallel.tobytes() == sequential.tobytes()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import zipfile
+
+import kfxdedrm
+import scriptinterface
+from kfxlib.yj_book import YJ_Book
+
+from drmion import drmion, Voucher
+from kfxbook import build_book
+
+VOUCHER = Voucher()
+
+
+def write_kfx_zip(path):
+    # book.kfx は暗号化し、book.res と画像は平文のまま入れる
+    book = build_book(npages=4, resource_container=True)
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr(zipfile.ZipInfo("book.kfx"), drmion(VOUCHER, book["book.kfx"], page_size=1000),
+                    compress_type=zipfile.ZIP_DEFLATED)
+        zf.writestr("book.res", book["book.res"])
+        zf.writestr(zipfile.ZipInfo("extra.bin"), os.urandom(5000), compress_type=zipfile.ZIP_DEFLATED)
+    return book
+
+
+def use_test_voucher(monkeypatch):
+    monkeypatch.setattr(kfxdedrm.KFXZipBook, "decrypt_voucher", lambda self, pids: setattr(self, "voucher", VOUCHER))
+
+
+def cbz_members(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        return [(name, zf.read(name)) for name in zf.namelist()]
+
+
+def test_iter_files_matches_get_file(monkeypatch, tmp_path):
+    use_test_voucher(monkeypatch)
+    infile = str(tmp_path / "in.kfx-zip")
+    book = write_kfx_zip(infile)
+
+    kfx_zip = kfxdedrm.KFXZipBook(infile)
+    kfx_zip.processBook([])
+    assert kfx_zip.encrypted == ["book.kfx"]
+
+    files = list(kfx_zip.iterFiles())
+    assert [name for name, data in files] == ["book.kfx", "book.res", "extra.bin"]
+    assert dict(files)["book.kfx"] == book["book.kfx"]
+    assert dict(files)["book.res"] == book["book.res"]
+
+    outfile = str(tmp_path / "out.kfx-zip")
+    kfx_zip.getFile(outfile)
+    with zipfile.ZipFile(outfile) as zf:
+        assert [(info.filename, zf.read(info)) for info in zf.infolist()] == files
+
+
+def test_decrypted_files_convert_without_kfx_zip(monkeypatch, tmp_path):
+    use_test_voucher(monkeypatch)
+    book_dir = tmp_path / "book"
+    book_dir.mkdir()
+    infile = str(book_dir / "in.kfx-zip")
+    book = write_kfx_zip(infile)
+    rscpath = tmp_path / "keys"
+    rscpath.mkdir()
+
+    # _nodrm.kfx-zip を書き出さず、復号したメンバーから直接変換する
+    files = scriptinterface.decryptk4mobifiles(infile, str(rscpath))
+    assert os.listdir(str(book_dir)) == ["in.kfx-zip"]
+    cbz_direct = YJ_Book(infile, files=files).convert_to_cbz()
+
+    plain_dir = tmp_path / "plain"
+    plain_dir.mkdir()
+    for name, data in book.items():
+        (plain_dir / name).write_bytes(data)
+    assert cbz_members(cbz_direct) == cbz_members(YJ_Book(str(plain_dir)).convert_to_cbz())
+
+
+def test_decrypt_failure_returns_none(monkeypatch, tmp_path):
+    monkeypatch.setattr(kfxdedrm.KFXZipBook, "decrypt_voucher", lambda self, pids: setattr(self, "voucher", Voucher()))
+    infile = str(tmp_path / "in.kfx-zip")
+    write_kfx_zip(infile)
+    rscpath = tmp_path / "keys"
+    rscpath.mkdir()
+
+    assert scriptinterface.decryptk4mobifiles(infile, str(rscpath)) is None
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import random
+
+import alfcrypto
+import mobidedrm
+
+
+def reference_pc1(key, src, decryption=True):
+    # 展開前の PC1 実装 (mobidedrm 1.1 / alfcrypto)
+    sum1 = 0
+    sum2 = 0
+    keyXorVal = 0
+    wkey = []
+    for i in range(8):
+        wkey.append(key[i*2]<<8 | key[i*2+1])
+    dst = bytearray(len(src))
+    for i in range(len(src)):
+        temp1 = 0
+        byteXorVal = 0
+        for j in range(8):
+            temp1 ^= wkey[j]
+            sum2  = (sum2+j)*20021 + sum1
+            sum1  = (temp1*346)&0xFFFF
+            sum2  = (sum2+sum1)&0xFFFF
+            temp1 = (temp1*20021+1)&0xFFFF
+            byteXorVal ^= temp1 ^ sum2
+        curByte = src[i]
+        if not decryption:
+            keyXorVal = curByte * 257
+        curByte = ((curByte ^ (byteXorVal >> 8)) ^ byteXorVal) & 0xFF
+        if decryption:
+            keyXorVal = curByte * 257
+        for j in range(8):
+            wkey[j] ^= keyXorVal
+        dst[i] = curByte
+    return bytes(dst)
+
+
+def random_records(rng, count, max_size):
+    return [rng.randbytes(rng.randint(0, max_size)) for i in range(count)]
+
+
+def test_pc1_matches_reference():
+    rng = random.Random(27)
+    cipher = alfcrypto.Pukall_Cipher()
+    for i in range(50):
+        key = rng.randbytes(16)
+        data = rng.randbytes(rng.randint(0, 600))
+        for decryption in (True, False):
+            assert cipher.PC1(key, data, decryption) == reference_pc1(key, data, decryption)
+
+
+def test_pc1_round_trip():
+    rng = random.Random(28)
+    cipher = alfcrypto.Pukall_Cipher()
+    key = rng.randbytes(16)
+    data = rng.randbytes(4096)
+    assert cipher.PC1(key, cipher.PC1(key, data, False), True) == data
+
+
+def test_decrypt_records_single_core():
+    rng = random.Random(29)
+    key = rng.randbytes(16)
+    records = random_records(rng, 40, 512)
+    expected = [reference_pc1(key, data) for data in records]
+    assert mobidedrm.decryptRecords(key, records, workers=1) == expected
+
+
+def test_decrypt_records_pooled(monkeypatch):
+    # 小さなデータでもプロセスプールを使わせる
+    monkeypatch.setattr(mobidedrm, "PARALLEL_MIN_BYTES", 1)
+    monkeypatch.setattr(mobidedrm, "PARALLEL_CHUNK_BYTES", 1024)
+
+    rng = random.Random(30)
+    key = rng.randbytes(16)
+    records = random_records(rng, 60, 700)
+    expected = [reference_pc1(key, data) for data in records]
+    assert mobidedrm.decryptRecords(key, records, workers=1) == expected
+    assert mobidedrm.decryptRecords(key, records, workers=4) == expected
+    assert list(mobidedrm.iterDecryptRecords(key, [memoryview(data) for data in records], workers=4)) == expected
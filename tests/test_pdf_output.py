@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import io
+import zlib
+
+import pytest
+from PIL import Image
+
+from kfxlib.pdf_output import PdfOutput, PdfPageImage
+
+
+def png_data(img):
+    data = io.BytesIO()
+    img.save(data, "PNG")
+    return data.getvalue()
+
+
+def test_16_bit_gray_is_scaled():
+    img = Image.new("I;16", (4, 1))
+    for x, value in enumerate([0, 255, 40000, 65535]):
+        img.putpixel((x, 0), value)
+
+    page_image = PdfPageImage(png_data(img))
+
+    # 8 ビットへ切り詰めず上位バイトを使う
+    assert page_image.color_space == "/DeviceGray"
+    assert page_image.bits == 8
+    assert page_image.filter == "/FlateDecode"
+    assert zlib.decompress(page_image.data) == bytes([0, 0, 156, 255])
+
+
+def test_8_bit_gray_unchanged():
+    img = Image.new("L", (3, 1))
+    for x, value in enumerate([0, 100, 255]):
+        img.putpixel((x, 0), value)
+
+    page_image = PdfPageImage(png_data(img))
+    assert zlib.decompress(page_image.data) == bytes([0, 100, 255])
+
+
+class OutlineEntry(object):
+    def __init__(self, title, page_num, children=()):
+        self.title = title
+        self.page_num = page_num
+        self.children = list(children)
+
+
+def jpeg_data(img):
+    data = io.BytesIO()
+    img.save(data, "JPEG", quality=95)
+    return data.getvalue()
+
+
+def test_pdf_parses_strictly():
+    pypdf = pytest.importorskip("pypdf")
+
+    rgba = Image.new("RGBA", (40, 30), (200, 10, 10, 255))
+    rgba.paste((10, 200, 10, 0), (0, 0, 20, 30))
+    bilevel = Image.new("1", (33, 20), 1)
+    bilevel.paste(0, (0, 0, 10, 20))
+    pages = [
+        (png_data(rgba), "RGBA"),
+        (png_data(bilevel), "1"),
+        (jpeg_data(Image.new("CMYK", (24, 16), (10, 20, 30, 40))), "CMYK"),
+        (jpeg_data(Image.new("L", (16, 24), 128)), "L"),
+        (jpeg_data(Image.new("RGB", (50, 20), (0, 0, 255))), "RGB"),
+        (png_data(Image.new("L", (8, 8), 7)), "L"),
+        ]
+
+    pdf_file = io.BytesIO()
+    pdf_output = PdfOutput(pdf_file)
+    for data, mode in pages:
+        pdf_output.add_image_page(PdfPageImage(data))
+
+    metadata = {"/Title": "表紙 (1) \\ test", "/Author": "A & B", "/CreationDate": "D:20260101120000"}
+    outline = [
+        OutlineEntry("Cover", 0),
+        OutlineEntry("第1章", 1, [OutlineEntry("1.1", 2), OutlineEntry("1.2", 3, [OutlineEntry("1.2.1", 4)])]),
+        OutlineEntry("Missing", 99),
+        OutlineEntry("Last", 5),
+        ]
+    pdf_output.finish(metadata, True, outline)
+    pdf_data = pdf_file.getvalue()
+
+    reader = pypdf.PdfReader(io.BytesIO(pdf_data), strict=True)
+
+    # 相互参照表の各オフセットがそのオブジェクトの先頭を指すこと
+    xref_offset = int(pdf_data.rsplit(b"startxref\n", 1)[1].split(b"\n")[0])
+    xref_entries = pdf_data[xref_offset:].split(b"\n")[2:reader.trailer["/Size"] + 2]
+    for obj_num, entry in enumerate(xref_entries[1:], start=1):
+        offset = int(entry[:10])
+        assert pdf_data[offset:].startswith(b"%d 0 obj\n" % obj_num)
+
+    assert reader.metadata.title == metadata["/Title"]
+    assert reader.metadata.author == metadata["/Author"]
+    assert reader.trailer["/Root"]["/ViewerPreferences"]["/Direction"] == "/R2L"
+
+    assert len(reader.pages) == len(pages)
+    for page, (data, mode) in zip(reader.pages, pages):
+        width, height = Image.open(io.BytesIO(data)).size
+        assert [float(v) for v in page.mediabox] == [0, 0, width, height]
+
+        image = page.images[0].image
+        assert image.size == (width, height)
+        assert image.mode == mode
+
+        if mode in ["RGBA", "1"]:
+            assert image.tobytes() == Image.open(io.BytesIO(data)).tobytes()
+
+    def titles(items):
+        result = []
+        for item in items:
+            if isinstance(item, list):
+                result.append(titles(item))
+            else:
+                result.append((item.title, reader.get_destination_page_number(item) if "/Page" in item else None))
+        return result
+
+    assert titles(reader.outline) == [
+        ("Cover", 0), ("第1章", 1), [("1.1", 2), ("1.2", 3), [("1.2.1", 4)]], ("Missing", None), ("Last", 5)]
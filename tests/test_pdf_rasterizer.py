@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import zipfile
+
+import pytest
+from PIL import Image
+
+import kfxlib.yj_to_image_book as yj_to_image_book
+from kfxlib.resources import PdfImageResource, PdfPageRasterizer
+
+PDF_DATA = b"%PDF-1.4 stand-in"
+
+
+class StandInRasterizer(object):
+    # pdftoppm の代わりに、ページ番号を幅に持つ JPEG をページごとに書き出す
+    def __init__(self, extra_files=0):
+        self.calls = []
+        self.extra_files = extra_files
+
+    def __call__(self, pdf_file, jpeg_dir, first, last, dpi):
+        with open(pdf_file, "rb") as f:
+            assert f.read() == PDF_DATA
+
+        self.calls.append((pdf_file, first, last))
+        for page_num in range(first, last + 1 + self.extra_files):
+            Image.new("L", (page_num, 8)).save(os.path.join(jpeg_dir, "page-%d.jpg" % page_num), "JPEG")
+
+
+def page_widths(jpeg_datas):
+    return [Image.open(io.BytesIO(jpeg_data)).width for jpeg_data in jpeg_datas]
+
+
+def test_render_pages_in_order():
+    rasterizer = StandInRasterizer()
+    pdf_rasterizer = PdfPageRasterizer(PDF_DATA, rasterizer=rasterizer)
+
+    assert page_widths(pdf_rasterizer.render([1, 2, 3, 9, 10, 11, 12])) == [1, 2, 3, 9, 10, 11, 12]
+    assert page_widths(pdf_rasterizer.render([5])) == [5]
+    assert [(first, last) for pdf_file, first, last in rasterizer.calls] == [(1, 3), (9, 12), (5, 5)]
+
+    # 一時ファイルは一度だけ書き出され、元の PDF データは保持されない
+    pdf_files = set(pdf_file for pdf_file, first, last in rasterizer.calls)
+    assert len(pdf_files) == 1
+    assert pdf_rasterizer.pdf_data is None
+
+    pdf_file = pdf_files.pop()
+    assert os.path.isfile(pdf_file)
+    pdf_rasterizer.close()
+    assert not os.path.exists(pdf_file)
+
+
+def test_render_wrong_file_count():
+    with PdfPageRasterizer(PDF_DATA, rasterizer=StandInRasterizer(extra_files=1)) as pdf_rasterizer:
+        with pytest.raises(Exception, match="created 3 files for 2 pages"):
+            list(pdf_rasterizer.render([4, 5]))
+
+
+def test_cbz_batches_count_pages(monkeypatch):
+    rasterizer = StandInRasterizer()
+    monkeypatch.setattr(yj_to_image_book, "PDF_BATCH_PAGES", 4)
+    monkeypatch.setattr(yj_to_image_book, "PdfPageRasterizer",
+                        lambda pdf_data: PdfPageRasterizer(pdf_data, rasterizer=rasterizer))
+
+    # 複数ページをまとめたリソースでも、1 回のラスタライズは PDF_BATCH_PAGES ページまで
+    ordered_images = []
+    for page_nums in [[1, 2, 3], [4, 5, 6], [7], [8, 9, 10, 11, 12]]:
+        image_resource = PdfImageResource("doc.pdf", PDF_DATA, page_nums[0] - 1, 12)
+        image_resource.page_nums = page_nums
+        ordered_images.append(image_resource)
+
+    cbz_data = yj_to_image_book.combine_images_into_cbz(ordered_images)
+
+    assert [(first, last) for pdf_file, first, last in rasterizer.calls] == [(1, 3), (4, 7), (8, 12)]
+    with zipfile.ZipFile(io.BytesIO(cbz_data)) as zf:
+        names = zf.namelist()
+        assert names == ["%04d.jpg" % page_num for page_num in range(1, 13)]
+        assert page_widths(zf.read(name) for name in names) == list(range(1, 13))
+
+    assert not os.path.exists(rasterizer.calls[0][0])
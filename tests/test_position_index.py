@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import random
+
+from kfxlib.yj_position_location import ContentChunk, PositionIndex
+
+
+def reference_pid_for_eid(eid, eid_offset, pos_info):
+    # 索引導入前の線形探索（探索開始位置は先頭）
+    for pi in pos_info:
+        if pi.eid == eid and eid_offset >= pi.eid_offset and eid_offset <= pi.eid_offset + pi.length:
+            return pi.pid + eid_offset - pi.eid_offset
+
+    return None
+
+
+def reference_page_for_pid(pid, page_pids):
+    page_num = 0
+    for ordered_page_num, ordered_page_pid in enumerate(page_pids):
+        page_num = ordered_page_num
+        if pid <= ordered_page_pid:
+            break
+
+    return page_num
+
+
+def test_chunk_boundaries():
+    pos_info = [ContentChunk(100, "a", 0, 10), ContentChunk(110, "a", 10, 5), ContentChunk(200, "b", 0, 0)]
+    index = PositionIndex(pos_info)
+
+    # 先頭と末尾の両端を含む。境界では先に始まるチャンクではなく、そこから始まるチャンクを使う
+    assert index.pid_for_eid("a", 0) == 100
+    assert index.pid_for_eid("a", 9) == 109
+    assert index.pid_for_eid("a", 10) == 110
+    assert index.pid_for_eid("a", 15) == 115
+    assert index.pid_for_eid("a", 16) is None
+    assert index.pid_for_eid("b", 0) == 200
+    assert index.pid_for_eid("b", 1) is None
+    assert index.pid_for_eid("c", 0) is None
+
+
+def test_offset_before_first_chunk():
+    index = PositionIndex([ContentChunk(50, "a", 5, 10), ContentChunk(70, "a", 20, 3)])
+
+    assert index.pid_for_eid("a", 4) is None
+    assert index.pid_for_eid("a", 0) is None
+    assert index.pid_for_eid("a", 5) == 50
+    assert index.pid_for_eid("a", 17) is None
+    assert index.pid_for_eid("a", 21) == 71
+
+
+def test_overlapping_chunks():
+    # 直前に始まるチャンクが届かなければ、それより前に始まる長いチャンクを使う
+    pos_info = [ContentChunk(0, "a", 0, 100), ContentChunk(500, "a", 10, 5), ContentChunk(600, "a", 10, 2)]
+    index = PositionIndex(pos_info)
+
+    assert index.pid_for_eid("a", 5) == 5
+    assert index.pid_for_eid("a", 11) == 501
+    assert index.pid_for_eid("a", 14) == 504
+    assert index.pid_for_eid("a", 50) == 50
+    assert index.pid_for_eid("a", 100) == 100
+    assert index.pid_for_eid("a", 101) is None
+
+
+def test_empty_position_info():
+    index = PositionIndex([])
+    assert index.pid_for_eid("a", 0) is None
+
+
+def test_matches_linear_search():
+    rng = random.Random(48)
+    pos_info = []
+    pid = 0
+    for i in range(300):
+        eid = rng.choice(["a", "b", "c", 1001, 1002])
+        length = rng.choice([0, 1, 5, 20])
+        eid_offset = rng.randrange(0, 200)
+        pos_info.append(ContentChunk(pid, eid, eid_offset, length))
+        pid += length + 1
+
+    rng.shuffle(pos_info)
+
+    # 重なりのないチャンクだけを残す
+    covered = set()
+    chunks = []
+    for chunk in pos_info:
+        offsets = set((chunk.eid, offset) for offset in range(chunk.eid_offset, chunk.eid_offset + chunk.length + 1))
+        if not (offsets & covered):
+            covered |= offsets
+            chunks.append(chunk)
+
+    index = PositionIndex(chunks)
+    for eid in ["a", "b", "c", "d", 1001, 1002]:
+        for eid_offset in range(-1, 230):
+            assert index.pid_for_eid(eid, eid_offset) == reference_pid_for_eid(eid, eid_offset, chunks)
+
+
+def test_page_for_pid():
+    page_pids = [10, 20, 20, 35]
+
+    for pid in range(0, 50):
+        assert PositionIndex.page_for_pid(pid, page_pids) == reference_page_for_pid(pid, page_pids)
+
+    assert PositionIndex.page_for_pid(10, page_pids) == 0
+    assert PositionIndex.page_for_pid(11, page_pids) == 1
+    assert PositionIndex.page_for_pid(20, page_pids) == 1
+    assert PositionIndex.page_for_pid(36, page_pids) == 3
+
+
+def test_page_for_pid_without_pages():
+    assert PositionIndex.page_for_pid(5, []) == reference_page_for_pid(5, []) == 0
+    assert PositionIndex.page_for_pid(5, [7]) == PositionIndex.page_for_pid(9, [7]) == 0